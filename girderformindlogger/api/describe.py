@@ -562,40 +562,46 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
         """
         super(autoDescribeRoute, self).__init__(description=description)
         self.hide = hide
+        self._compiled = None
 
-    def _passArg(self, fun, kwargs, name, val):
+    def _argSetter(self, name):
         """
-        This helper passes the arguments to the underlying function if the function
-        has an argument with the given name. Otherwise, it adds it into the "params"
-        argument, which is a dictionary containing other parameters.
+        Build the function that passes an argument to the underlying function if the function
+        has an argument with the given name, or otherwise adds it into the "params" argument,
+        which is a dictionary containing other parameters.
 
-        :param fun: The wrapped route handler function
-        :type fun: callable
         :param name: The name of the argument to set
         :type name: str
-        :param kwargs: The arguments to be passed down to the function.
-        :type kwargs: dict
-        :param val: The value of the argument to set
+        :returns: A function of the arguments to be passed down to the function (a dict) and
+            the value of the argument.
         """
         if name in self._funNamedArgs or self._funHasKwargs:
-            kwargs[name] = val
-            kwargs['params'].pop(name, None)
+            def setArg(kwargs, val):
+                kwargs[name] = val
+                kwargs['params'].pop(name, None)
         else:
-            kwargs['params'][name] = val
+            def setArg(kwargs, val):
+                kwargs['params'][name] = val
+        return setArg
 
-    def _mungeKwargs(self, kwargs, fun):
+    def _compileMungeKwargs(self):
         """
-        Performs final modifications to the kwargs passed into the wrapped function.
-        Combines the sort/sortdir params appropriately for consumption by the model
-        layer, and only passes the "params" catch-all dict if there is a corresponding
+        Build the function that performs final modifications to the kwargs passed into the
+        wrapped function. It combines the sort/sortdir params appropriately for consumption by
+        the model layer, and only passes the "params" catch-all dict if there is a corresponding
         kwarg for it in the wrapped function.
         """
-        if self.description.hasPagingParams and 'sort' in kwargs:
-            sortdir = kwargs.pop('sortdir', None) or kwargs['params'].pop('sortdir', None)
-            kwargs['sort'] = [(kwargs['sort'], sortdir)]
+        combineSort = self.description.hasPagingParams
+        dropParams = 'params' not in self._funNamedArgs and not self._funHasKwargs
 
-        if 'params' not in self._funNamedArgs and not self._funHasKwargs:
-            kwargs.pop('params', None)
+        def mungeKwargs(kwargs):
+            if combineSort and 'sort' in kwargs:
+                sortdir = kwargs.pop('sortdir', None) or kwargs['params'].pop('sortdir', None)
+                kwargs['sort'] = [(kwargs['sort'], sortdir)]
+
+            if dropParams:
+                kwargs.pop('params', None)
+        return mungeKwargs
 
     def _inspectFunSignature(self, fun):
         self._funNamedArgs = set()
@@ -620,6 +626,25 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
 
         return destName
 
+    def _compile(self):
+        """
+        Work out everything about the parameters that doesn't depend on the
+        request into a list of steps that each handle one parameter. This is
+        done on the route's first request rather than when it is declared,
+        since plugins may add parameters to its Description when they load,
+        and again whenever parameters are added.
+
+        :returns: The number of parameters compiled, the steps, and the
+            function that performs final modifications to the kwargs.
+        """
+        params = self.description.params
+        self._compiled = (len(params), [
+            step for step in (
+                self._compileParam(descParam) for descParam in params
+            ) if step is not None
+        ], self._compileMungeKwargs())
+        return self._compiled
+
     def __call__(self, fun):
         self._inspectFunSignature(fun)
 
@@ -629,56 +654,22 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
             Transform any passed params according to the spec, or
             fill in default values for any params not passed.
             """
+            compiled = self._compiled
+            # Parameters are only ever appended to a Description.
+            if compiled is None or compiled[0] != len(self.description.params):
+                compiled = self._compile()
+            _, steps, mungeKwargs = compiled
+
             # Combine path params with form/query params into a single lookup table
             params = {k: v for k, v in six.viewitems(kwargs) if k != 'params'}
             params.update(kwargs.get('params', {}))
 
             kwargs['params'] = kwargs.get('params', {})
 
-            for descParam in self.description.params:
-                # We need either a type or a schema ( for message body )
-                if 'type' not in descParam and 'schema' not in descParam:
-                    continue
-
-                name = descParam['name']
-                model = self._getModel(name, self.description.modelParams)
-                if name in params:
-                    if name in self.description.jsonParams:
-                        info = self.description.jsonParams[name]
-                        val = self._loadJson(name, info, params[name])
-                        self._passArg(fun, kwargs, name, val)
-                    elif name in self.description.modelParams:
-                        info = self.description.modelParams[name]
-                        kwargs.pop(name, None)  # Remove from path params
-                        val = self._loadModel(name, info, params[name], model)
-                        self._passArg(fun, kwargs, self._destName(info, model), val)
-                    else:
-                        val = self._validateParam(name, descParam, params[name])
-                        self._passArg(fun, kwargs, name, val)
-                elif descParam['in'] == 'body':
-                    if name in self.description.jsonParams:
-                        info = self.description.jsonParams[name].copy()
-                        info['required'] = descParam['required']
-                        val = self._loadJsonBody(name, info)
-                        self._passArg(fun, kwargs, name, val)
-                    else:
-                        self._passArg(fun, kwargs, name, cherrypy.request.body)
-                elif descParam['in'] == 'header':
-                    continue  # For now, do nothing with header params
-                elif 'default' in descParam:
-                    self._passArg(fun, kwargs, name, descParam['default'])
-                elif descParam['required']:
-                    raise RestException('Parameter "%s" is required.' % name)
-                else:
-                    # If required=False but no default is specified, use None
-                    if name in self.description.modelParams:
-                        info = self.description.modelParams[name]
-                        kwargs.pop(name, None)  # Remove from path params
-                        self._passArg(fun, kwargs, info['destName'] or model.name, None)
-                    else:
-                        self._passArg(fun, kwargs, name, None)
+            for step in steps:
+                step(params, kwargs)
 
-            self._mungeKwargs(kwargs, fun)
+            mungeKwargs(kwargs)
 
             return fun(*args, **kwargs)
 
@@ -688,123 +679,301 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
             wrapped.description = self.description
         return wrapped
 
-    def _validateJsonType(self, name, info, val):
-        if info.get('schema') is not None:
-            try:
-                jsonschema.validate(val, info['schema'])
-            except jsonschema.ValidationError as e:
-                raise RestException('Invalid JSON object for parameter %s: %s' % (
-                    name, str(e)))
-        elif info['requireObject'] and not isinstance(val, dict):
-            raise RestException('Parameter %s must be a JSON object.' % name)
-        elif info['requireArray'] and not isinstance(val, list):
-            raise RestException('Parameter %s must be a JSON array.' % name)
-
-    def _loadJsonBody(self, name, info):
-        val = None
-        if cherrypy.request.body.length == 0 and info['required']:
-            raise RestException('JSON parameter %s must be passed in request body.' % name)
-        elif cherrypy.request.body.length > 0:
-            val = getBodyJson()
-            self._validateJsonType(name, info, val)
-
-        return val
-
-    def _loadJson(self, name, info, value):
-        try:
-            val = bson.json_util.loads(value)
-        except ValueError:
-            raise RestException('Parameter %s must be valid JSON.' % name)
-
-        self._validateJsonType(name, info, val)
-
-        return val
-
-    def _getModel(self, name, modelParams):
-        if name not in self.description.modelParams:
-            return
-        info = self.description.modelParams[name]
+    def _compileParam(self, descParam):
+        """
+        Build the step that transforms a parameter according to the spec, or
+        fills in its default value if it wasn't passed.
 
-        if info['isModelClass']:
-            return info['model']()
+        :param descParam: The formal parameter in the Description.
+        :type descParam: dict
+        :returns: A function of the request's params and of the kwargs to be
+            passed to the wrapped function, or None if the parameter needs no
+            handling.
+        """
+        # We need either a type or a schema ( for message body )
+        if 'type' not in descParam and 'schema' not in descParam:
+            return None
+
+        name = descParam['name']
+        if name in self.description.modelParams:
+            return self._compileModelParam(descParam)
+
+        jsonInfo = self.description.jsonParams.get(name)
+        toKwargs = name in self._funNamedArgs or self._funHasKwargs
+        if jsonInfo is not None:
+            convert = self._compileJsonLoader(name, jsonInfo)
+        else:
+            convert = self._compileConverter(name, descParam)
+
+        hasDefault = False
+        default = None
+        missing = None
+        if descParam['in'] == 'body':
+            if jsonInfo is not None:
+                missing = self._compileJsonBodyLoader(
+                    name, dict(jsonInfo, required=descParam['required']))
+            else:
+                def missing():
+                    return cherrypy.request.body
+        elif descParam['in'] == 'header':
+            pass  # For now, do nothing with header params
+        elif 'default' in descParam:
+            hasDefault = True
+            default = descParam['default']
+        elif descParam['required']:
+            message = 'Parameter "%s" is required.' % name
+
+            def missing():
+                raise RestException(message)
         else:
-            return ModelImporter.model(info['model'], info['plugin'])
+            # If required=False but no default is specified, use None
+            hasDefault = True
+
+        def step(params, kwargs):
+            if name in params:
+                val = convert(params[name])
+            elif hasDefault:
+                val = default
+            elif missing is None:
+                return
+            else:
+                val = missing()
 
-    def _loadModel(self, name, info, id, model):
-        if info['force']:
-            doc = model.load(id, force=True, **info['kwargs'])
-        elif info['level'] is not None:
-            doc = model.load(id=id, level=info['level'], user=getCurrentUser(), **info['kwargs'])
+            if toKwargs:
+                kwargs[name] = val
+                kwargs['params'].pop(name, None)
+            else:
+                kwargs['params'][name] = val
+        return step
+
+    def _compileModelParam(self, descParam):
+        name = descParam['name']
+        info = self.description.modelParams[name]
+        getModel = self._modelGetter(info)
+        loadModel = self._compileModelLoader(info, getModel)
+        setters = {}
+
+        def setArg(kwargs, dest, val):
+            # The destination may be named after the model, which is only
+            # looked up once a request needs it.
+            if dest not in setters:
+                if dest == 'loaded':
+                    argName = self._destName(info, getModel())
+                elif dest == 'none':
+                    argName = info['destName'] or getModel().name
+                else:
+                    argName = name
+                setters[dest] = self._argSetter(argName)
+            setters[dest](kwargs, val)
+
+        if descParam['in'] == 'body':
+            def missing(kwargs):
+                setArg(kwargs, 'body', cherrypy.request.body)
+        elif descParam['in'] == 'header':
+            def missing(kwargs):
+                pass  # For now, do nothing with header params
+        elif 'default' in descParam:
+            default = descParam['default']
+
+            def missing(kwargs):
+                setArg(kwargs, 'default', default)
+        elif descParam['required']:
+            message = 'Parameter "%s" is required.' % name
+
+            def missing(kwargs):
+                raise RestException(message)
         else:
-            doc = model.load(id, **info['kwargs'])
+            # If required=False but no default is specified, use None
+            def missing(kwargs):
+                kwargs.pop(name, None)  # Remove from path params
+                setArg(kwargs, 'none', None)
+
+        def step(params, kwargs):
+            if name in params:
+                kwargs.pop(name, None)  # Remove from path params
+                setArg(kwargs, 'loaded', loadModel(params[name]))
+            else:
+                missing(kwargs)
+        return step
+
+    def _compileJsonValidator(self, name, info):
+        schema = info.get('schema')
+        if schema is not None:
+            # As jsonschema.validate does, but checking the schema only once.
+            cls = jsonschema.validators.validator_for(schema)
+            cls.check_schema(schema)
+            validator = cls(schema)
+
+            def validate(val):
+                error = jsonschema.exceptions.best_match(validator.iter_errors(val))
+                if error is not None:
+                    raise RestException('Invalid JSON object for parameter %s: %s' % (
+                        name, str(error)))
+        elif info['requireObject']:
+            def validate(val):
+                if not isinstance(val, dict):
+                    raise RestException('Parameter %s must be a JSON object.' % name)
+        elif info['requireArray']:
+            def validate(val):
+                if not isinstance(val, list):
+                    raise RestException('Parameter %s must be a JSON array.' % name)
+        else:
+            def validate(val):
+                pass
+        return validate
 
-        if doc is None and info['exc']:
-            raise RestException('Invalid %s id (%s).' % (model.name, str(id)))
+    def _compileJsonBodyLoader(self, name, info):
+        validate = self._compileJsonValidator(name, info)
+        required = info['required']
 
-        if info['requiredFlags']:
-            model.requireAccessFlags(doc, user=getCurrentUser(), flags=info['requiredFlags'])
+        def loadJsonBody():
+            val = None
+            if cherrypy.request.body.length == 0 and required:
+                raise RestException('JSON parameter %s must be passed in request body.' % name)
+            elif cherrypy.request.body.length > 0:
+                val = getBodyJson()
+                validate(val)
 
-        return doc
+            return val
+        return loadJsonBody
 
-    def _handleString(self, name, descParam, value):
-        if descParam['_strip']:
-            value = value.strip()
-        if descParam['_lower']:
-            value = value.lower()
-        if descParam['_upper']:
-            value = value.upper()
+    def _compileJsonLoader(self, name, info):
+        validate = self._compileJsonValidator(name, info)
 
-        format = descParam.get('format')
-        if format in ('date', 'date-time'):
+        def loadJson(value):
             try:
-                value = dateutil.parser.parse(value)
+                val = bson.json_util.loads(value)
             except ValueError:
-                raise RestException('Invalid date format for parameter %s: %s.' % (name, value))
+                raise RestException('Parameter %s must be valid JSON.' % name)
+
+            validate(val)
+
+            return val
+        return loadJson
+
+    def _modelGetter(self, info):
+        """
+        Build the function that returns the model of a model param. The model
+        is looked up when first needed, as plugin models may be registered
+        after the routes using them are declared, and then kept, as models are
+        singletons.
+        """
+        model = []
+
+        def getModel():
+            if not model:
+                if info['isModelClass']:
+                    model.append(info['model']())
+                else:
+                    model.append(ModelImporter.model(info['model'], info['plugin']))
+            return model[0]
+        return getModel
 
-            if format == 'date':
-                value = value.date()
+    def _compileModelLoader(self, info, getModel):
+        loadKwargs = info['kwargs']
+        level = info['level']
+        exc = info['exc']
+        requiredFlags = info['requiredFlags']
 
-        return value
+        if info['force']:
+            def load(model, id):
+                return model.load(id, force=True, **loadKwargs)
+        elif level is not None:
+            def load(model, id):
+                return model.load(id=id, level=level, user=getCurrentUser(), **loadKwargs)
+        else:
+            def load(model, id):
+                return model.load(id, **loadKwargs)
+
+        def loadModel(id):
+            model = getModel()
+            doc = load(model, id)
+
+            if doc is None and exc:
+                raise RestException('Invalid %s id (%s).' % (model.name, str(id)))
+
+            if requiredFlags:
+                model.requireAccessFlags(doc, user=getCurrentUser(), flags=requiredFlags)
 
-    def _handleInt(self, name, descParam, value):
-        try:
-            return int(value)
-        except ValueError:
-            raise RestException('Invalid value for integer parameter %s: %s.' % (name, value))
+            return doc
+        return loadModel
 
-    def _handleNumber(self, name, descParam, value):
-        try:
-            return float(value)
-        except ValueError:
-            raise RestException('Invalid value for numeric parameter %s: %s.' % (name, value))
+    def _compileStringConverter(self, name, descParam):
+        transforms = [transform for flag, transform in (
+            ('_strip', lambda value: value.strip()),
+            ('_lower', lambda value: value.lower()),
+            ('_upper', lambda value: value.upper())
+        ) if descParam[flag]]
 
-    def _validateParam(self, name, descParam, value):
+        format = descParam.get('format')
+        if format in ('date', 'date-time'):
+            def parseDate(value):
+                try:
+                    value = dateutil.parser.parse(value)
+                except ValueError:
+                    raise RestException(
+                        'Invalid date format for parameter %s: %s.' % (name, value))
+
+                if format == 'date':
+                    value = value.date()
+                return value
+            transforms.append(parseDate)
+
+        def convert(value):
+            for transform in transforms:
+                value = transform(value)
+            return value
+        return convert
+
+    def _compileConverter(self, name, descParam):
         """
-        Validates and transforms a single parameter that was passed. Raises
-        RestException if the passed value is invalid.
+        Build the function that validates and transforms a single parameter
+        that was passed, which raises RestException if the passed value is
+        invalid.
 
         :param name: The name of the param.
         :type name: str
         :param descParam: The formal parameter in the Description.
         :type descParam: dict
-        :param value: The value passed in for this param for the current request.
-        :returns: The value transformed
+        :returns: A function of the value passed in for this param, returning
+            the value transformed.
         """
         type = descParam.get('type')
 
         # Coerce to the correct data type
         if type == 'string':
-            value = self._handleString(name, descParam, value)
+            coerce = self._compileStringConverter(name, descParam)
         elif type == 'boolean':
-            value = toBool(value)
+            coerce = toBool
         elif type == 'integer':
-            value = self._handleInt(name, descParam, value)
+            def coerce(value):
+                try:
+                    return int(value)
+                except ValueError:
+                    raise RestException(
+                        'Invalid value for integer parameter %s: %s.' % (name, value))
         elif type == 'number':
-            value = self._handleNumber(name, descParam, value)
+            def coerce(value):
+                try:
+                    return float(value)
+                except ValueError:
+                    raise RestException(
+                        'Invalid value for numeric parameter %s: %s.' % (name, value))
+        else:
+            def coerce(value):
+                return value
 
-        # Enum validation (should be after type coercion)
-        if 'enum' in descParam and value not in descParam['enum']:
-            raise RestException('Invalid value for %s: "%s". Allowed values: %s.' % (
-                name, value, ', '.join(str(v) for v in descParam['enum'])))
+        if 'enum' not in descParam:
+            return coerce
 
-        return value
+        # Enum validation (should be after type coercion)
+        enum = descParam['enum']
+        allowed = ', '.join(str(v) for v in enum)
+
+        def convert(value):
+            value = coerce(value)
+            if value not in enum:
+                raise RestException('Invalid value for %s: "%s". Allowed values: %s.' % (
+                    name, value, allowed))
+            return value
+        return convert
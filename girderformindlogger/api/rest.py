@@ -4,6 +4,7 @@ import cherrypy
 import collections
 import datetime
 import inspect
+import itertools
 import json
 import posixpath
 import pymongo
@@ -26,7 +27,8 @@ from girderformindlogger.models.token import Token
 from girderformindlogger.models.user import User
 from girderformindlogger.settings import SettingKey
 from girderformindlogger.utility import toBool, config, JsonEncoder, optionalArgumentDecorator
-from girderformindlogger.utility._cache import requestCache
+from girderformindlogger.utility import compression, mongo_metrics
+from girderformindlogger.utility._cache import authCache, requestCache
 from girderformindlogger.utility.model_importer import ModelImporter
 from six.moves import range, urllib
 
@@ -35,6 +37,13 @@ READ_BUFFER_LEN = 65536
 
 _MONGO_CURSOR_TYPES = (MongoProxy, pymongo.cursor.Cursor, pymongo.command_cursor.CommandCursor)
 
+# Approximate size in bytes of the chunks of streamed JSON arrays
+JSON_STREAM_CHUNK_SIZE = 65536
+
+# The types a client may ask for in its Accept header to get JSON responses
+# as JSON, as newline-delimited JSON (for arrays only) or rendered as HTML
+_JSON_RESPONSE_TYPES = ('application/json', 'application/x-ndjson', 'text/html')
+
 
 def getUrlParts(url=None):
     """
@@ -162,7 +171,11 @@ def getCurrentToken(allowCookie=None):
     if not tokenStr:
         return None
 
-    return Token().load(tokenStr, force=True, objectId=False)
+    found, token = authCache.getToken(tokenStr)
+    if not found:
+        token = Token().load(tokenStr, force=True, objectId=False)
+        authCache.setToken(tokenStr, token)
+    return token
 
 
 def getCurrentUser(returnToken=False):
@@ -205,7 +218,12 @@ def getCurrentUser(returnToken=False):
         except AccessException:
             return retVal(None, token)
 
-        user = User().load(token['userId'], force=True)
+        # The user's applet cache is large and rarely needed; see
+        # User.loadCached.
+        user = authCache.getUser(token['_id'])
+        if user is None:
+            user = User().load(token['userId'], force=True, fields={'cached': False})
+            authCache.setUser(token['_id'], user)
         return retVal(user, token)
 
 
@@ -440,10 +458,11 @@ class filtermodel(object):  # noqa: class name
             user = getCurrentUser()
 
             if isinstance(val, _MONGO_CURSOR_TYPES):
-                if callable(getattr(val, 'count', None)):
-                    cherrypy.response.headers['Girder-Total-Count'] = val.count()
-                return [model.filter(m, user, self.addFields) for m in val]
-            elif isinstance(val, (list, tuple, types.GeneratorType)):
+                _setTotalCount(val)
+                return (model.filter(m, user, self.addFields) for m in val)
+            elif isinstance(val, types.GeneratorType):
+                return (model.filter(m, user, self.addFields) for m in val)
+            elif isinstance(val, (list, tuple)):
                 return [model.filter(m, user, self.addFields) for m in val]
             elif isinstance(val, dict):
                 return model.filter(val, user, self.addFields)
@@ -506,27 +525,196 @@ def _createResponse(val):
             return val.encode('utf8')
         return val
 
-    accepts = cherrypy.request.headers.elements('Accept')
-    for accept in accepts:
-        if accept.value == 'application/json':
-            break
-        elif accept.value == 'text/html':
-            # Pretty-print and HTML-ify the response for the browser
-            setResponseHeader('Content-Type', 'text/html')
-            resp = cgi.escape(json.dumps(
-                val, indent=4, sort_keys=True, allow_nan=False, separators=(',', ': '),
-                cls=JsonEncoder))
-            resp = resp.replace(' ', '&nbsp;').replace('\n', '<br />')
-            resp = '<div style="font-family:monospace;">%s</div>' % resp
-            return resp.encode('utf8')
-
-    # Default behavior will just be normal JSON output. Keep this
-    # outside of the loop body in case no Accept header is passed.
+    responseType = _acceptedResponseType()
+    if responseType == 'text/html':
+        # Pretty-print and HTML-ify the response for the browser
+        setResponseHeader('Content-Type', 'text/html')
+        resp = cgi.escape(json.dumps(
+            val, indent=4, sort_keys=True, allow_nan=False, separators=(',', ': '),
+            cls=JsonEncoder))
+        resp = resp.replace(' ', '&nbsp;').replace('\n', '<br />')
+        resp = '<div style="font-family:monospace;">%s</div>' % resp
+        return resp.encode('utf8')
+
+    if responseType == 'application/x-ndjson' and isinstance(val, (list, tuple)):
+        setResponseHeader('Content-Type', 'application/x-ndjson')
+        return b''.join(jsonArrayChunks(val, ndjson=True))
+
+    # Default behavior will just be normal JSON output.
     setResponseHeader('Content-Type', 'application/json')
+    return jsonResponseBody(val)
+
+
+def _acceptedResponseType():
+    """
+    The first of _JSON_RESPONSE_TYPES in the "Accept" header of the current
+    request, by preference, or "application/json" if it has none of them.
+    """
+    for accept in cherrypy.request.headers.elements('Accept'):
+        if accept.value in _JSON_RESPONSE_TYPES:
+            return accept.value
+    return 'application/json'
+
+
+def _acceptsHtml():
+    """
+    Whether the "Accept" header of the current request asks for HTML before
+    JSON, in which case JSON responses are rendered for a browser.
+    """
+    return _acceptedResponseType() == 'text/html'
+
+
+def jsonResponseBody(val):
+    """
+    Serialize a value as the body of a JSON response.
+
+    :rtype: bytes
+    """
     return json.dumps(val, sort_keys=True, allow_nan=False,
                       cls=JsonEncoder).encode('utf8')
 
 
+def jsonArrayChunks(items, ndjson=False):
+    """
+    Serialize the items of an array as the body of a JSON response, as they
+    are iterated, so that the whole array is never held in memory.
+
+    :param items: The items of the array.
+    :type items: iterable
+    :param ndjson: Serialize them as newline-delimited JSON rather than as a
+        JSON array.
+    :type ndjson: bool
+    :returns: A generator of the body in chunks of about
+        JSON_STREAM_CHUNK_SIZE bytes. Joined, they are the same as
+        jsonResponseBody of a list of the items.
+    """
+    encode = JsonEncoder(sort_keys=True, allow_nan=False).encode
+    chunk = []
+    size = 0
+    empty = True
+    for item in items:
+        text = encode(item)
+        if ndjson:
+            text += '\n'
+        else:
+            text = ('[' if empty else ', ') + text
+        empty = False
+        chunk.append(text)
+        size += len(text)
+        if size >= JSON_STREAM_CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf8')
+            chunk = []
+            size = 0
+    if not ndjson:
+        chunk.append('[]' if empty else ']')
+    if chunk:
+        yield ''.join(chunk).encode('utf8')
+
+
+def _jsonStream(val):
+    """
+    Prepare to send a Mongo cursor or a generator as a JSON array, or as
+    newline-delimited JSON if the client asks for it, streamed as it is
+    iterated. The first item is read right away, so that errors raised
+    before it (eg, access checks at the start of a generator) get their usual
+    error responses; errors raised after it end the response early.
+
+    :returns: A generator function for a streaming response.
+    """
+    if isinstance(val, _MONGO_CURSOR_TYPES):
+        _setTotalCount(val)
+    items = iter(val)
+    first = list(itertools.islice(items, 1))
+    ndjson = _acceptedResponseType() == 'application/x-ndjson'
+    setResponseHeader(
+        'Content-Type', 'application/x-ndjson' if ndjson else 'application/json')
+
+    def stream():
+        return jsonArrayChunks(itertools.chain(first, items), ndjson)
+    return stream
+
+
+def _responseEncoding():
+    """
+    Choose the encoding to compress the current response with, if its content
+    type is worth compressing and it isn't already encoded or partial.
+
+    :returns: One of compression.ENCODINGS, or None.
+    """
+    headers = cherrypy.response.headers
+    if not compression.isEnabled() or not compression.isCompressible(
+        headers.get('Content-Type')
+    ) or any(header in headers for header in (
+        'Content-Encoding', 'Content-Length', 'Content-Range'
+    )):
+        return None
+    _varyByEncoding()
+    return compression.acceptedEncoding(
+        cherrypy.request.headers.get('Accept-Encoding'))
+
+
+def _varyByEncoding():
+    vary = cherrypy.response.headers.get('Vary')
+    if not vary:
+        setResponseHeader('Vary', 'Accept-Encoding')
+    elif 'accept-encoding' not in vary.lower():
+        setResponseHeader('Vary', vary + ', Accept-Encoding')
+
+
+def _compressResponse(resp):
+    """
+    Compress a response body, if it is large enough and the client accepts
+    one of the supported encodings.
+    """
+    if not isinstance(resp, six.binary_type):
+        return resp
+    # Choose the encoding whatever the size, so that small responses vary by
+    # Accept-Encoding too and caches don't serve them for larger ones.
+    encoding = _responseEncoding()
+    if encoding is None or len(resp) < compression.minSize():
+        return resp
+    setResponseHeader('Content-Encoding', encoding)
+    return compression.compress(resp, encoding)
+
+
+def getJsonResponseEncoding():
+    """
+    For routes that send JSON they serialized themselves, eg, from a cache of
+    ready-to-send responses: get the encoding that the current request
+    accepts.
+
+    :returns: One of compression.ENCODINGS, compression.IDENTITY if the
+        response should not be compressed, or None if the client asked for
+        HTML rather than JSON.
+    """
+    if _acceptsHtml():
+        return None
+    if not compression.isEnabled():
+        return compression.IDENTITY
+    _varyByEncoding()
+    return compression.acceptedEncoding(
+        cherrypy.request.headers.get('Accept-Encoding')) or compression.IDENTITY
+
+
+def sendEncodedJson(data, encoding):
+    """
+    Send JSON that is already serialized, and possibly compressed, as the
+    response of the current request, without decoding or re-encoding it.
+
+    :param data: The JSON, as UTF-8 bytes or compressed.
+    :type data: bytes
+    :param encoding: Its encoding, as from getJsonResponseEncoding.
+    :type encoding: str
+    :returns: The response body, to return from the route handler.
+    """
+    setRawResponse()
+    setResponseHeader('Content-Type', 'application/json')
+    setResponseHeader('Content-Length', len(data))
+    if encoding != compression.IDENTITY:
+        setResponseHeader('Content-Encoding', encoding)
+    return data
+
+
 def _handleRestException(e):
     # Handle all user-error exceptions from the REST layer
     cherrypy.response.status = e.code
@@ -601,12 +789,16 @@ def _mongoCursorToList(val):
     # This needs to be before the callable check, as mongo cursors can
     # be callable.
     if isinstance(val, _MONGO_CURSOR_TYPES):
-        if callable(getattr(val, 'count', None)):
-            cherrypy.response.headers['Girder-Total-Count'] = val.count()
+        _setTotalCount(val)
         val = list(val)
     return val
 
 
+def _setTotalCount(cursor):
+    if callable(getattr(cursor, 'count', None)):
+        cherrypy.response.headers['Girder-Total-Count'] = cursor.count()
+
+
 def endpoint(fun):
     """
     REST HTTP method endpoints should use this decorator. It converts the return
@@ -633,6 +825,13 @@ def endpoint(fun):
             if 'Content-Range' in cherrypy.response.headers:
                 cherrypy.response.status = 206
 
+            if isinstance(val, _MONGO_CURSOR_TYPES + (types.GeneratorType,)) and not (
+                _acceptsHtml() or getattr(cherrypy.request, 'girderRawResponse', False)
+            ):
+                # Arrays from cursors and generators are streamed as they
+                # are read, rather than held in memory and sent at once.
+                val = _jsonStream(val)
+
             val = _mongoCursorToList(val)
 
             if callable(val):
@@ -640,7 +839,12 @@ def endpoint(fun):
                 # lambda, functools.partial), we assume it's a generator
                 # function for a streaming response.
                 cherrypy.response.stream = True
+                _recordDatabaseUse()
                 _logRestRequest(self, path, params)
+                encoding = _responseEncoding()
+                if encoding is not None:
+                    setResponseHeader('Content-Encoding', encoding)
+                    return compression.compressStream(val(), encoding)
                 return val()
 
             if isinstance(val, cherrypy.lib.file_generator):
@@ -675,13 +879,49 @@ def endpoint(fun):
                 val['message'] = '%s: %s' % (t.__name__, repr(value))
                 val['trace'] = traceback.extract_tb(tb)
 
-        resp = _createResponse(val)
+        _recordDatabaseUse()
+        resp = _compressResponse(_createResponse(val))
         _logRestRequest(self, path, params)
 
         return resp
     return endpointDecorator
 
 
+def _recordDatabaseUse():
+    """
+    Add the current request's database queries to the metrics of its route,
+    and report them in response headers in development mode. For streamed
+    responses, this only covers the queries made before streaming starts.
+
+    Outside of production mode, this also warns of queries repeated more than
+    ``[logging] repeated_query_threshold`` times, and triggers a
+    ``rest.queries`` event with the route, the request's stats and its
+    repeated queries, which tests use to enforce query budgets.
+    """
+    route = getattr(cherrypy.request, 'girderRoute', None)
+    if route is not None:
+        stats = mongo_metrics.finishRequest(route)
+    else:
+        stats = mongo_metrics.requestStats()
+    mode = config.getServerMode()
+    if mode == ServerMode.DEVELOPMENT:
+        setResponseHeader('X-Mongo-Queries', str(stats['queries']))
+        setResponseHeader('X-Mongo-Time', '%.1f' % stats['time'])
+    if mode != ServerMode.PRODUCTION:
+        repeated = mongo_metrics.repeatedQueries(
+            config.getConfig().get('logging', {}).get(
+                'repeated_query_threshold',
+                mongo_metrics.REPEATED_QUERY_THRESHOLD))
+        for query in repeated:
+            logger.warning('Repeated query in %s: %s' % (
+                route, mongo_metrics.formatRepeatedQuery(query)))
+        events.trigger('rest.queries', {
+            'route': route,
+            'stats': stats,
+            'repeated': repeated
+        })
+
+
 def ensureTokenScopes(token, scope):
     """
     Call this to validate a token scope for endpoints that require tokens
@@ -736,6 +976,66 @@ def _setCommonCORSHeaders():
             setResponseHeader('Access-Control-Allow-Origin', '*')
 
 
+class _RouteNode(object):
+    """
+    A node of the trie that routes of one HTTP method are compiled into. Each
+    edge is a path component: a literal one, or any value for a wildcard.
+    The routes ending at a node are kept in the order they were registered,
+    with the positions and names of their wildcards.
+    """
+
+    __slots__ = ('literals', 'wildcard', 'routes')
+
+    def __init__(self):
+        self.literals = {}
+        self.wildcard = None
+        self.routes = []
+
+    def add(self, route, handler):
+        node = self
+        wildcards = []
+        for i, component in enumerate(route):
+            if component[0] == ':':
+                if node.wildcard is None:
+                    node.wildcard = _RouteNode()
+                node = node.wildcard
+                wildcards.append((i, component[1:]))
+            else:
+                node = node.literals.setdefault(component, _RouteNode())
+        node.routes.append((route, handler, tuple(wildcards)))
+
+    def match(self, path):
+        """
+        Find the route matching a path, preferring literal components over
+        wildcards from the left, so that eg, ``user/me`` matches that route
+        rather than ``user/:id``.
+
+        :returns: A ``(route, handler, wildcards)`` tuple, where wildcards is
+            a tuple of the positions and names of the route's wildcards, or
+            None.
+        """
+        node = self
+        index = 0
+        length = len(path)
+        # The wildcard edges passed over for literal ones, to backtrack to.
+        untried = []
+        while True:
+            if index == length:
+                if node.routes:
+                    return node.routes[0]
+            else:
+                if node.wildcard is not None:
+                    untried.append((node.wildcard, index + 1))
+                child = node.literals.get(path[index])
+                if child is not None:
+                    node = child
+                    index += 1
+                    continue
+            if not untried:
+                return None
+            node, index = untried.pop()
+
+
 class Resource(object):
     """
     All REST resources should inherit from this class, which provides utilities
@@ -747,6 +1047,8 @@ class Resource(object):
     def __init__(self):
         self._routes = collections.defaultdict(
             lambda: collections.defaultdict(list))
+        # The routes of each method, compiled for _matchRoute.
+        self._routeTrie = {}
 
     def _ensureInit(self):
         """
@@ -795,6 +1097,7 @@ class Resource(object):
                 break
         else:
             nLengthRoutes.append((route, handler))
+        self._routeTrie.setdefault(method.lower(), _RouteNode()).add(route, handler)
 
         # Now handle the api doc if the handler has any attached
         if resource is None and hasattr(self, 'resourceName'):
@@ -842,6 +1145,7 @@ class Resource(object):
                 break
         else:
             raise GirderException('No such route: %s %s' % (method, '/'.join(route)))
+        self._compileRoutes(method.lower())
 
         # Remove the api doc
         if resource is None:
@@ -870,6 +1174,19 @@ class Resource(object):
         else:
             raise Exception('Could not find route "%s %s"' % (method.upper(), '/'.join(route)))
 
+    def _compileRoutes(self, method):
+        """
+        Rebuild the trie of a method's routes from the registered routes.
+
+        :param method: The HTTP method, in lowercase.
+        :type method: str
+        """
+        trie = _RouteNode()
+        for length in sorted(self._routes[method]):
+            for route, handler in self._routes[method][length]:
+                trie.add(route, handler)
+        self._routeTrie[method] = trie
+
     def _shouldInsertRoute(self, a, b):
         """
         Return bool representing whether route a should go before b. Checks by
@@ -937,6 +1254,7 @@ class Resource(object):
 
         routeStr = '/'.join((resource, '/'.join(route))).rstrip('/')
         eventPrefix = '.'.join(('rest', method, routeStr))
+        cherrypy.request.girderRoute = ' '.join((method.upper(), routeStr))
 
         event = events.trigger('.'.join((eventPrefix, 'before')),
                                kwargs, pre=self._defaultAccess)
@@ -976,15 +1294,14 @@ class Resource(object):
         if not self._routes:
             raise GirderException('No routes defined for resource')
 
-        for route, handler in self._routes[method][len(path)]:
-            wildcards = {}
-            for routeComponent, pathComponent in six.moves.zip(route, path):
-                if routeComponent[0] == ':':  # Wildcard token
-                    wildcards[routeComponent[1:]] = pathComponent
-                elif routeComponent != pathComponent:  # Exact match token
-                    break
-            else:
-                return route, handler, wildcards
+        trie = self._routeTrie.get(method)
+        found = trie.match(path) if trie is not None else None
+        if found is not None:
+            route, handler, wildcards = found
+            kwargs = {}
+            for i, name in wildcards:
+                kwargs[name] = path[i]
+            return route, handler, kwargs
 
         raise RestException('No matching route for "%s %s"' % (method.upper(), '/'.join(path)))
 
@@ -23,7 +23,8 @@ import threading
 import uuid
 import requests
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, rawResponse
+from ..rest import Resource, getJsonResponseEncoding, jsonResponseBody, \
+    rawResponse, sendEncodedJson
 from bson.objectid import ObjectId
 from girderformindlogger.constants import AccessType, SortDir, TokenScope,     \
     DEFINED_INFORMANTS, REPROLIB_CANONICAL, SPECIAL_SUBJECTS, USER_ROLES
@@ -32,11 +33,13 @@ from girderformindlogger.exceptions import AccessException, ValidationException
 from girderformindlogger.models.activity import Activity as ActivityModel
 from girderformindlogger.models.applet import Applet as AppletModel
 from girderformindlogger.models.collection import Collection as CollectionModel
+from girderformindlogger.models.response_cache import ResponseCache
 from girderformindlogger.models.folder import Folder as FolderModel
 from girderformindlogger.models.group import Group as GroupModel
 from girderformindlogger.models.item import Item as ItemModel
 from girderformindlogger.models.protocol import Protocol as ProtocolModel
 from girderformindlogger.models.roles import getCanonicalUser, getUserCipher
+from girderformindlogger.models.schedule_occurrence import ScheduleOccurrence
 from girderformindlogger.models.user import User as UserModel
 from girderformindlogger.utility import config, jsonld_expander
 from pyld import jsonld
@@ -58,6 +61,7 @@ class Applet(Resource):
         self.route('PUT', (':id', 'constraints'), self.setConstraints)
         self.route('PUT', (':id', 'schedule'), self.setSchedule)
         self.route('POST', (':id', 'invite'), self.invite)
+        self.route('POST', (':id', 'invite', 'bulk'), self.inviteBulk)
         self.route('GET', (':id', 'roles'), self.getAppletRoles)
         self.route('GET', (':id', 'users'), self.getAppletUsers)
         self.route('DELETE', (':id',), self.deactivateApplet)
@@ -199,32 +203,88 @@ class Applet(Resource):
         )
         .param(
             'format',
-            'JSON or CSV',
+            'JSON, NDJSON, CSV, Parquet or Arrow (IPC stream). All but JSON '
+            'are streamed as they are read.',
             required=False
         )
+        .jsonParam(
+            'columns',
+            'For Parquet and Arrow, a JSON Array of the item IRIs to include '
+            'as columns. All items are included by default.',
+            required=False,
+            requireArray=True
+        )
+        .param(
+            'startDate',
+            'Only include responses created at or after this time.',
+            required=False,
+            dataType='dateTime'
+        )
+        .param(
+            'endDate',
+            'Only include responses created before this time.',
+            required=False,
+            dataType='dateTime'
+        )
         .errorResponse('Write access was denied for this applet.', 403)
+        .errorResponse('pyarrow is not installed on this server.', 501)
     )
-    def getAppletData(self, id, format='json'):
-        import pandas as pd
+    def getAppletData(self, id, format='json', columns=None, startDate=None,
+                      endDate=None):
         from datetime import datetime
+        from girderformindlogger.utility.columnar import columnarLines,        \
+            responseSchema, COLUMNAR_FORMATS, RESPONSE_FIELDS
+        from girderformindlogger.utility.response import csvLines, ndjsonLines
         from ..rest import setContentDisposition, setRawResponse, setResponseHeader
 
         format = ('json' if format is None else format).lower()
         thisUser = self.getCurrentUser()
-        data = AppletModel().getResponseData(id, thisUser)
+        created = {
+            k: v for k, v in {
+                '$gte': startDate,
+                '$lt': endDate
+            }.items() if v is not None
+        }
+        filter = {'created': created} if len(created) else {}
+
+        if format in COLUMNAR_FORMATS:
+            # Build the schema first so a missing pyarrow fails the request
+            # before anything is streamed.
+            schema = responseSchema(
+                AppletModel().getResponseItemTypes(id, filter),
+                columns
+            )
+            data = AppletModel().iterResponseData(
+                id,
+                thisUser,
+                filter,
+                fields=RESPONSE_FIELDS
+            )
+        else:
+            data = AppletModel().iterResponseData(id, thisUser, filter)
 
         setContentDisposition("{}-{}.{}".format(
             str(id),
             datetime.now().isoformat(),
             format
         ))
-        if format=='csv':
+        if format in ['csv', 'ndjson', *COLUMNAR_FORMATS]:
             setRawResponse()
-            setResponseHeader('Content-Type', 'text/{}'.format(format))
-            csv = pd.DataFrame(data).to_csv(index=False)
-            return(csv)
+            if format=='csv':
+                setResponseHeader('Content-Type', 'text/csv')
+                lines = csvLines(
+                    data,
+                    AppletModel().getResponseDataFields(id, filter)
+                )
+            elif format in COLUMNAR_FORMATS:
+                setResponseHeader('Content-Type', COLUMNAR_FORMATS[format])
+                lines = columnarLines(data, schema, format)
+            else:
+                setResponseHeader('Content-Type', 'application/x-ndjson')
+                lines = ndjsonLines(data)
+            return(lambda: lines)
         setResponseHeader('Content-Type', 'application/{}'.format(format))
-        return(data)
+        return(list(data))
 
 
     @access.user(scope=TokenScope.DATA_WRITE)
@@ -321,6 +381,25 @@ class Applet(Resource):
                 "message": "The applet is being refreshed. Please check back "
                            "in several mintutes to see it."
             })
+        encoding = getJsonResponseEncoding()
+        if encoding is not None and applet.get('cachedVersion') and (
+            'cached' in applet
+        ):
+            # The applet is the same for every user until its cache changes,
+            # so it is serialized (and compressed) once per version of the
+            # cache and sent as is.
+            data = ResponseCache().loadResponse(
+                AppletModel().name,
+                applet['_id'],
+                applet['cachedVersion'],
+                encoding,
+                lambda: jsonResponseBody(jsonld_expander.formatLdObject(
+                    applet,
+                    'applet',
+                    user
+                ))
+            )
+            return(sendEncodedJson(data, encoding))
         return(
             jsonld_expander.formatLdObject(
                 applet,
@@ -438,6 +517,82 @@ class Applet(Resource):
             import sys, traceback
             print(sys.exc_info())
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Invite many participants to an applet at once.')
+        .notes(
+            'The body is a CSV roster with a header row, or a JSON Array of '
+            'Objects, with the columns or keys `email`, `idCode`, '
+            '`displayName` and `role` (default "user"). Each row needs an '
+            '`email` or an `idCode`; ID codes are generated for rows without '
+            'one. Once every row has been processed, the result of each row '
+            'is streamed back as a line of NDJSON with its `row` index and a '
+            '`status` of "invited", "exists" or "error".'
+        )
+        .modelParam(
+            'id',
+            model=AppletModel,
+            level=AccessType.READ,
+            destName='applet'
+        )
+        .param(
+            'invitations',
+            'CSV or JSON roster of the participants to invite.',
+            paramType='body'
+        )
+        .param(
+            'sendEmail',
+            'Whether to email the invited participants.',
+            default=True,
+            required=False,
+            dataType='boolean'
+        )
+        .consumes('text/csv')
+        .consumes('application/json')
+        .produces('application/x-ndjson')
+        .errorResponse('ID was invalid.')
+        .errorResponse('The roster could not be read.')
+        .errorResponse('Only coordinators can invite users.', 403)
+    )
+    def inviteBulk(self, applet, invitations, sendEmail=True):
+        import cherrypy
+        import csv
+        import io
+        import json
+        from girderformindlogger.models.invitation import Invitation
+        from girderformindlogger.utility.response import ndjsonLines
+        from ..rest import setRawResponse, setResponseHeader
+
+        body = invitations.read().decode('utf-8-sig')
+        if 'csv' in cherrypy.request.headers.get('Content-Type', ''):
+            rows = csv.DictReader(io.StringIO(body))
+        else:
+            try:
+                rows = json.loads(body)
+            except ValueError:
+                raise ValidationException(
+                    'The roster must be CSV or a JSON Array.',
+                    'invitations'
+                )
+            if not isinstance(rows, list):
+                raise ValidationException(
+                    'The roster must be CSV or a JSON Array.',
+                    'invitations'
+                )
+
+        # Invite the whole roster before responding, so that a client that
+        # disconnects doesn't stop the invitations part way.
+        results = list(Invitation().inviteMany(
+            applet,
+            self.getCurrentUser(),
+            rows,
+            sendEmail=sendEmail
+        ))
+        setRawResponse()
+        setResponseHeader('Content-Type', 'application/x-ndjson')
+        lines = ndjsonLines(results)
+        return(lambda: lines)
+
     @access.user(scope=TokenScope.DATA_WRITE)
     @autoDescribeRoute(
         Description('Deprecated. Do not use')
@@ -507,6 +662,11 @@ class Applet(Resource):
             args=(applet, thisUser)
         )
         thread.start()
+        thread = threading.Thread(
+            target=ScheduleOccurrence().expandApplet,
+            args=(applet,)
+        )
+        thread.start()
         return(appletMeta)
 
 
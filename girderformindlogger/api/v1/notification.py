@@ -11,16 +11,15 @@ from girderformindlogger.exceptions import RestException
 from girderformindlogger.models.notification import Notification as NotificationModel
 from girderformindlogger.models.setting import Setting
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import JsonEncoder
+from girderformindlogger.utility import JsonEncoder, notification_broker
 from girderformindlogger.api import access
 
 
 # If no timeout param is passed to stream, we default to this value
 DEFAULT_STREAM_TIMEOUT = 300
-# When new events are seen, we will poll at the minimum interval
-MIN_POLL_INTERVAL = 0.5
-# The interval increases when no new events are seen, capping at this value
-MAX_POLL_INTERVAL = 2
+# Streams waiting for notifications check at least this often (in seconds)
+# whether the server is stopping.
+MAX_WAIT = 5
 
 
 def sseMessage(event):
@@ -48,7 +47,7 @@ class Notification(Resource):
         .notes('This uses long-polling to keep the connection open for '
                'several minutes at a time (or longer) and should be requested '
                'with an EventSource object or other SSE-capable client. '
-               '<p>Notifications are returned within a few seconds of when '
+               '<p>Notifications are returned within a second of when '
                'they occur.  When no notification occurs for the timeout '
                'duration, the stream is closed. '
                '<p>This connection can stay open indefinitely long.')
@@ -74,21 +73,28 @@ class Notification(Resource):
             since = datetime.utcfromtimestamp(since)
 
         def streamGen():
-            lastUpdate = since
-            start = time.time()
-            wait = MIN_POLL_INTERVAL
-            while cherrypy.engine.state == cherrypy.engine.states.STARTED:
-                wait = min(wait + MIN_POLL_INTERVAL, MAX_POLL_INTERVAL)
-                for event in NotificationModel().get(user, lastUpdate, token=token):
-                    if lastUpdate is None or event['updated'] > lastUpdate:
+            # Subscribe before reading the outstanding notifications, so that
+            # none are missed in between.
+            subscription = notification_broker.broker.subscribe(user, token)
+            try:
+                lastUpdate = since
+                start = time.time()
+                events = list(NotificationModel().get(
+                    user, lastUpdate, token=token,
+                    sort=[('updated', SortDir.ASCENDING)]))
+                while cherrypy.engine.state == cherrypy.engine.states.STARTED:
+                    for event in events:
+                        if lastUpdate is not None and event['updated'] <= lastUpdate:
+                            continue
                         lastUpdate = event['updated']
-                    wait = MIN_POLL_INTERVAL
-                    start = time.time()
-                    yield sseMessage(event)
-                if time.time() - start > timeout:
-                    break
-
-                time.sleep(wait)
+                        start = time.time()
+                        yield sseMessage(dict(event))
+                    remaining = timeout - (time.time() - start)
+                    if remaining <= 0 or subscription.closed:
+                        break
+                    events = subscription.get(min(remaining, MAX_WAIT))
+            finally:
+                notification_broker.broker.unsubscribe(subscription)
         return streamGen
 
     @disableAuditLog
@@ -104,5 +110,5 @@ class Notification(Resource):
     )
     def listNotifications(self, since):
         user, token = self.getCurrentUser(returnToken=True)
-        return list(NotificationModel().get(
-            user, since, token=token, sort=[('updated', SortDir.ASCENDING)]))
+        return NotificationModel().get(
+            user, since, token=token, sort=[('updated', SortDir.ASCENDING)])
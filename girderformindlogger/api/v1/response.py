@@ -21,12 +21,13 @@ import itertools
 import tzlocal
 from ..describe import Description, autoDescribeRoute
 from ..rest import Resource, filtermodel, setResponseHeader, \
-    setContentDisposition
+    setContentDisposition, setRawResponse
 from datetime import datetime
 from girderformindlogger.utility import ziputil
 from girderformindlogger.constants import AccessType, TokenScope
 from girderformindlogger.exceptions import AccessException, RestException, \
     ValidationException
+from girderformindlogger import events
 from girderformindlogger.api import access
 from girderformindlogger.models.activity import Activity as ActivityModel
 from girderformindlogger.models.applet import Applet as AppletModel
@@ -37,14 +38,13 @@ from girderformindlogger.models.response_folder import ResponseFolder as \
 from girderformindlogger.models.roles import getCanonicalUser, getUserCipher
 from girderformindlogger.models.user import User as UserModel
 from girderformindlogger.models.upload import Upload as UploadModel
-from girderformindlogger.utility.response import formatResponse, \
-    string_or_ObjectID
+from girderformindlogger.utility.response import csvLines, ndjsonLines, \
+    string_or_ObjectID, tidyResponses, TIDY_RESPONSE_COLUMNS
 from girderformindlogger.utility.resource import listFromString
 from pymongo import ASCENDING, DESCENDING
 from bson import ObjectId
-import hashlib
-
 
+EXPORT_BATCH_SIZE = 500
 
 class ResponseItem(Resource):
 
@@ -54,6 +54,7 @@ class ResponseItem(Resource):
         self._model = ResponseItemModel()
         self.route('GET', (), self.getResponses)
         self.route('GET', ('last7Days', ':applet'), self.getLast7Days)
+        self.route('POST', ('batch',), self.createResponseItems)
         self.route('POST', (':applet', ':activity'), self.createResponseItem)
 
     """
@@ -99,6 +100,14 @@ class ResponseItem(Resource):
             'thereof.',
             required=False
         )
+        .param(
+            'format',
+            'Output format. Responses are streamed as they are read; '
+            '"ndjson" and "csv" are sent as file downloads.',
+            required=False,
+            enum=['json', 'ndjson', 'csv'],
+            default='json'
+        )
         .errorResponse('ID was invalid.')
         .errorResponse(
             'Read access was denied for this applet for this user.',
@@ -110,6 +119,7 @@ class ResponseItem(Resource):
         informant=[],
         subject=[],
         applet=[],
+        format='json',
         # activity=[],
         # screen=[]
     ):
@@ -178,12 +188,6 @@ class ResponseItem(Resource):
             )
         }
 
-        allResponses = list(ResponseItemModel().find(
-            query=q,
-            user=reviewer,
-            sort=[("created", DESCENDING)]
-        ))
-
         # TODO: for now, an applet only has one group
         # get the manager group and make sure there is just 1:
         managerGroupOfApplet = appletInfo['roles']['manager']['groups']
@@ -197,43 +201,35 @@ class ResponseItem(Resource):
             reviewer['groups']
         )))
 
-        # Format the output response.
-        # else, get the userCipher and use that for the userId.
-        outputResponse = []
-        for response in allResponses:
-            userId = response['baseParentId']
-
-            # encode the userId below:
-            # TODO: create a user cipher, which is the hash of
-            # an appletid concatenated with the user id
-            appletIdUserId = applet + str(userId)
-            # hash it:
-            hash_object = hashlib.md5(appletIdUserId.encode())
-            encodedId = hash_object.hexdigest()
-
-            # format the response and add the userId
-            formattedResponse = formatResponse(response)['thisResponse']
-            formattedResponse['userId'] = encodedId
-            outputResponse.append(formattedResponse)
-
-        # lets format the output response in tidy format.
+        # Format the output response in tidy format, reading the responses
+        # from a batched cursor:
         # a list of objects, with columns:
         # ['itemURI', 'value', 'userId', 'schema:startDate', 'schema:endDate']
+        # The userId is a hash of the applet ID and the user ID.
+        allResponses = ResponseItemModel().find(
+            query=q,
+            sort=[("created", DESCENDING)]
+        ).batch_size(EXPORT_BATCH_SIZE)
+        rows = tidyResponses(allResponses, applet)
+
+        format = ('json' if format is None else format).lower()
+        if format == 'json':
+            return(rows)
+
+        setRawResponse()
+        setContentDisposition("{}-{}.{}".format(
+            str(applet),
+            datetime.now().isoformat(),
+            format
+        ))
+        if format == 'csv':
+            setResponseHeader('Content-Type', 'text/csv')
+            lines = csvLines(rows, TIDY_RESPONSE_COLUMNS)
+        else:
+            setResponseHeader('Content-Type', 'application/x-ndjson')
+            lines = ndjsonLines(rows)
 
-        formattedOutputResponse = []
-
-        for response in outputResponse:
-            tmp = {
-                'schema:startDate': response['schema:startDate'],
-                'schema:endDate': response['schema:endDate'],
-                'userId': response['userId'],
-            }
-            for key, value in response['responses'].items():
-                tmp['itemURI'] = key
-                tmp['value'] = value
-                formattedOutputResponse.append(tmp)
-
-        return formattedOutputResponse
+        return(lambda: lines)
 
         # responseArray = [
         #     formatResponse(response) for response in allResponses
@@ -320,6 +316,14 @@ class ResponseItem(Resource):
         .jsonParam('metadata',
                    'A JSON object containing the metadata keys to add.',
                    paramType='form', requireObject=True, required=True)
+        .param(
+            'idempotencyKey',
+            'A key identifying this submission, so that a retried request '
+            'returns the original response rather than creating a duplicate. '
+            'If omitted, a key is derived from the activity, the subject and '
+            'the responseStarted and responseCompleted timestamps in '
+            'metadata.',
+            required=False, default=None)
         .errorResponse()
         .errorResponse('Write access was denied on the parent folder.', 403)
     )
@@ -330,29 +334,25 @@ class ResponseItem(Resource):
         metadata,
         subject_id,
         pending,
+        idempotencyKey,
         params
     ):
         from girderformindlogger.models.profile import Profile
         try:
             from girderformindlogger.utility.response import aggregateAndSave
             # TODO: pending
-            metadata['applet'] = {
-                "@id": applet.get('_id'),
-                "name": AppletModel().preferredName(applet),
-                "url": applet.get(
-                    'url',
-                    applet.get('meta', {}).get('applet', {}).get('url')
-                )
-            }
-            metadata['activity'] = {
-                "@id": activity.get('_id'),
-                "name": ActivityModel().preferredName(activity),
-                "url": activity.get(
-                    'url',
-                    activity.get('meta', {}).get('activity', {}).get('url')
-                )
-            }
             informant = self.getCurrentUser()
+            idempotencyKey = idempotencyKey or self._model.deriveIdempotencyKey(
+                activity,
+                metadata,
+                subject_id or informant['_id']
+            )
+            existing = self._model.findIdempotent(informant, idempotencyKey)
+            if existing is not None:
+                # A retry of a submission we already saved.
+                if not pending:
+                    existing['readOnly'] = True
+                return(existing)
             subject_id = subject_id if subject_id else str(
                 informant['_id']
             )
@@ -364,23 +364,10 @@ class ResponseItem(Resource):
 
             print(subject_id)
 
-            if isinstance(metadata.get('subject'), dict):
-                metadata['subject']['@id'] = subject_id
-            else:
-                metadata['subject'] = {'@id': subject_id}
+            metadata = _responseMetadata(applet, activity, metadata, subject_id)
             now = datetime.now(tzlocal.get_localzone())
-            appletName=AppletModel().preferredName(applet)
-            UserResponsesFolder = ResponseFolderModel().load(
-                user=informant,
-                reviewer=informant,
-                force=True
-            )
-            UserAppletResponsesFolder = Folder().createFolder(
-                parent=UserResponsesFolder, parentType='folder',
-                name=appletName, reuseExisting=True, public=False)
-            AppletSubjectResponsesFolder = Folder().createFolder(
-                parent=UserAppletResponsesFolder, parentType='folder',
-                name=str(subject_id), reuseExisting=True, public=False)
+            AppletSubjectResponsesFolder = ResponseFolderModel(
+            ).getSubjectFolder(informant, applet, subject_id)
 
             try:
                 newItem = self._model.createResponseItem(
@@ -391,8 +378,21 @@ class ResponseItem(Resource):
                         Folder().preferredName(activity),
                         now.strftime("%Y-%m-%d"),
                         now.strftime("%H:%M:%S %Z")
-                    ), reuseExisting=False)
+                    ), reuseExisting=False,
+                    # Files are uploaded under the item, so with files the
+                    # metadata can only be set once the item exists.
+                    metadata=None if len(params) else metadata,
+                    idempotencyKey=idempotencyKey)
             except:
+                # A concurrent retry may have saved this submission first.
+                existing = self._model.findIdempotent(
+                    informant,
+                    idempotencyKey
+                )
+                if existing is not None:
+                    if not pending:
+                        existing['readOnly'] = True
+                    return(existing)
                 raise ValidationException(
                     "Couldn't find activity name for this response"
                 )
@@ -417,7 +417,7 @@ class ResponseItem(Resource):
                 # now, replace the metadata key with a link to this upload
                 metadata['responses'][key] = "file::{}".format(newUpload['_id'])
 
-            if metadata:
+            if metadata and len(params):
                 newItem = self._model.setMetadata(newItem, metadata)
 
             print(metadata)
@@ -438,5 +438,186 @@ class ResponseItem(Resource):
             print(traceback.print_tb(sys.exc_info()[2]))
             return(str(traceback.print_tb(sys.exc_info()[2])))
 
+    @access.user(scope=TokenScope.DATA_WRITE)
+    @autoDescribeRoute(
+        Description('Create many user response items at once.')
+        .notes(
+            'For clients submitting responses that were collected offline. '
+            'The whole batch is validated before anything is saved. A '
+            'response whose idempotencyKey was already submitted returns '
+            'the existing item instead of creating a new one. If a response '
+            'has no idempotencyKey, one is derived from its activity, its '
+            'subject and the responseStarted and responseCompleted timestamps '
+            'in its metadata.'
+        )
+        .jsonParam(
+            'responses',
+            'A JSON Array of responses. Each response is an Object with the '
+            'keys "applet" (ID), "activity" (ID) and "metadata" (as for '
+            '`POST /response/{applet}/{activity}`), and optionally '
+            '"subject_id", "pending" and "idempotencyKey".',
+            paramType='body',
+            requireArray=True
+        )
+        .errorResponse()
+        .errorResponse('Read access was denied on an applet or activity.', 403)
+    )
+    def createResponseItems(self, responses):
+        from girderformindlogger.models.profile import Profile
+        from girderformindlogger.utility.response import responseDatetime
+
+        informant = self.getCurrentUser()
+
+        # Validate the whole batch before writing anything.
+        for i, response in enumerate(responses):
+            if not isinstance(response, dict) or not all([
+                response.get(k) for k in ['applet', 'activity']
+            ]):
+                raise ValidationException(
+                    'Response {} must have an "applet" and an "activity".'
+                    .format(i)
+                )
+            if not isinstance(response.get('metadata'), dict):
+                raise ValidationException(
+                    'Response {} must have a "metadata" Object.'.format(i),
+                    'metadata'
+                )
+        applets = {
+            appletId: AppletModel().load(
+                appletId,
+                level=AccessType.READ,
+                user=informant,
+                exc=True
+            ) for appletId in {str(r['applet']) for r in responses}
+        }
+        activities = {
+            activityId: ActivityModel().load(
+                activityId,
+                level=AccessType.READ,
+                user=informant,
+                exc=True
+            ) for activityId in {str(r['activity']) for r in responses}
+        }
+
+        # Resolve each profile and response folder once for the batch.
+        profiles = {}
+        for response in responses:
+            key = (
+                str(response['applet']),
+                str(response.get('subject_id') or informant['_id'])
+            )
+            if key not in profiles:
+                profiles[key] = Profile().createProfile(
+                    applets[key[0]],
+                    key[1]
+                ).get('_id')
+        subjectFolders = {
+            key: ResponseFolderModel().getSubjectFolder(
+                informant,
+                applets[key[0]],
+                profileId
+            ) for key, profileId in profiles.items()
+        }
+
+        newResponses = []
+        for response in responses:
+            key = (
+                str(response['applet']),
+                str(response.get('subject_id') or informant['_id'])
+            )
+            applet = applets[key[0]]
+            activity = activities[str(response['activity'])]
+            metadata = _responseMetadata(
+                applet,
+                activity,
+                response['metadata'],
+                profiles[key]
+            )
+            completed = metadata.get('responseCompleted')
+            completed = responseDatetime(completed).astimezone(
+                tzlocal.get_localzone()
+            ) if completed else datetime.now(tzlocal.get_localzone())
+            newResponses.append({
+                'name': completed.strftime("%Y-%m-%d-%H-%M-%S-%Z"),
+                'description': "{} response on {} at {}".format(
+                    Folder().preferredName(activity),
+                    completed.strftime("%Y-%m-%d"),
+                    completed.strftime("%H:%M:%S %Z")
+                ),
+                'folder': subjectFolders[key],
+                'metadata': metadata,
+                'idempotencyKey': response.get(
+                    'idempotencyKey'
+                ) or self._model.deriveIdempotencyKey(
+                    activity,
+                    metadata,
+                    key[1]
+                )
+            })
+        items = self._model.createResponseItems(newResponses, informant)
+
+        # Only the latest new response of each (applet, activity, subject)
+        # needs aggregating; aggregates cover every earlier response.
+        toAggregate = {}
+        for response, item in zip(responses, items):
+            if response.get('pending'):
+                continue
+            item['readOnly'] = True
+            if 'allTime' not in item.get('meta', {}):
+                toAggregate[(
+                    str(response['applet']),
+                    str(response['activity']),
+                    str(profiles[(
+                        str(response['applet']),
+                        str(response.get('subject_id') or informant['_id'])
+                    )])
+                )] = item
+        for (appletId, activityId, subjectId), item in toAggregate.items():
+            # Aggregating is slow, so it is left to the event workers, which
+            # handle one response of each applet and subject at a time and
+            # log and count any failures.
+            events.daemon.trigger(
+                'response.aggregate',
+                info={'item': item, 'informant': informant},
+                callback=_aggregateResponse,
+                key='response.aggregate:{}:{}'.format(appletId, subjectId)
+            )
+        return(items)
+
+
+def _aggregateResponse(event):
+    from girderformindlogger.utility.response import aggregateAndSave
+
+    aggregateAndSave(event.info['item'], event.info['informant'])
+
+
+def _responseMetadata(applet, activity, metadata, subjectId):
+    """
+    Add the applet, activity and subject references to a response's
+    metadata.
+    """
+    metadata['applet'] = {
+        "@id": applet.get('_id'),
+        "name": AppletModel().preferredName(applet),
+        "url": applet.get(
+            'url',
+            applet.get('meta', {}).get('applet', {}).get('url')
+        )
+    }
+    metadata['activity'] = {
+        "@id": activity.get('_id'),
+        "name": ActivityModel().preferredName(activity),
+        "url": activity.get(
+            'url',
+            activity.get('meta', {}).get('activity', {}).get('url')
+        )
+    }
+    if isinstance(metadata.get('subject'), dict):
+        metadata['subject']['@id'] = subjectId
+    else:
+        metadata['subject'] = {'@id': subjectId}
+    return(metadata)
+
+
 def save():
     return(lambda x: x)
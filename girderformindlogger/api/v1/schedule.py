@@ -21,9 +21,14 @@ from ..describe import Description, autoDescribeRoute
 from ..rest import Resource
 from girderformindlogger.api import access
 from girderformindlogger.constants import TokenScope
+from girderformindlogger.exceptions import RestException
 from girderformindlogger.models.applet import Applet as AppletModel
+from girderformindlogger.models.schedule_occurrence import ScheduleOccurrence
 from girderformindlogger.utility import jsonld_expander, response
 
+# The most due notifications returned in one page
+MAX_DUE_LIMIT = 10000
+
 
 class Schedule(Resource):
     """API Endpoint for schedules."""
@@ -32,6 +37,7 @@ class Schedule(Resource):
         super(Schedule, self).__init__()
         self.resourceName = 'schedule'
         self.route('GET', (), self.getSchedule)
+        self.route('GET', ('due',), self.getDue)
 
     @access.public(scope=TokenScope.DATA_READ)
     @autoDescribeRoute(
@@ -51,3 +57,52 @@ class Schedule(Resource):
         """
         currentUser = self.getCurrentUser()
         return(response.getSchedule(currentUser, timezone))
+
+    @access.admin(scope=TokenScope.DATA_READ)
+    @autoDescribeRoute(
+        Description('Page through the notifications due soon, for all users.')
+        .notes(
+            'For reminder dispatchers. Occurrences are returned in order of '
+            'time; pass the returned "next" value as "after" to get the next '
+            'page. Requesting the first page also starts expanding, in the '
+            'background, the schedules of profiles whose expanded occurrences '
+            'are running out.'
+        )
+        .param(
+            'minutes',
+            'Return notifications due within this many minutes from now.',
+            required=False,
+            dataType='integer',
+            default=15
+        )
+        .param(
+            'after',
+            'The "next" value returned with the previous page.',
+            required=False
+        )
+        .param(
+            'limit',
+            'Maximum number of notifications to return, at most %d.'
+            % MAX_DUE_LIMIT,
+            required=False,
+            dataType='integer',
+            default=1000
+        )
+        .errorResponse('Invalid "after" value.')
+        .errorResponse('Invalid "minutes" or "limit" value.')
+        .errorResponse('Admin access was denied.', 403)
+    )
+    def getDue(self, minutes, after, limit):
+        if minutes < 0:
+            raise RestException('"minutes" must not be negative.')
+        if not 1 <= limit <= MAX_DUE_LIMIT:
+            raise RestException(
+                '"limit" must be between 1 and %d.' % MAX_DUE_LIMIT)
+        if after:
+            try:
+                ScheduleOccurrence().parseAfter(after)
+            except ValueError:
+                raise RestException('Invalid "after" value: %s.' % after)
+        else:
+            ScheduleOccurrence().extendLater()
+        return(ScheduleOccurrence().findDue(minutes, after, limit))
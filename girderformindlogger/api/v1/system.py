@@ -8,22 +8,20 @@ import six
 import os
 import logging
 
-from girderformindlogger import plugin
+from girderformindlogger import events, plugin
 from girderformindlogger.api import access
 from girderformindlogger.constants import TokenScope, ACCESS_FLAGS, VERSION
 from girderformindlogger.exceptions import GirderException, ResourcePathNotFound
 from girderformindlogger.models.collection import Collection
-from girderformindlogger.models.file import File
 from girderformindlogger.models.folder import Folder
 from girderformindlogger.models.group import Group
-from girderformindlogger.models.item import Item
 from girderformindlogger.models.setting import Setting
+from girderformindlogger.models.system_check import SystemCheck
 from girderformindlogger.models.upload import Upload
 from girderformindlogger.models.user import User
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import config, system
+from girderformindlogger.utility import config, mongo_metrics, system
 from girderformindlogger.utility.jsonld_expander import getByLanguage
-from girderformindlogger.utility.progress import ProgressContext
 from ..describe import Description, autoDescribeRoute
 from ..rest import Resource
 
@@ -50,8 +48,11 @@ class System(Resource):
         self.route('DELETE', ('uploads',), self.discardPartialUploads)
         self.route('GET', ('check',), self.systemStatus)
         self.route('PUT', ('check',), self.systemConsistencyCheck)
+        self.route('GET', ('check', 'consistency'), self.getConsistencyCheck)
         self.route('GET', ('log',), self.getLog)
         self.route('GET', ('log', 'level'), self.getLogLevel)
+        self.route('GET', ('metrics',), self.getMetrics)
+        self.route('GET', ('metrics', 'events'), self.getEventMetrics)
         self.route('PUT', ('log', 'level'), self.setLogLevel)
         self.route('GET', ('setting', 'collection_creation_policy', 'access'),
                    self.getCollectionCreationPolicyAccess)
@@ -154,6 +155,38 @@ class System(Resource):
         version['serverStartDate'] = ModuleStartTime
         return version
 
+    @access.admin(scope=TokenScope.SETTINGS_READ)
+    @autoDescribeRoute(
+        Description('Get the database use of each route.')
+        .notes('Must be a system administrator to call this. For each route, '
+               'this returns the number of requests, their total and maximum '
+               'number of database queries, their total database time in '
+               'milliseconds, and histograms of queries and database time '
+               'per request, since the server started or the metrics were '
+               'last reset.')
+        .param('reset', 'Whether to reset the metrics after returning them.',
+               required=False, dataType='boolean', default=False)
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getMetrics(self, reset):
+        return mongo_metrics.getRouteMetrics(reset=reset)
+
+    @access.admin(scope=TokenScope.SETTINGS_READ)
+    @autoDescribeRoute(
+        Description('Get the queue depth and timing of asynchronous events.')
+        .notes('Must be a system administrator to call this. This returns '
+               'the number of queued events and, for each event name, the '
+               'number of events handled and failed, and the total and '
+               'longest times in seconds they waited in the queue and took '
+               'to handle, since the server started or the metrics were '
+               'last reset.')
+        .param('reset', 'Whether to reset the metrics after returning them.',
+               required=False, dataType='boolean', default=False)
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getEventMetrics(self, reset):
+        return events.daemon.metrics(reset=reset)
+
     @access.public
     @autoDescribeRoute(
         Description(
@@ -325,37 +358,40 @@ class System(Resource):
         Description('Perform a variety of system checks to verify that all is '
                     'well.')
         .notes('Must be a system administrator to call this.  This verifies '
-               'and corrects some issues, such as incorrect folder sizes.')
+               'and corrects some issues, such as incorrect folder sizes. The '
+               'check runs in the background; this returns it as it starts, '
+               'and `GET /system/check/consistency` returns its results once '
+               'it is done. If a check is already running, it is returned '
+               'instead, and if the last check did not finish, it is resumed.')
         .param('progress', 'Whether to record progress on this task.',
                required=False, dataType='boolean', default=False)
         .errorResponse('You are not a system administrator.', 403)
     )
     def systemConsistencyCheck(self, progress):
-        user = self.getCurrentUser()
-        title = 'Running system consistency check'
-        with ProgressContext(progress, user=user, title=title) as pc:
-            results = {}
-            pc.update(title='Checking for orphaned records (Step 1 of 3)')
-            results['orphansRemoved'] = self._pruneOrphans(pc)
-            pc.update(title='Checking for incorrect base parents (Step 2 of 3)')
-            results['baseParentsFixed'] = self._fixBaseParents(pc)
-            pc.update(title='Checking for incorrect sizes (Step 3 of 3)')
-            results['sizesChanged'] = self._recalculateSizes(pc)
-            return results
+        return SystemCheck().start(self.getCurrentUser(), progress)
         # TODO:
-        # * check that all files are associated with an existing item
         # * check that all files exist within their assetstore and are the
         #   expected size
         # * check that all folders have a valid ancestor tree leading to a
         #   user or collection
-        # * check that all folders have the correct baseParentId and
-        #   baseParentType
         # * check that all groups contain valid users
         # * check that all resources validate
         # * for filesystem assetstores, find files that are not tracked.
         # * for gridfs assetstores, find chunks that are not tracked.
         # * for s3 assetstores, find elements that are not tracked.
 
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get the most recent system consistency check.')
+        .notes('Must be a system administrator to call this. Its status is '
+               '"active", "success" or "error"; once it succeeds, its '
+               'results hold the number of orphaned records removed, base '
+               'parents fixed and sizes changed.')
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getConsistencyCheck(self):
+        return SystemCheck().latest()
+
     @access.admin
     @autoDescribeRoute(
         Description('Show the most recent contents of the server logs.')
@@ -465,48 +501,3 @@ class System(Resource):
                 grp['description'] = grpDoc['description']
 
         return acList
-
-    def _fixBaseParents(self, progress):
-        fixes = 0
-        models = [Folder(), Item()]
-        steps = sum(model.find().count() for model in models)
-        progress.update(total=steps, current=0)
-        for model in models:
-            for doc in model.find():
-                progress.update(increment=1)
-                baseParent = model.parentsToRoot(doc, force=True)[0]
-                baseParentType = baseParent['type']
-                baseParentId = baseParent['object']['_id']
-                if (doc['baseParentType'] != baseParentType or doc['baseParentId'] != baseParentId):
-                    model.update({'_id': doc['_id']}, update={
-                        '$set': {
-                            'baseParentType': baseParentType,
-                            'baseParentId': baseParentId
-                        }})
-                    fixes += 1
-        return fixes
-
-    def _pruneOrphans(self, progress):
-        count = 0
-        models = [File(), Folder(), Item()]
-        steps = sum(model.find().count() for model in models)
-        progress.update(total=steps, current=0)
-        for model in models:
-            for doc in model.find():
-                progress.update(increment=1)
-                if model.isOrphan(doc):
-                    model.remove(doc)
-                    count += 1
-        return count
-
-    def _recalculateSizes(self, progress):
-        fixes = 0
-        models = [Collection(), User()]
-        steps = sum(model.find().count() for model in models)
-        progress.update(total=steps, current=0)
-        for model in models:
-            for doc in model.find():
-                progress.update(increment=1)
-                _, f = model.updateSize(doc)
-                fixes += f
-        return fixes
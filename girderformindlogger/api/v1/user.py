@@ -16,6 +16,7 @@ from girderformindlogger.models.folder import Folder as FolderModel
 from girderformindlogger.models.group import Group as GroupModel
 from girderformindlogger.models.ID_code import IDCode
 from girderformindlogger.models.profile import Profile as ProfileModel
+from girderformindlogger.models.schedule_occurrence import ScheduleOccurrence
 from girderformindlogger.models.setting import Setting
 from girderformindlogger.models.token import Token
 from girderformindlogger.models.user import User as UserModel
@@ -121,6 +122,11 @@ class User(Resource):
             args=(applet, thisUser)
         )
         thread.start()
+        thread = threading.Thread(
+            target=ScheduleOccurrence().expandProfile,
+            args=(profile, applet)
+        )
+        thread.start()
         return(profile["userDefined"])
 
     @access.user(scope=TokenScope.DATA_WRITE)
@@ -173,6 +179,11 @@ class User(Resource):
             args=(applet, thisUser)
         )
         thread.start()
+        thread = threading.Thread(
+            target=ScheduleOccurrence().expandProfile,
+            args=(profile, applet)
+        )
+        thread.start()
         return(profile["coordinatorDefined"])
 
     @access.public(scope=TokenScope.USER_INFO_READ)
@@ -397,6 +408,7 @@ class User(Resource):
                            "in several mintutes to see it."
             })
         try:
+            UserModel().loadCached(reviewer)
             if 'cached' in reviewer:
                 reviewer['cached'] = json_util.loads(
                     reviewer['cached']
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import click
+
+from girderformindlogger.models import getDbConnection
+from girderformindlogger.models.folder import Folder
+from girderformindlogger.models.item import Item
+
+
+def _duplicates(collection, fields, match=None):
+    """
+    Find the documents that a unique index on fields would reject.
+
+    :param collection: The collection to search.
+    :param fields: The fields of the unique index.
+    :type fields: list of str
+    :param match: The partial filter expression of the index, if any.
+    :type match: dict or None
+    :returns: A generator of the values of fields shared by each group of
+        duplicates and the sorted ids of that group. The oldest document of
+        each group comes first.
+    """
+    pipeline = [{'$match': match}] if match else []
+    pipeline.extend([{
+        '$group': {
+            '_id': {field: '$%s' % field for field in fields},
+            'ids': {'$push': '$_id'},
+            'count': {'$sum': 1}
+        }
+    }, {
+        '$match': {'count': {'$gt': 1}}
+    }])
+    for group in collection.aggregate(pipeline, allowDiskUse=True):
+        yield group['_id'], sorted(group['ids'])
+
+
+def _freeFolderName(db, parent, name):
+    n = 0
+    while True:
+        n += 1
+        newName = '%s (%d)' % (name, n)
+        if db['folder'].count_documents(dict(parent, name=newName)):
+            continue
+        if parent['parentCollection'] == 'folder' and db['item'].count_documents({
+            'folderId': parent['parentId'],
+            'name': newName
+        }):
+            continue
+        return(newName)
+
+
+def dedupe(db):
+    """
+    Resolve the duplicates that keep unique indices from being built, keeping
+    the oldest document of each group as it is:
+
+    - folders sharing a parent and name are renamed to "name (n)",
+    - items sharing a creator and idempotency key lose their key,
+    - invitations sharing an applet and ID code lose their ID code, and
+    - cached applet responses sharing a document and encoding are removed.
+
+    :param db: The database.
+    :returns: A list of the kind and number of documents changed.
+    """
+    counts = []
+
+    count = 0
+    for key, ids in _duplicates(
+            db['folder'], ['parentId', 'parentCollection', 'name']):
+        parent = {
+            'parentId': key.get('parentId'),
+            'parentCollection': key.get('parentCollection')
+        }
+        for id in ids[1:]:
+            name = _freeFolderName(db, parent, key.get('name'))
+            db['folder'].update_one({'_id': id}, {'$set': {
+                'name': name, 'lowerName': name.lower()}})
+            count += 1
+    counts.append(('folders renamed', count))
+
+    count = 0
+    for key, ids in _duplicates(
+            db['item'], ['creatorId', 'idempotencyKey'],
+            {'idempotencyKey': {'$exists': True}}):
+        count += db['item'].update_many(
+            {'_id': {'$in': ids[1:]}},
+            {'$unset': {'idempotencyKey': True}}).modified_count
+    counts.append(('response idempotency keys removed', count))
+
+    count = 0
+    for key, ids in _duplicates(
+            db['invitation'], ['appletId', 'idCode'],
+            {'idCode': {'$type': 'string'}}):
+        click.echo('Removing ID code %s from invitations %s' % (
+            key.get('idCode'), ', '.join(str(id) for id in ids[1:])))
+        count += db['invitation'].update_many(
+            {'_id': {'$in': ids[1:]}},
+            {'$unset': {'idCode': True}}).modified_count
+    counts.append(('invitation ID codes removed', count))
+
+    count = 0
+    for key, ids in _duplicates(
+            db['responseCache'], ['collection', 'docId', 'encoding']):
+        count += db['responseCache'].delete_many(
+            {'_id': {'$in': ids[1:]}}).deleted_count
+    counts.append(('cached responses removed', count))
+
+    return(counts)
+
+
+@click.command('migrate', short_help='Backfill fields of older folders and items.',
+               help='Resolve the duplicate folders, responses, invitations '
+               'and cached responses that keep unique indices from being '
+               'built, which stops the server from starting. Then store the '
+               'base parent, lower-case name, model type, '
+               'folder type and ancestors of every folder that lacks them, '
+               'then the ancestors of every item, so that loading applets and '
+               'activities and walking folder trees no longer query one level '
+               'at a time. This may be interrupted and run again, but should '
+               'be run to completion.')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='The number of folders or items to update at a time.')
+def main(batch_size):
+    # This must come before the models are first used, since that builds
+    # their indices.
+    for kind, count in dedupe(getDbConnection().get_database()):
+        if count:
+            click.echo('Resolved duplicates: %d %s' % (count, kind))
+    for kind, batches in [
+        ('folders', Folder().migrateFolders(batch_size)),
+        ('items', Item().migrateItems(batch_size))
+    ]:
+        updated = skipped = 0
+        for batchUpdated, batchSkipped in batches:
+            updated += batchUpdated
+            skipped += batchSkipped
+            click.echo('Updated %d %s' % (updated, kind))
+        if skipped:
+            click.echo('Skipped %d %s with a missing ancestor' % (skipped, kind))
+    click.echo('Done')
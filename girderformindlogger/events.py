@@ -17,20 +17,29 @@ And if the event should be handled asynchronously, use:
 
     ``girderformindlogger.events.daemon.trigger('event.name', info, callback)``
 
+Asynchronous events with the same routing key, which is given by the ``key``
+argument or else is the ``_id`` of the info or the event name, are handled in
+the order they were triggered.
+
 For obvious reasons, the asynchronous method does not return a value to the
 caller. Instead, the caller may optionally pass the callback argument as a
 function to be called when the task is finished. That callback function will
 receive the Event object as its only argument.
 """
 
+import collections
 import contextlib
 import girderformindlogger
 import six
 import threading
+import time
 
 from collections import OrderedDict
 from girderformindlogger.utility import config
-from six.moves import queue
+
+DEFAULT_EVENT_WORKERS = 4
+# Seconds that stopping the daemon waits for queued events to be handled.
+DRAIN_TIMEOUT = 10
 
 
 class Event(object):
@@ -99,7 +108,7 @@ class ForegroundEventsDaemon(object):
     config file chooses to disable using the background thread for the daemon.
     It executes all bound handlers in the current thread, and provides
     no-op start() and stop() implementations to remain compatible with the
-    API of AsyncEventsThread.
+    API of AsyncEventsDaemon.
     """
 
     def start(self):
@@ -108,7 +117,7 @@ class ForegroundEventsDaemon(object):
     def stop(self):
         pass
 
-    def trigger(self, eventName=None, info=None, callback=None):
+    def trigger(self, eventName=None, info=None, callback=None, key=None):
         if eventName is None:
             event = Event(None, info, asynchronous=False)
         else:
@@ -117,33 +126,72 @@ class ForegroundEventsDaemon(object):
         if callable(callback):
             callback(event)
 
+    def metrics(self, reset=False):
+        return {'workers': 0, 'queueDepth': 0, 'activeKeys': 0, 'events': {}}
 
-class AsyncEventsThread(threading.Thread):
-    """
-    This class is used to execute the pipeline for events asynchronously.
-    This should not be invoked directly by callers; instead, they should use
-    girderformindlogger.events.daemon.trigger().
+
+class AsyncEventsDaemon(object):
     """
+    This class is used to execute the pipeline for events asynchronously, on
+    a pool of worker threads. This should not be invoked directly by callers;
+    instead, they should use girderformindlogger.events.daemon.trigger().
+
+    Each event has a routing key, and events with the same key are handled
+    one at a time in the order they were triggered, while events with other
+    keys are handled by any idle worker. A slow handler therefore only
+    delays later events with its own key.
 
-    def __init__(self):
-        threading.Thread.__init__(self)
+    :param workers: Number of worker threads.
+    :type workers: int
+    """
 
-        self.daemon = True
+    def __init__(self, workers=DEFAULT_EVENT_WORKERS):
+        self.workers = workers
+        self.threads = []
         self.terminate = False
-        self.eventQueue = queue.Queue()
-        self.queueNotEmpty = threading.Condition()
+        self.stopping = False
+        # Routing key → deque of queued (eventName, info, callback, time)
+        self._pending = {}
+        # Keys with queued events that no worker is handling, in the order
+        # they became ready.
+        self._ready = collections.deque()
+        self._active = set()
+        self._condition = threading.Condition()
+        self._metrics = {}
+
+    def start(self):
+        girderformindlogger.logprint.info(
+            'Started %d asynchronous event workers.' % self.workers)
+        with self._condition:
+            self.terminate = False
+            self.stopping = False
+        self.threads = [
+            threading.Thread(target=self.run, daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
 
     def run(self):
         """
-        Loops over all queued events. If the queue is empty, this thread gets
-        put to sleep until someone calls trigger() on it with a new event to
-        dispatch.
+        Handles queued events until the daemon stops. Idle workers sleep
+        until someone calls trigger() with a new event to dispatch.
         """
-        girderformindlogger.logprint.info('Started asynchronous event manager thread.')
-
-        while not self.terminate:
+        while True:
+            with self._condition:
+                while not self._ready and not (
+                    self.stopping or self.terminate
+                ):
+                    self._condition.wait()
+                if self.terminate or not self._ready:
+                    return
+                key = self._ready.popleft()
+                eventName, info, callback, queued = self._pending[key].popleft()
+                self._active.add(key)
+
+            started = time.monotonic()
+            failed = False
             try:
-                eventName, info, callback = self.eventQueue.get(block=False)
                 if eventName is None:
                     event = Event(None, info, asynchronous=True)
                 else:
@@ -151,17 +199,36 @@ class AsyncEventsThread(threading.Thread):
 
                 if callable(callback):
                     callback(event)
-            except queue.Empty:
-                self.queueNotEmpty.acquire()
-                self.queueNotEmpty.wait()
-                self.queueNotEmpty.release()
             except Exception:
                 # Must continue the event loop even if handler failed
+                failed = True
                 girderformindlogger.logger.exception('In handler for event "%s":' % eventName)
+            finished = time.monotonic()
 
-        girderformindlogger.logprint.info('Stopped asynchronous event manager thread.')
-
-    def trigger(self, eventName=None, info=None, callback=None):
+            with self._condition:
+                self._active.discard(key)
+                if self._pending[key]:
+                    self._ready.append(key)
+                    self._condition.notify()
+                else:
+                    del self._pending[key]
+                metrics = self._metrics.setdefault(eventName, {
+                    'count': 0,
+                    'errors': 0,
+                    'latency': 0.0,
+                    'maxLatency': 0.0,
+                    'handlerTime': 0.0,
+                    'maxHandlerTime': 0.0
+                })
+                metrics['count'] += 1
+                metrics['errors'] += int(failed)
+                metrics['latency'] += started - queued
+                metrics['maxLatency'] = max(metrics['maxLatency'], started - queued)
+                metrics['handlerTime'] += finished - started
+                metrics['maxHandlerTime'] = max(
+                    metrics['maxHandlerTime'], finished - started)
+
+    def trigger(self, eventName=None, info=None, callback=None, key=None):
         """
         Adds a new event on the queue to trigger asynchronously.
 
@@ -170,28 +237,83 @@ class AsyncEventsThread(threading.Thread):
         :param callback: Optional callable to be called upon completion of
             all bound event handlers. It takes one argument, which is the
             event object itself.
+        :param key: Events with the same routing key are handled in order.
+            Defaults to the "_id" of info if it has one, and otherwise to the
+            event name.
+        """
+        if key is None:
+            key = _routingKey(eventName, info)
+        with self._condition:
+            pending = self._pending.setdefault(key, collections.deque())
+            pending.append((eventName, info, callback, time.monotonic()))
+            if len(pending) == 1 and key not in self._active:
+                self._ready.append(key)
+                self._condition.notify()
+
+    def stop(self, timeout=DRAIN_TIMEOUT):
         """
-        self.queueNotEmpty.acquire()
-        self.eventQueue.put((eventName, info, callback))
-        self.queueNotEmpty.notify()
-        self.queueNotEmpty.release()
+        Gracefully stops the workers. Queued events are handled for up to a
+        timeout, after which the workers stop once they finish the events
+        they are handling, and the rest are dropped.
 
-    def stop(self):
+        :param timeout: Seconds to wait for queued events to be handled.
+        :type timeout: float
+        """
+        with self._condition:
+            self.stopping = True
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        with self._condition:
+            self.terminate = True
+            self._condition.notify_all()
+            dropped = sum(len(pending) for pending in self._pending.values())
+        if dropped:
+            girderformindlogger.logger.warning(
+                'Dropped %d asynchronous events on shutdown.' % dropped)
+
+    def metrics(self, reset=False):
         """
-        Gracefully stops this thread. Will finish the currently processing
-        event before stopping.
+        Get the number of queued events and, for each event name, the number
+        of events handled and failed, and the total and longest times in
+        seconds they waited in the queue ("latency") and took to handle.
+
+        :param reset: Whether to reset the per-event metrics.
+        :type reset: bool
+        :rtype: dict
         """
-        self.queueNotEmpty.acquire()
-        self.terminate = True
-        self.queueNotEmpty.notify()
-        self.queueNotEmpty.release()
+        with self._condition:
+            metrics = {
+                'workers': self.workers,
+                'queueDepth': sum(
+                    len(pending) for pending in self._pending.values()),
+                'activeKeys': len(self._active),
+                'events': {
+                    str(name): dict(values)
+                    for name, values in self._metrics.items()
+                }
+            }
+            if reset:
+                self._metrics = {}
+        return metrics
 
     def __del__(self):
-        # Make sure we stop this thread if it's getting GCed, i.e. daemon was reassigned
-        self.stop()
-        # We had been calling the super class's __del__, but it doesn't have
-        # such a method, so doing so would raise an AttributeError.
-        # super(AsyncEventsThread, self).__del__()
+        # Make sure we stop the workers if the daemon is getting GCed, i.e.
+        # daemon was reassigned
+        with self._condition:
+            self.terminate = True
+            self._condition.notify_all()
+
+
+# Plugins refer to the asynchronous daemon by its former name.
+AsyncEventsThread = AsyncEventsDaemon
+
+
+def _routingKey(eventName, info):
+    if isinstance(info, dict) and info.get('_id') is not None:
+        return str(info['_id'])
+    return eventName
 
 
 def bind(eventName, handlerName, handler):
@@ -299,6 +421,43 @@ def trigger(eventName, info=None, pre=None, asynchronous=False, daemon=False):
     return e
 
 
+def triggerBatch(batchEventName, eventName, infos):
+    """
+    Fire an event for a batch of infos. The batch event is fired once, with
+    the list of infos, and then the single event is fired for each info, but
+    only to the handlers that are not also bound to the batch event under the
+    same handler name. A handler can therefore take over whole batches by
+    binding to both events under its name, while handlers that only know the
+    single event still see every info.
+
+    :param batchEventName: The name of the event fired with the list of infos.
+    :type batchEventName: str
+    :param eventName: The name of the event fired for each info.
+    :type eventName: str
+    :param infos: The info of each event.
+    :type infos: list
+    :returns: The batch Event, and a list of the single Events, one per info.
+    """
+    batchEvent = trigger(batchEventName, infos)
+    batchHandlers = _mapping.get(batchEventName, {})
+    handlers = [
+        (name, handler) for name, handler in six.viewitems(_mapping.get(eventName, {}))
+        if name not in batchHandlers
+    ]
+    singleEvents = []
+    for info in infos:
+        e = Event(eventName, info)
+        for name, handler in handlers:
+            e.currentHandlerName = name
+            handler(e)
+
+            if e.propagate is False:
+                break
+        singleEvents.append(e)
+
+    return batchEvent, singleEvents
+
+
 _deprecated = {}
 _mapping = {}
 daemon = ForegroundEventsDaemon()
@@ -306,7 +465,9 @@ daemon = ForegroundEventsDaemon()
 
 def setupDaemon():
     global daemon
-    if config.getConfig()['server'].get('disable_event_daemon', False):
+    cfg = config.getConfig()['server']
+    if cfg.get('disable_event_daemon', False):
         daemon = ForegroundEventsDaemon()
     else:
-        daemon = AsyncEventsThread()
+        daemon = AsyncEventsDaemon(
+            int(cfg.get('event_workers', DEFAULT_EVENT_WORKERS)))
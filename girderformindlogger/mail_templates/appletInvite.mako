@@ -0,0 +1,13 @@
+<%include file="_header.mako"/>
+
+% if displayName:
+<p>Hello ${displayName | h},</p>
+% endif
+
+<p>
+<b>${coordinatorName | h}</b> has invited you to be a ${role} of
+<b>${appletName | h}</b>. To accept or decline,
+<a href="${url}">click here</a>.
+</p>
+
+<%include file="_footer.mako"/>
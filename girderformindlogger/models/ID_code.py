@@ -152,26 +152,35 @@ class IDCode(acl_mixin.AccessControlMixin, Model):
         :type idCode: str or None
         :returns: The ID code document that was created.
         """
-        now = datetime.datetime.utcnow()
+        self.createIdCodes([profile], [idCode])
+        return(True)
 
-        try:
-            self.save(
-                {
-                    'code': idCode if idCode is not None else self.generateCode(
-                        profile
-                    ),
-                    'profileId': ObjectId(profile['_id']),
-                    'created': now,
-                    'updated': now,
-                    'size': 0
-                },
-                validate=False
-            )
-            return(True)
-        except Exception as e:
-            import sys, traceback
-            raise e
-            print(sys.exc_info())
+    def createIdCodes(self, profiles, idCodes=None):
+        """
+        Create a new ID code for each of several profiles with one bulk
+        write.
+
+        :param profiles: The profiles for which to create ID codes.
+        :type profiles: list of dicts
+        :param idCodes: The ID code string for each profile, or None to
+            generate one; defaults to generating every code.
+        :type idCodes: list or None
+        :returns: The ID code documents that were created.
+        """
+        now = datetime.datetime.utcnow()
+        idCodes = idCodes if idCodes is not None else [None] * len(profiles)
+
+        return(self.saveMany([
+            {
+                'code': idCode if idCode is not None else self.generateCode(
+                    profile
+                ),
+                'profileId': ObjectId(profile['_id']),
+                'created': now,
+                'updated': now,
+                'size': 0
+            } for profile, idCode in zip(profiles, idCodes)
+        ], validate=False))
 
     def findProfile(self, idCode):
         """
@@ -6,6 +6,8 @@ from six.moves import urllib
 from girderformindlogger import logger, logprint
 from girderformindlogger.external.mongodb_proxy import MongoProxy
 from girderformindlogger.utility import config
+from girderformindlogger.utility.mongo_metrics import CommandRecorder,       \
+    DEFAULT_SLOW_QUERY_MS
 
 _dbClients = {}
 
@@ -61,7 +63,11 @@ def getDbConnection(uri=None, replicaSet=None, autoRetry=True, quiet=False, **kw
         'serverSelectionTimeoutMS': 20000,
         'readPreference': 'secondaryPreferred',
         'replicaSet': replicaSet,
-        'w': 'majority'
+        'w': 'majority',
+        'event_listeners': [CommandRecorder(
+            config.getConfig().get('logging', {}).get(
+                'slow_query_ms', DEFAULT_SLOW_QUERY_MS)
+        )]
     }
 
     # All other options in the [database] section will be passed directly as
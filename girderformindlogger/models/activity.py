@@ -66,68 +66,52 @@ class Activity(Folder):
         """
         # Ensure we include extra fields to do the migration below
         extraFields = {'baseParentId', 'baseParentType', 'parentId',
-                       'parentCollection', 'name', 'lowerName'}
+                       'parentCollection', 'name', 'lowerName', 'folderType'}
         loadFields = self._supplementFields(fields, extraFields)
         doc = super(Folder, self).load(
             id=id, level=level, user=user, objectId=objectId, force=force,
             fields=loadFields, exc=exc)
         if doc is not None:
-            pathFromRoot = Folder().parentsToRoot(doc, user=user, force=True)
-            baseParent = pathFromRoot[0]
-            if 'baseParentType' not in doc:
-                doc['baseParentId'] = baseParent['object']['_id']
-                doc['baseParentType'] = baseParent['type']
-                self.update({'_id': doc['_id']}, {'$set': {
-                    'baseParentId': doc['baseParentId'],
-                    'baseParentType': doc['baseParentType']
-                }})
-            if 'lowerName' not in doc:
-                doc['lowerName'] = doc['name'].lower()
-                self.update({'_id': doc['_id']}, {'$set': {
-                    'lowerName': doc['lowerName']
-                }})
-            if '_modelType' not in doc:
-                doc['_modelType'] = 'folder'
+            folderType = self._folderType(doc, user)
             self._removeSupplementalFields(doc, fields)
+            if folderType == 'activityVersion':
+                """
+                This is an activity version, or an activity in the
+                "Activities" collection. Return it.
+                """
+                return([str(doc['_id']) if '_id' in doc else str(id)])
+            if folderType == 'activity':
+                """
+                This is an activity in an applet. Return its versions, latest
+                first.
+                """
+                latest = Folder().childFolders(
+                    parentType='folder',
+                    parent=doc,
+                    user=user,
+                    sort=[('created', SortDir.DESCENDING)]
+                )
+                return([str(actVer['_id']) for actVer in list(latest)])
+            if folderType == 'applet':
+                raise ValidationException(
+                    "Invalid Activity ID."
+                )
+
+    def _folderType(self, doc, user=None):
+        """
+        Get the stored type of a loaded folder, migrating the folder first
+        if it predates the stored type.
+        """
+        if 'folderType' not in doc:
             try:
-                if(
-                    baseParent['object']['name'].lower()=='activities' and
-                    doc['baseParentType']=='collection'
-                ):
-                    return([str(doc['_id']) if '_id' in doc else str(id)])
-                parent = pathFromRoot[-1]['object']
-                grandparent = pathFromRoot[-2]['object']
-                if (
-                    grandparent['lowerName']=="applets" and
-                    parent['baseParentType'] in {'collection', 'user'}
-                ):
-                    """
-                    Check if grandparent is "Applets" collection or user
-                    folder, ie, if this is an Activity. If so, return latest
-                    version.
-                    """
-                    latest = Folder().childFolders(
-                        parentType='folder',
-                        parent=doc,
-                        user=user,
-                        sort=[('created', SortDir.DESCENDING)]
-                    )
-                    return([str(actVer['_id']) for actVer in list(latest)])
-                greatgrandparent = pathFromRoot[-3]['object']
-                if (
-                    greatgrandparent['lowerName']=="applets" and
-                    parent['baseParentType'] in {'collection', 'user'}
-                ):
-                    """
-                    Check if greatgrandparent is "Applets" collection or user
-                    folder, ie, if this is an Activity version. If so, return
-                    this version.
-                    """
-                    return([str(doc['_id']) if '_id' in doc else str(id)])
+                Folder().migrateFolder(doc, user=user)
             except:
                 raise ValidationException(
                     "Invalid Activity ID."
                 )
+        if '_modelType' not in doc:
+            doc['_modelType'] = 'folder'
+        return(doc['folderType'])
 
 
     def load(self, id, level=AccessType.ADMIN, user=None, objectId=True,
@@ -151,7 +135,7 @@ class Activity(Folder):
         """
         # Ensure we include extra fields to do the migration below
         extraFields = {'baseParentId', 'baseParentType', 'parentId',
-                       'parentCollection', 'name', 'lowerName'}
+                       'parentCollection', 'name', 'lowerName', 'folderType'}
         loadFields = self._supplementFields(fields, extraFields)
         doc = super(Folder, self).load(
             id=id, level=level, user=user, objectId=objectId, force=force,
@@ -167,60 +151,27 @@ class Activity(Folder):
                         refreshCache
                     )[0]
                 )
-            pathFromRoot = Folder().parentsToRoot(doc, user=user, force=True)
-            baseParent = pathFromRoot[0]
-            if 'baseParentType' not in doc:
-                doc['baseParentId'] = baseParent['object']['_id']
-                doc['baseParentType'] = baseParent['type']
-                self.update({'_id': doc['_id']}, {'$set': {
-                    'baseParentId': doc['baseParentId'],
-                    'baseParentType': doc['baseParentType']
-                }})
-            if 'lowerName' not in doc:
-                doc['lowerName'] = doc['name'].lower()
-                self.update({'_id': doc['_id']}, {'$set': {
-                    'lowerName': doc['lowerName']
-                }})
-            if '_modelType' not in doc:
-                doc['_modelType'] = 'folder'
+            folderType = self._folderType(doc, user)
             self._removeSupplementalFields(doc, fields)
-            try:
-                if(
-                    baseParent['object']['name'].lower()=='activities' and
-                    doc['baseParentType']=='collection'
-                ):
-                    return(doc)
-                parent = pathFromRoot[-1]['object']
-                grandparent = pathFromRoot[-2]['object']
-                if (
-                    grandparent['lowerName']=="applets" and
-                    parent['baseParentType'] in {'collection', 'user'}
-                ):
-                    """
-                    Check if grandparent is "Applets" collection or user
-                    folder, ie, if this is an Activity. If so, return latest
-                    version.
-                    """
-                    latest = Folder().childFolders(
-                        parentType='folder',
-                        parent=doc,
-                        user=user,
-                        sort=[('created', SortDir.DESCENDING)],
-                        limit=1
-                    )
-                    return(latest[0])
-                greatgrandparent = pathFromRoot[-3]['object']
-                if (
-                    greatgrandparent['lowerName']=="applets" and
-                    parent['baseParentType'] in {'collection', 'user'}
-                ):
-                    """
-                    Check if greatgrandparent is "Applets" collection or user
-                    folder, ie, if this is an Activity version. If so, return
-                    this version.
-                    """
-                    return(doc)
-            except:
+            if folderType == 'activityVersion':
+                """
+                This is an activity version, or an activity in the
+                "Activities" collection. Return it.
+                """
+                return(doc)
+            if folderType == 'activity':
+                """
+                This is an activity in an applet. Return its latest version.
+                """
+                latest = Folder().childFolders(
+                    parentType='folder',
+                    parent=doc,
+                    user=user,
+                    sort=[('created', SortDir.DESCENDING)],
+                    limit=1
+                )
+                return(latest[0])
+            if folderType == 'applet':
                 raise ValidationException(
                     "Invalid Activity ID."
                 )
@@ -22,6 +22,7 @@ import datetime
 import itertools
 import json
 import os
+import re
 import six
 import threading
 
@@ -81,15 +82,17 @@ class Applet(Folder):
             appletsCollection = CollectionModel().findOne({"name": "Applets"})
 
         # create new applet
+        folder = self.createFolder(
+            parent=appletsCollection,
+            name=name,
+            parentType='collection',
+            public=True,
+            creator=user,
+            allowRename=True
+        )
+        folder['folderType'] = 'applet'
         applet = self.setMetadata(
-            folder=self.createFolder(
-                parent=appletsCollection,
-                name=name,
-                parentType='collection',
-                public=True,
-                creator=user,
-                allowRename=True
-            ),
+            folder=folder,
             metadata={
                 'protocol': protocol,
                 'applet': constraints if constraints is not None and isinstance(
@@ -105,36 +108,41 @@ class Applet(Folder):
         )
 
         print("Name: {}".format(appletGroupName))
-        # Create user groups
+        # Create user groups, numbering their names past any that are taken
+        existing = {group['lowerName'] for group in GroupModel().find(
+            {'lowerName': {
+                '$regex': '^{}'.format(re.escape(appletGroupName.lower()))
+            }},
+            fields=['lowerName']
+        )}
+        groupNames = {}
         for role in USER_ROLES.keys():
-            try:
-                group = GroupModel().createGroup(
-                    name="{} {}s".format(appletGroupName, role.title()),
-                    creator=user,
-                    public=False if role=='user' else True
-                )
-            except ValidationException:
-                numero = 0
-                numberedName = appletGroupName
-                while GroupModel().findOne(query={'name': numberedName}):
-                    numero += 1
-                    numberedName = "{} {} {}s".format(
-                        appletGroupName,
-                        str(numero),
-                        role.title()
-                    )
-                group = GroupModel().createGroup(
-                    name=numberedName,
-                    creator=user,
-                    public=False if role=='user' else True
+            numero = 0
+            groupName = "{} {}s".format(appletGroupName, role.title())
+            while groupName.lower() in existing:
+                numero += 1
+                groupName = "{} {} {}s".format(
+                    appletGroupName,
+                    str(numero),
+                    role.title()
                 )
+            groupNames[role] = groupName
+        groups = GroupModel().createGroups([
+            {
+                'name': groupNames[role],
+                'public': False if role=='user' else True
+            } for role in USER_ROLES.keys()
+        ], creator=user)
+        for role, group in zip(USER_ROLES.keys(), groups):
             self.setGroupRole(
                 doc=applet,
                 group=group,
                 role=role,
                 currentUser=user,
-                force=False
+                force=False,
+                save=False
             )
+        applet = self._saveRole(applet, {'$set': {'roles': applet['roles']}})
         return(jsonld_expander.formatLdObject(
             applet,
             'applet',
@@ -215,44 +223,174 @@ class Applet(Folder):
         :type appletId: ObjectId or str
         :param reviewer: Reviewer making request
         :type reviewer: dict
-        :param filter: reduction criteria (not yet implemented)
+        :param filter: additional query criteria for the response items
         :type filter: dict
         :reutrns: TBD
         """
-        from .ID_code import IDCode
-        from .profile import Profile
+        return(list(self.iterResponseData(appletId, reviewer, filter)))
+
+    def iterResponseData(self, appletId, reviewer, filter={}, fields=None,
+                         batchSize=500):
+        """
+        Lazily collect response data available to given reviewer. Responses
+        are read from a batched cursor and respondent ID codes are resolved
+        from a single prefetched map, so memory use does not grow with the
+        number of responses.
+
+        :param appletId: ID of applet for which to get response data
+        :type appletId: ObjectId or str
+        :param reviewer: Reviewer making request
+        :type reviewer: dict
+        :param filter: additional query criteria for the response items, eg,
+            ``{"created": {"$gte": startDate}}``
+        :type filter: dict
+        :param fields: fields of the response items to read, or None for the
+            full documents
+        :type fields: list or None
+        :param batchSize: Number of responses to fetch per cursor batch
+        :type batchSize: int
+        :returns: generator of dicts
+        """
         from .response_folder import ResponseItem
-        from .user import User
         from pymongo import DESCENDING
 
+        # Check access now rather than on first iteration so a streaming
+        # caller can still fail the request before any output is sent.
         if not self._hasRole(appletId, reviewer, 'reviewer'):
             raise AccessException("You are not a reviewer for this applet.")
-        query = {
+        query = self._responseDataQuery(appletId, filter)
+        respondents = self.respondentCodes(
+            appletId,
+            ResponseItem().collection.distinct('baseParentId', query)
+        )
+
+        def responseData():
+            responses = ResponseItem().find(
+                query=query,
+                fields=fields,
+                sort=[("created", DESCENDING)]
+            ).batch_size(batchSize)
+            for response in responses:
+                for code in respondents.get(
+                    str(response.get('baseParentId')),
+                    []
+                ):
+                    yield {
+                        "respondent": code,
+                        **response.get('meta', {})
+                    }
+
+        return(responseData())
+
+    def getResponseDataFields(self, appletId, filter={}):
+        """
+        Get the column names of the response data for an applet without
+        loading the responses themselves.
+
+        :param appletId: ID of applet for which to get response data
+        :type appletId: ObjectId or str
+        :param filter: additional query criteria for the response items
+        :type filter: dict
+        :returns: list of str
+        """
+        from .response_folder import ResponseItem
+
+        return(["respondent"] + sorted([
+            field['_id'] for field in ResponseItem().collection.aggregate([
+                {"$match": self._responseDataQuery(appletId, filter)},
+                {"$project": {"fields": {"$objectToArray": "$meta"}}},
+                {"$unwind": "$fields"},
+                {"$group": {"_id": "$fields.k"}}
+            ]) if field['_id'] != "respondent"
+        ]))
+
+    def getResponseItemTypes(self, appletId, filter={}):
+        """
+        Get the BSON types of the values stored for each item IRI in the
+        responses to an applet, without loading the responses themselves.
+
+        :param appletId: ID of applet for which to get response data
+        :type appletId: ObjectId or str
+        :param filter: additional query criteria for the response items
+        :type filter: dict
+        :returns: dict of {itemIRI: set of BSON type aliases}
+        """
+        from .response_folder import ResponseItem
+
+        return({
+            item['_id']: set(item['types']) for item in ResponseItem(
+            ).collection.aggregate([
+                {"$match": self._responseDataQuery(appletId, filter)},
+                {"$project": {
+                    "items": {"$objectToArray": "$meta.responses"}
+                }},
+                {"$unwind": "$items"},
+                {"$group": {
+                    "_id": "$items.k",
+                    "types": {"$addToSet": {"$type": "$items.v"}}
+                }}
+            ])
+        })
+
+    def _responseDataQuery(self, appletId, filter={}):
+        return({
+            **(filter if isinstance(filter, dict) else {}),
             "baseParentType": "user",
             "meta.applet.@id": ObjectId(appletId)
+        })
+
+    def respondentCodes(self, appletId, userIds):
+        """
+        Map each of the given users to their ID codes for an applet, using
+        one query for profiles and one for ID codes. Profiles and codes are
+        only created individually for users who don't have them yet.
+
+        :param appletId: ID of applet
+        :type appletId: ObjectId or str
+        :param userIds: IDs of the users to look up
+        :type userIds: iterable
+        :returns: dict of {str(userId): [str]}
+        """
+        from .ID_code import IDCode
+        from .profile import Profile
+        from .user import User
+
+        userIds = [ObjectId(userId) for userId in userIds if userId]
+        profiles = {
+            str(profile['userId']): profile['_id'] for profile in Profile(
+            ).find(
+                {
+                    'appletId': ObjectId(appletId),
+                    'userId': {'$in': userIds},
+                    'profile': True
+                },
+                fields=['_id', 'userId']
+            )
         }
-        responses = list(ResponseItem().find(
-            query=query,
-            user=reviewer,
-            sort=[("created", DESCENDING)]
-        ))
-        respondents = {
-            str(response['baseParentId']): IDCode().findIdCodes(
-                Profile().createProfile(
+        codes = {}
+        for idCode in IDCode().find(
+            {'profileId': {'$in': list(itertools.chain.from_iterable([
+                [profileId, str(profileId)] for profileId in profiles.values()
+            ]))}},
+            fields=['profileId', 'code']
+        ):
+            if 'code' in idCode:
+                codes.setdefault(str(idCode['profileId']), []).append(
+                    idCode['code']
+                )
+        respondents = {}
+        for userId in userIds:
+            profileId = profiles.get(str(userId))
+            if profileId is None:
+                profileId = Profile().createProfile(
                     appletId,
-                    User().load(response['baseParentId'], force=True),
+                    User().load(userId, force=True),
                     'user'
                 )['_id']
-            ) for response in responses if 'baseParentId' in response
-        }
-        return([
-            {
-                "respondent": code,
-                **response.get('meta', {})
-            } for response in responses for code in respondents[
-                str(response['baseParentId'])
-            ]
-        ])
+            respondents[str(userId)] = codes.get(
+                str(profileId)
+            ) or IDCode().findIdCodes(profileId)
+        return(respondents)
 
     def updateRelationship(self, applet, relationship):
         """
@@ -263,7 +401,8 @@ class Applet(Folder):
         :returns: updated Applet
         """
         from bson.json_util import dumps
-        from girderformindlogger.utility.jsonld_expander import loadCache
+        from girderformindlogger.utility.jsonld_expander import cacheVersion, \
+            loadCache
 
         if not isinstance(relationship, str):
             raise TypeError("Applet relationship must be defined as a string.")
@@ -277,6 +416,7 @@ class Applet(Folder):
         if 'applet' in applet['cached']:
             applet['cached']['applet']['informantRelationship'] = relationship
         applet['cached'] = dumps(applet['cached'])
+        applet['cachedVersion'] = cacheVersion()
         return(self.save(applet, validate=False))
 
     def unexpanded(self, applet):
@@ -340,6 +480,32 @@ class Applet(Folder):
     def isManager(self, appletId, user):
         return(self._hasRole(appletId, user, 'manager'))
 
+    def getActivityIndex(self, applet, user=None):
+        """
+        List the activities of an Applet without formatting the whole Applet.
+        The index is saved with the Applet's cache; Applets cached before the
+        index existed are indexed on first use.
+
+        :param applet: Applet, with at least its "_id" and "activityIndex"
+            fields if it has one
+        :type applet: dict
+        :param user: User making the request
+        :type user: dict
+        :returns: list of dicts with the keys "_id" and "url"
+        """
+        from girderformindlogger.utility.jsonld_expander import                \
+            activityIndex, formatLdObject
+
+        if isinstance(applet.get('activityIndex'), list):
+            return(applet['activityIndex'])
+        index = activityIndex(formatLdObject(
+            self.load(applet['_id'], force=True),
+            'applet',
+            user
+        ))
+        self.update({'_id': applet['_id']}, {'$set': {'activityIndex': index}})
+        return(index)
+
     def _hasRole(self, appletId, user, role):
         from .profile import Profile
 
@@ -399,6 +565,7 @@ class Applet(Folder):
         from girderformindlogger.utility import jsonld_expander
 
         applets=self.getAppletsForUser(role, user, active)
+        UserModel().loadCached(user)
         user['cached'] = user.get('cached', {})
         user['cached'] = json_util.loads(user['cached']) if isinstance(
             user['cached'], str
@@ -486,7 +653,7 @@ class Applet(Folder):
         thread.start()
         return(postformatted)
 
-    def getAppletsForUser(self, role, user, active=True):
+    def getAppletsForUser(self, role, user, active=True, fields=None):
         """
         Method get Applets for a User.
 
@@ -496,6 +663,9 @@ class Applet(Folder):
         :type user: dict
         :param active: Only return active Applets?
         :type active: bool
+        :param fields: Fields of the Applets to return, or None for the
+            whole documents
+        :type fields: list or None
         :returns: list of dicts
         """
         user = UserModel().load(
@@ -513,19 +683,22 @@ class Applet(Folder):
                         []
                     )},
                     'meta.applet.deleted': {'$ne': active}
-                }
+                },
+                fields=fields
             )),
             *list(self.find(
                 {
                     'roles.manager.groups.id': {'$in': user.get('groups', [])},
                     'meta.applet.deleted': {'$ne': active}
-                }
+                },
+                fields=fields
             ))
         ] if role=="coordinator" else list(self.find(
             {
                 'roles.' + role + '.groups.id': {'$in': user.get('groups', [])},
                 'meta.applet.deleted': {'$ne': active}
-            }
+            },
+            fields=fields
         )) if active else [
             *list(self.find(
                 {
@@ -533,17 +706,20 @@ class Applet(Folder):
                         'groups',
                         []
                     )}
-                }
+                },
+                fields=fields
             )),
             *list(self.find(
                 {
                     'roles.manager.groups.id': {'$in': user.get('groups', [])}
-                }
+                },
+                fields=fields
             ))
         ] if role=="coordinator" else list(self.find(
             {
                 'roles.' + role + '.groups.id': {'$in': user.get('groups', [])}
-            }
+            },
+            fields=fields
         ))
 
         # filter out duplicates for coordinators
@@ -677,44 +853,26 @@ class Applet(Folder):
         """
         # Ensure we include extra fields to do the migration below
         extraFields = {'baseParentId', 'baseParentType', 'parentId',
-                       'parentCollection', 'name', 'lowerName'}
+                       'parentCollection', 'name', 'lowerName', 'folderType'}
         loadFields = self._supplementFields(fields, extraFields)
         doc = super(Folder, self).load(
             id=id, level=level, user=user, objectId=objectId, force=force,
             fields=loadFields, exc=exc)
         if doc is not None:
-            pathFromRoot = Folder().parentsToRoot(doc, user=user, force=True)
-            if 'baseParentType' not in doc:
-                baseParent = pathFromRoot[0]
-                doc['baseParentId'] = baseParent['object']['_id']
-                doc['baseParentType'] = baseParent['type']
-                self.update({'_id': doc['_id']}, {'$set': {
-                    'baseParentId': doc['baseParentId'],
-                    'baseParentType': doc['baseParentType']
-                }})
-            if 'lowerName' not in doc:
-                doc['lowerName'] = doc['name'].lower()
-                self.update(
-                    {'_id': doc['_id']},
-                    {'$set': {
-                        'lowerName': doc['lowerName']
-                    }}
-                )
+            if 'folderType' not in doc:
+                try:
+                    Folder().migrateFolder(doc, user=user)
+                except:
+                    raise ValidationException(
+                        "Invalid Applet ID."
+                    )
+            folderType = doc['folderType']
             if '_modelType' not in doc:
                 doc['_modelType'] = 'folder'
             self._removeSupplementalFields(doc, fields)
-            try:
-                parent = pathFromRoot[-1]['object']
-                if (
-                    parent['name'] == "Applets" and
-                    doc['baseParentType'] in {'collection', 'user'}
-                ):
-                    """
-                    Check if parent is "Applets" collection or user
-                    folder, ie, if this is an Applet. If so, return Applet.
-                    """
-                    return(doc)
-            except:
-                raise ValidationException(
-                    "Invalid Applet ID."
-                )
+            if folderType == 'applet':
+                """
+                Check if parent is "Applets" collection or user folder, ie, if
+                this is an Applet. If so, return Applet.
+                """
+                return(doc)
@@ -7,11 +7,15 @@ import six
 
 from bson.objectid import ObjectId
 from .model_base import AccessControlledModel
-from girderformindlogger import events
+from girderformindlogger import auditLogger, events, logger
 from girderformindlogger.constants import AccessType
 from girderformindlogger.exceptions import ValidationException, GirderException
 from girderformindlogger.utility.model_importer import ModelImporter
 from girderformindlogger.utility.progress import noProgress, setResponseTimeLimit
+from pymongo.errors import DuplicateKeyError
+
+# Paths from the root deeper than this are taken to be cyclic.
+MAX_FOLDER_DEPTH = 100
 
 
 class Folder(AccessControlledModel):
@@ -30,6 +34,7 @@ class Folder(AccessControlledModel):
                 'parentId',
                 'name',
                 'lowerName',
+                'ancestors._id',
                 'meta.activity.@type',
                 'meta.protocol.@type',
                 'meta.protocol.url',
@@ -41,7 +46,12 @@ class Folder(AccessControlledModel):
                     ('meta.activity.@type', 1),
                     ('meta.protocol.url', 1),
                     ('meta.activity.url', 1)
-                ], {})
+                ], {}),
+                ([
+                    ('parentId', 1),
+                    ('parentCollection', 1),
+                    ('name', 1)
+                ], {'unique': True})
             )
         )
         self.ensureTextIndex({
@@ -258,19 +268,27 @@ class Folder(AccessControlledModel):
         """
         from .item import Item
 
+        # Descendants with stored ancestors are updated at once; older ones
+        # are found a level at a time.
         self.update(query={
-            'parentId': folderId,
-            'parentCollection': 'folder'
+            'ancestors._id': folderId
         }, update=updateQuery, multi=True)
         Item().update(query={
-            'folderId': folderId,
+            'ancestors._id': folderId
         }, update=updateQuery, multi=True)
 
         q = {
             'parentId': folderId,
-            'parentCollection': 'folder'
+            'parentCollection': 'folder',
+            'ancestors': {'$exists': False}
         }
-        for child in self.find(q):
+        self.update(query=q, update=updateQuery, multi=True)
+        Item().update(query={
+            'folderId': folderId,
+            'ancestors': {'$exists': False}
+        }, update=updateQuery, multi=True)
+
+        for child in self.find(q, fields=['_id']):
             self._updateDescendants(child['_id'], updateQuery)
 
     def _isAncestor(self, ancestor, descendant):
@@ -286,6 +304,12 @@ class Folder(AccessControlledModel):
         if ancestor['_id'] == descendant['_id']:
             return True
 
+        if 'ancestors' in descendant:
+            return any(
+                parent['_id'] == ancestor['_id']
+                for parent in descendant['ancestors']
+            )
+
         if descendant['parentCollection'] != 'folder':
             return False
 
@@ -296,6 +320,28 @@ class Folder(AccessControlledModel):
 
         return self._isAncestor(ancestor, descendant)
 
+    def _moveDescendants(self, folder, ancestors):
+        """
+        Replace the ancestors above a folder in the stored ancestors of every
+        folder and item below it, with two bulk updates per collection.
+
+        :param folder: The folder being moved, with its old ancestors.
+        :type folder: dict
+        :param ancestors: The folder's new ancestors.
+        :type ancestors: list
+        """
+        from .item import Item
+
+        for model in (self, Item()):
+            model.update({'ancestors._id': folder['_id']}, {'$pull': {
+                'ancestors': {'_id': {'$in': [
+                    parent['_id'] for parent in folder['ancestors']
+                ]}}
+            }})
+            model.update({'ancestors._id': folder['_id']}, {'$push': {
+                'ancestors': {'$each': ancestors, '$position': 0}
+            }})
+
     def move(self, folder, parent, parentType):
         """
         Move the given folder from its current parent to another parent object.
@@ -316,6 +362,14 @@ class Folder(AccessControlledModel):
         folder['parentId'] = parent['_id']
         folder['parentCollection'] = parentType
 
+        if 'ancestors' in folder:
+            ancestors = self.childAncestors(parent, parentType)
+            self._moveDescendants(folder, ancestors)
+            folder['ancestors'] = ancestors
+
+        folder['folderType'] = self.getFolderType(
+            folder, self.parentsToRoot(folder, force=True))
+
         if parentType == 'folder':
             rootType, rootId = parent['baseParentType'], parent['baseParentId']
         else:
@@ -340,7 +394,37 @@ class Folder(AccessControlledModel):
                 }
             })
 
-        return self.save(folder)
+        folder = self.save(folder)
+        self._updateFolderTypes(folder)
+        return folder
+
+    def _updateFolderTypes(self, folder):
+        """
+        Recompute the stored "folderType" of every folder below a folder that
+        has moved, a level at a time.
+
+        :param folder: The moved folder, as saved.
+        :type folder: dict
+        """
+        ancestors = {}
+        parentIds = [folder['_id']]
+        while len(parentIds):
+            children = list(self.find({
+                'parentId': {'$in': parentIds},
+                'parentCollection': 'folder'
+            }, fields=['name', 'parentId', 'parentCollection', 'folderType']))
+            paths = self._pathsFromRoot(children, ancestors)
+            updates = []
+            for child in children:
+                if paths[child['_id']] is None:
+                    continue
+                folderType = self.getFolderType(child, paths[child['_id']])
+                if child.get('folderType') != folderType:
+                    updates.append(({'_id': child['_id']}, {
+                        '$set': {'folderType': folderType}}))
+                ancestors[('folder', child['_id'])] = child
+            self.updateMany(updates, multi=False)
+            parentIds = [child['_id'] for child in children]
 
     def clean(self, folder, progress=None, **kwargs):
         """
@@ -476,7 +560,8 @@ class Folder(AccessControlledModel):
         return iter(cursor)
 
     def createFolder(self, parent, name, description='', parentType='folder',
-                     public=None, creator=None, allowRename=False, reuseExisting=False):
+                     public=None, creator=None, allowRename=False, reuseExisting=False,
+                     upsert=False):
         """
         Create a new folder under the given parent.
 
@@ -501,9 +586,13 @@ class Folder(AccessControlledModel):
             under the given parent, return that folder rather than creating a
             new one.
         :type reuseExisting: bool
+        :param upsert: With reuseExisting, find or create the folder with a
+            single upsert instead of a lookup followed by a save, which is
+            safe when several requests create the same folder at once.
+        :type upsert: bool
         :returns: The folder document that was created.
         """
-        if reuseExisting:
+        if reuseExisting and not upsert:
             existing = self.findOne({
                 'parentId': parent['_id'],
                 'name': name,
@@ -540,6 +629,7 @@ class Folder(AccessControlledModel):
             'parentCollection': parentType,
             'baseParentId': parent['baseParentId'],
             'baseParentType': parent['baseParentType'],
+            'ancestors': self.childAncestors(parent, parentType, creator),
             'parentId': ObjectId(parent['_id']),
             'creatorId': creatorId,
             'created': now,
@@ -565,9 +655,60 @@ class Folder(AccessControlledModel):
         if allowRename:
             self.validate(folder, allowRename=True)
 
+        if reuseExisting and upsert:
+            return self._upsertFolder(folder)
+
         # Now validate and save the folder.
         return self.save(folder)
 
+    def _upsertFolder(self, folder):
+        """
+        Find a folder by its name and parent, or create it, with one upsert.
+        The folder is validated as by save, except that a folder of the same
+        name is reused rather than a conflict; the unique index on parent and
+        name keeps concurrent upserts from creating it twice.
+        """
+        from .item import Item
+
+        folder['name'] = folder['name'].strip()
+        folder['lowerName'] = folder['name'].lower()
+        folder['description'] = folder['description'].strip()
+        if not folder['name']:
+            raise ValidationException('Folder name must not be empty.', 'name')
+        query = {
+            'parentId': folder['parentId'],
+            'name': folder['name'],
+            'parentCollection': folder['parentCollection']
+        }
+        if folder['parentCollection'] == 'folder' and Item().findOne({
+            'folderId': folder['parentId'],
+            'name': folder['name']
+        }, fields=['_id']):
+            raise ValidationException('An item with that name already '
+                                      'exists here.', 'name')
+        try:
+            result = self.collection.update_one(
+                query,
+                {'$setOnInsert': folder},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # A concurrent request created the folder first.
+            return self.findOne(query)
+        if result.upserted_id is None:
+            return self.findOne(query)
+        folder['_id'] = result.upserted_id
+        self._invalidateCaches(folder['_id'])
+        auditLogger.info('document.create', extra={
+            'details': {
+                'collection': self.name,
+                'id': folder['_id']
+            }
+        })
+        events.trigger('model.%s.save.created' % self.name, folder)
+        events.trigger('model.%s.save.after' % self.name, folder)
+        return folder
+
     def updateFolder(self, folder):
         """
         Updates a folder.
@@ -601,6 +742,12 @@ class Folder(AccessControlledModel):
         :returns: an ordered list of dictionaries from root to the current folder
         """
         curPath = curPath or []
+        if folder.get('ancestors'):
+            pathFromRoot = self._ancestorsToRoot(
+                folder['ancestors'], user=user, force=force, level=level)
+            if pathFromRoot is not None:
+                return pathFromRoot + curPath
+
         curParentId = folder['parentId']
         curParentType = folder['parentCollection']
 
@@ -626,11 +773,263 @@ class Folder(AccessControlledModel):
 
             return self.parentsToRoot(curParentObject, curPath, user=user, force=force)
 
+    def _ancestorsToRoot(self, ancestors, user=None, force=False,
+                         level=AccessType.READ):
+        """
+        Load stored ancestors in the form returned by parentsToRoot, with
+        one query for the root and one for all of the folders.
+
+        :returns: The path from the root, or None if an ancestor is missing.
+        """
+        root = ancestors[0]
+        rootObject = ModelImporter.model(root['type']).load(
+            root['_id'], user=user, level=level, force=force)
+        if rootObject is None:
+            return None
+        folders = {
+            doc['_id']: doc for doc in self.find({'_id': {'$in': [
+                parent['_id'] for parent in ancestors[1:]
+            ]}})
+        } if len(ancestors) > 1 else {}
+        if len(folders) != len(ancestors) - 1:
+            return None
+        path = [{
+            'type': root['type'],
+            'object': rootObject if force else ModelImporter.model(
+                root['type']).filter(rootObject, user)
+        }]
+        for parent in ancestors[1:]:
+            parentObject = folders[parent['_id']]
+            if not force:
+                self.requireAccess(parentObject, user, level)
+                parentObject = self.filter(parentObject, user)
+            path.append({'type': 'folder', 'object': parentObject})
+        return path
+
+    def getAncestors(self, folder, user=None):
+        """
+        Get the stored ancestors of a folder: the _id and type of each of
+        its parents, from the root down. For folders created before
+        ancestors were stored, they are found from the folder's parents.
+
+        :param folder: The folder.
+        :type folder: dict
+        :returns: list of dicts with the keys "_id" and "type"
+        """
+        if 'ancestors' in folder:
+            return(folder['ancestors'])
+        return([
+            {'_id': parent['object']['_id'], 'type': parent['type']}
+            for parent in self.parentsToRoot(folder, user=user, force=True)
+        ])
+
+    def childAncestors(self, parent, parentType='folder', user=None):
+        """
+        Get the ancestors to store on a new child of a folder, user or
+        collection.
+
+        :param parent: The parent document.
+        :type parent: dict
+        :param parentType: The type of the parent.
+        :type parentType: str
+        :returns: list of dicts with the keys "_id" and "type"
+        """
+        ancestors = []
+        if parentType == 'folder':
+            if 'ancestors' not in parent and 'parentId' not in parent:
+                parent = self.load(parent['_id'], force=True, fields=[
+                    'ancestors', 'parentId', 'parentCollection'])
+            ancestors = self.getAncestors(parent, user=user)
+        return(ancestors + [{'_id': ObjectId(parent['_id']), 'type': parentType}])
+
+    def getFolderType(self, folder, pathFromRoot):
+        """
+        Determine what a folder holds from its path. This is stored on folders
+        as "folderType" so that loading an applet or activity doesn't need to
+        load every ancestor.
+
+        :param folder: The folder.
+        :type folder: dict
+        :param pathFromRoot: The folder's ancestors, as returned by
+            :py:meth:`parentsToRoot`.
+        :type pathFromRoot: list
+        :returns: 'applet' for a folder in the "Applets" collection or a
+            user's "Applets" folder, 'activity' for an applet's activity,
+            'activityVersion' for a version of an activity or an activity in
+            the "Activities" collection, or 'folder' for anything else.
+        :rtype: str
+        """
+        # A folder and its ancestors share a base parent: the root of the path
+        baseParentType = pathFromRoot[0]['type']
+        parents = [(parent['object'] or {}) for parent in pathFromRoot]
+        if (
+            parents[-1].get('name') == 'Applets' and
+            baseParentType in {'collection', 'user'}
+        ):
+            return('applet')
+        if (
+            parents[0].get('name', '').lower() == 'activities' and
+            baseParentType == 'collection'
+        ):
+            return('activityVersion')
+        for depth, folderType in [(2, 'activity'), (3, 'activityVersion')]:
+            if len(parents) >= depth and (
+                parents[-depth].get('name', '').lower() == 'applets' and
+                baseParentType in {'collection', 'user'}
+            ):
+                return(folderType)
+        return('folder')
+
+    def _migrationUpdate(self, folder, pathFromRoot, ancestors=False):
+        update = {'folderType': self.getFolderType(folder, pathFromRoot)}
+        if ancestors and 'ancestors' not in folder:
+            update['ancestors'] = [
+                {'_id': parent['object']['_id'], 'type': parent['type']}
+                for parent in pathFromRoot
+            ]
+        if 'baseParentType' not in folder or 'baseParentId' not in folder:
+            update['baseParentId'] = pathFromRoot[0]['object']['_id']
+            update['baseParentType'] = pathFromRoot[0]['type']
+        if 'lowerName' not in folder:
+            update['lowerName'] = folder['name'].lower()
+        if '_modelType' not in folder:
+            update['_modelType'] = 'folder'
+        return(update)
+
+    def migrateFolder(self, folder, user=None):
+        """
+        Backfill the stored fields that folders created by older versions
+        lack ("baseParentId", "baseParentType", "lowerName", "_modelType"
+        and "folderType") with a single update. The folder is updated in
+        place. ``girderformindlogger migrate`` does this for every folder at
+        once.
+
+        :param folder: The folder, with at least its name, parentId,
+            parentCollection and any of the above fields it has.
+        :type folder: dict
+        :returns: The folder.
+        """
+        update = self._migrationUpdate(
+            folder,
+            self.parentsToRoot(folder, user=user, force=True)
+        )
+        self.update({'_id': folder['_id']}, {'$set': update}, multi=False)
+        folder.update(update)
+        return(folder)
+
+    def _pathsFromRoot(self, folders, ancestors):
+        """
+        Find the paths from the root of a batch of folders, loading their
+        ancestors a level at a time.
+
+        :param ancestors: Ancestors already loaded, by (type, _id), which is
+            updated with those loaded.
+        :type ancestors: dict
+        :returns: Each folder's path, as returned by parentsToRoot, or None if
+            one of its ancestors is missing or its path is cyclic (which is
+            logged), by folder _id.
+        """
+        pending = folders
+        while len(pending):
+            missing = {}
+            for folder in pending:
+                key = (folder['parentCollection'], folder['parentId'])
+                if key not in ancestors:
+                    missing.setdefault(key[0], set()).add(key[1])
+            pending = []
+            for parentType, ids in six.viewitems(missing):
+                found = {
+                    doc['_id']: doc for doc in ModelImporter.model(
+                        parentType
+                    ).find({'_id': {'$in': list(ids)}}, fields=[
+                        'name', 'lowerName', 'parentId', 'parentCollection',
+                        'baseParentType'
+                    ])
+                }
+                for id in ids:
+                    ancestors[(parentType, id)] = found.get(id)
+                    if parentType == 'folder' and id in found:
+                        pending.append(found[id])
+        paths = {}
+        for folder in folders:
+            path = []
+            current = folder
+            while True:
+                parentType = current['parentCollection']
+                parent = ancestors.get((parentType, current['parentId']))
+                if parent is None:
+                    path = None
+                    break
+                path.insert(0, {'type': parentType, 'object': parent})
+                if parentType in ('user', 'collection'):
+                    break
+                if len(path) >= MAX_FOLDER_DEPTH:
+                    logger.warning(
+                        'Folder %s is more than %d levels deep; its path is '
+                        'probably cyclic.', folder['_id'], MAX_FOLDER_DEPTH)
+                    path = None
+                    break
+                current = parent
+            paths[folder['_id']] = path
+        return(paths)
+
+    def migrateFolders(self, batchSize=1000):
+        """
+        Backfill the stored fields that folders created by older versions
+        lack (see :py:meth:`migrateFolder`) and their "ancestors" for every
+        folder, with one bulk update per batch. This can be interrupted and
+        run again; each run only visits folders that are still missing
+        fields.
+
+        Subtree queries assume that a folder's descendants have stored
+        ancestors if it has them, which only holds once this has run to
+        completion and :py:meth:`girderformindlogger.models.item.Item.migrateItems`
+        has followed it. Ancestors are never stored on a single folder.
+
+        :param batchSize: The number of folders to update at a time.
+        :type batchSize: int
+        :returns: A generator of the number of folders updated and skipped
+            (for having a missing ancestor or a cyclic path) in each batch.
+        """
+        query = {'$or': [{field: {'$exists': False}} for field in [
+            'baseParentId', 'baseParentType', 'lowerName', '_modelType',
+            'folderType', 'ancestors'
+        ]]}
+        ancestors = {}
+        lastId = None
+        while True:
+            batch = list(self.find(
+                query if lastId is None else {
+                    '$and': [query, {'_id': {'$gt': lastId}}]
+                },
+                sort=[('_id', 1)],
+                limit=batchSize,
+                fields=[
+                    'name', 'lowerName', 'parentId', 'parentCollection',
+                    'baseParentId', 'baseParentType', '_modelType', 'ancestors'
+                ]
+            ))
+            if not len(batch):
+                return
+            lastId = batch[-1]['_id']
+            if len(ancestors) > 100 * batchSize:
+                ancestors = {}
+            paths = self._pathsFromRoot(batch, ancestors)
+            updates = [
+                ({'_id': folder['_id']}, {'$set': self._migrationUpdate(
+                    folder, paths[folder['_id']], ancestors=True
+                )}) for folder in batch if paths[folder['_id']]
+            ]
+            self.updateMany(updates, multi=False)
+            yield len(updates), len(batch) - len(updates)
+
     def countItems(self, folder):
         """
         Returns the number of items within the given folder.
         """
-        return self.childItems(folder, fields=()).count()
+        from .item import Item
+
+        return Item().collection.count_documents({'folderId': folder['_id']})
 
     def countFolders(self, folder, user=None, level=None):
         """
@@ -644,14 +1043,14 @@ class Folder(AccessControlledModel):
         :param level: The required access level, or None to return the raw
             subfolder count.
         """
-        fields = () if level is None else ('access', 'public')
-
-        folders = self.findWithPermissions({
+        query = {
             'parentId': folder['_id'],
             'parentCollection': 'folder'
-        }, fields=fields, user=user, level=level)
+        }
+        if level is not None and (not user or not user['admin']):
+            query = {'$and': [query, self.permissionClauses(user, level)]}
 
-        return folders.count()
+        return self.collection.count_documents(query)
 
     def subtreeCount(self, folder, includeItems=True, user=None, level=None):
         """
@@ -667,6 +1066,18 @@ class Folder(AccessControlledModel):
         :param level: If filtering by permission, the required permission level.
         :type level: AccessLevel
         """
+        from .item import Item
+
+        if level is None and 'ancestors' in folder:
+            count = 1 + self.collection.count_documents({
+                'ancestors._id': folder['_id']
+            })
+            if includeItems:
+                count += Item().collection.count_documents({
+                    'ancestors._id': folder['_id']
+                })
+            return count
+
         count = 1
 
         if includeItems:
@@ -52,6 +52,9 @@ class Group(AccessControlledModel):
         events.bind('model.group.save.created',
                     CoreEventHandler.GROUP_CREATOR_ACCESS,
                     self._grantCreatorAccess)
+        events.bind('model.group.saveMany.created',
+                    CoreEventHandler.GROUP_CREATOR_ACCESS,
+                    self._grantCreatorsAccess)
 
     def validate(self, doc):
         doc['name'] = doc['name'].strip()
@@ -353,6 +356,59 @@ class Group(AccessControlledModel):
 
         return(self.save(group))
 
+    def createGroups(self, groups, creator):
+        """
+        Create several groups at once. The creator will be given admin access
+        to each of them. This checks for name collisions with one query and
+        writes the groups with one bulk write.
+
+        :param groups: The name and, optionally, the description, public and
+            openRegistration values of each group, as passed to
+            :py:meth:`createGroup`.
+        :type groups: list of dicts
+        :param creator: User document representing the creator of the groups.
+        :type creator: dict
+        :returns: The list of group documents that were created.
+        """
+        now = datetime.datetime.utcnow()
+
+        docs = []
+        for group in groups:
+            doc = {
+                'name': group['name'].strip(),
+                'description': group.get('description', '').strip(),
+                'creatorId': creator['_id'],
+                'created': now,
+                'updated': now,
+                'openRegistration': group.get('openRegistration', False),
+                'requests': []
+            }
+            doc['lowerName'] = doc['name'].lower()
+            if not doc['name']:
+                raise ValidationException(
+                    'Group name must not be empty.', 'name')
+            self.setPublic(doc, group.get('public', True), save=False)
+            docs.append(doc)
+
+        lowerNames = [doc['lowerName'] for doc in docs]
+        if len(set(lowerNames)) < len(lowerNames) or self.findOne(
+            {'lowerName': {'$in': lowerNames}}, fields=['_id']
+        ) is not None:
+            raise ValidationException('A group with that name already exists.',
+                                      field='name')
+
+        docs = self.saveMany(docs, validate=False)
+        # Record the memberships granted by _grantCreatorsAccess in the
+        # creator document too, as addUser does.
+        creator.setdefault('groups', [])
+        for doc in docs:
+            if doc['_id'] not in creator['groups'] and any(
+                entry['id'] == creator['_id']
+                for entry in doc.get('access', {}).get('users', [])
+            ):
+                creator['groups'].append(doc['_id'])
+        return(docs)
+
     def _grantCreatorAccess(self, event):
         """
         This callback makes the group creator an administrator member of the
@@ -367,6 +423,33 @@ class Group(AccessControlledModel):
 
         self.addUser(group, creator, level=AccessType.ADMIN)
 
+    def _grantCreatorsAccess(self, event):
+        """
+        This callback makes the creator of each of a batch of groups an
+        administrator member of it, with one update per creator.
+
+        This generally should not be called or overridden directly, but it may
+        be unregistered from the `model.group.saveMany.created` event.
+        """
+        from .user import User
+
+        groupIds = {}
+        for group in event.info:
+            groupIds.setdefault(group['creatorId'], []).append(group['_id'])
+        for creatorId, ids in groupIds.items():
+            entry = {'id': creatorId, 'level': AccessType.ADMIN, 'flags': []}
+            User().update({'_id': creatorId}, {
+                '$addToSet': {'groups': {'$each': ids}}
+            })
+            # New groups have no members or requests yet.
+            self.update({'_id': {'$in': ids}}, {
+                '$push': {'access.users': entry}
+            })
+            for group in event.info:
+                if group['creatorId'] == creatorId:
+                    group.setdefault('access', {'groups': [], 'users': []})
+                    group['access'].setdefault('users', []).append(entry)
+
     def updateGroup(self, group):
         """
         Updates a group.
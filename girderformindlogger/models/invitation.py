@@ -6,14 +6,67 @@ import os
 import six
 
 from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
 from .model_base import AccessControlledModel
 from girderformindlogger import events
-from girderformindlogger.constants import AccessType
-from girderformindlogger.exceptions import ValidationException, GirderException
+from girderformindlogger.constants import AccessType, USER_ROLES
+from girderformindlogger.exceptions import AccessException, \
+    ValidationException, GirderException
+from girderformindlogger.utility.mail_utils import validateEmailAddress
 from girderformindlogger.utility.model_importer import ModelImporter
 from girderformindlogger.utility.progress import noProgress, \
     setResponseTimeLimit
 
+# Number of rows of a bulk invitation that are saved with each bulk write.
+BULK_INVITE_CHUNK_SIZE = 500
+INVITATION_URL = 'https://web.mindlogger.org/#/invitation/{}'
+
+
+def validateInvitationRows(rows):
+    """
+    Check the rows of a bulk invitation, eg, from an uploaded CSV roster.
+    Each row needs a valid email address or an ID code (or both), and no two
+    rows may share an email address or an ID code.
+
+    :param rows: dicts with the keys "email", "idCode", "displayName" and
+        "role" (default "user"), all optional
+    :type rows: iterable
+    :returns: generator of a result per row, with its "row" (index), "email",
+        "idCode", "displayName" and "role", and with a "status" of "error"
+        and an "error" message if it is invalid
+    """
+    emails = set()
+    idCodes = set()
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            yield {'row': index, 'status': 'error', 'error': 'Invalid row.'}
+            continue
+        result = {
+            key: (
+                str(row[key]).strip() if row.get(key) is not None else ''
+            ) or None for key in ['email', 'idCode', 'displayName', 'role']
+        }
+        result['row'] = index
+        result['email'] = result['email'].lower() if result['email'] else None
+        result['role'] = result['role'] or 'user'
+        error = None
+        if result['email'] is None and result['idCode'] is None:
+            error = 'An email address or an ID code is required.'
+        elif result['email'] and not validateEmailAddress(result['email']):
+            error = 'Invalid email address.'
+        elif result['role'] not in USER_ROLES:
+            error = 'Invalid role.'
+        elif result['email'] and result['email'] in emails:
+            error = 'Duplicate email address.'
+        elif result['idCode'] and result['idCode'] in idCodes:
+            error = 'Duplicate ID code.'
+        if error:
+            result.update({'status': 'error', 'error': error})
+        else:
+            emails.add(result['email'])
+            idCodes.add(result['idCode'])
+        yield result
+
 
 class Invitation(AccessControlledModel):
     """
@@ -23,7 +76,13 @@ class Invitation(AccessControlledModel):
 
     def initialize(self):
         self.name = 'invitation'
-        self.ensureIndices(('appletId', ([('appletId', 1)], {})))
+        self.ensureIndices((
+            'appletId',
+            ([('appletId', 1), ('idCode', 1)], {
+                'unique': True,
+                'partialFilterExpression': {'idCode': {'$type': 'string'}}
+            })
+        ))
 
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'created', 'updated', 'meta', 'appletId',
@@ -107,6 +166,32 @@ class Invitation(AccessControlledModel):
         :type idCode: string or None
         :returns: The invitation document that was created.
         """
+        return(self.createInvitations(applet, coordinator, [{
+            'role': role,
+            'profile': profile,
+            'idCode': idCode
+        }])[0])
+
+    def createInvitations(self, applet, coordinator, invitations):
+        """
+        Create several invitations to an applet at once, checking the
+        coordinator's permissions and any existing invitations with the same
+        ID codes once for all of them, and saving them with one bulk write.
+
+        :param applet: The applet for which these invitations exist
+        :type parent: dict
+        :param coordinator: user who is doing the inviting
+        :type coordinator: dict
+        :param invitations: The optional "role" (default "user"), "profile"
+            and "idCode" of each invitation, as passed to
+            :py:meth:`createInvitation`
+        :type invitations: list of dicts
+        :returns: The invitation documents, in the same order. An invitation
+            with the same ID code as an existing one is that invitation.
+        :raises ValidationException: if an invitation could not be saved, eg,
+            because another request took its ID code. The invitations before
+            it were saved, and are the exception's ``invitations``.
+        """
         from .applet import Applet
         from .profile import Profile
 
@@ -116,44 +201,240 @@ class Invitation(AccessControlledModel):
                 'applet ({}).'.format(Applet().preferredName(applet))
             )
 
-        codified = (isinstance(idCode, str) and len(idCode))
-
-        existing = self.findOne({
-            'appletId': applet['_id'],
-            'idCode': idCode
-        }) if codified else None
-
-        if existing:
-            return existing
-
-        now = datetime.datetime.utcnow()
-
-        invitation = {
-            'appletId': applet['_id'],
-            'created': now,
-            'updated': now,
-            'role': role,
-            'size': 0,
-            'invitedBy': Profile().coordinatorProfile(
-                applet['_id'],
-                coordinator
+        codes = [
+            invitation.get('idCode') for invitation in invitations if (
+                isinstance(invitation.get('idCode'), str) and len(
+                    invitation['idCode']
+                )
             )
-        }
-
-        if codified:
-            invitation["idCode"] = idCode
+        ]
+        existing = {
+            invitation['idCode']: invitation for invitation in self.find({
+                'appletId': applet['_id'],
+                'idCode': {'$in': codes}
+            })
+        } if len(codes) else {}
 
-        if isinstance(profile, dict):
-            invitation["coordinatorDefined"] = profile
+        now = datetime.datetime.utcnow()
+        invitedBy = Profile().coordinatorProfile(applet['_id'], coordinator)
+
+        docs = []
+        created = []
+        for invitation in invitations:
+            idCode = invitation.get('idCode')
+            codified = (isinstance(idCode, str) and len(idCode))
+            if codified and idCode in existing:
+                docs.append(existing[idCode])
+                continue
+
+            doc = {
+                'appletId': applet['_id'],
+                'created': now,
+                'updated': now,
+                'role': invitation.get('role', 'user'),
+                'size': 0,
+                'invitedBy': invitedBy
+            }
+
+            if codified:
+                doc["idCode"] = idCode
+                existing[idCode] = doc
+
+            if isinstance(invitation.get('profile'), dict):
+                doc["coordinatorDefined"] = invitation['profile']
+
+            self.setPublic(doc, False, save=False)
+            docs.append(doc)
+            created.append(doc)
+
+        createdIds = {id(doc) for doc in created}
+
+        def results(docs):
+            return([
+                {
+                    k: v for k, v in doc.items() if (
+                        k!="idCode" and v is not None
+                    )
+                } if id(doc) in createdIds else doc for doc in docs
+            ])
+
+        # Now validate and save the invitations.
+        try:
+            self.saveMany(created, validate=False)
+        except ValidationException as e:
+            if isinstance(e.__cause__, BulkWriteError):
+                # The write stopped at the first invitation that failed.
+                failed = created[e.__cause__.details['writeErrors'][0]['index']]
+                e.invitations = results(docs[:next(
+                    i for i, doc in enumerate(docs) if doc is failed
+                )])
+            raise
+        return(results(docs))
+
+    def generateIdCodes(self, applet, count):
+        """
+        Generate random ID codes that are not used by any ID code or by any
+        invitation to an applet, checking each batch of candidates with one
+        query per collection. The unique index on the invitations' applet and
+        ID code catches codes taken between the check and the save.
+
+        :param applet: Applet
+        :type applet: dict
+        :param count: Number of codes to generate
+        :type count: int
+        :returns: list of str
+        """
+        import secrets
+        from .ID_code import IDCode
 
-        self.setPublic(invitation, False, save=False)
+        codes = set()
+        while len(codes) < count:
+            candidates = list({
+                secrets.token_hex(9) for i in range(count - len(codes))
+            } - codes)
+            taken = {
+                invitation['idCode'] for invitation in self.find({
+                    'appletId': applet['_id'],
+                    'idCode': {'$in': candidates}
+                }, fields=['idCode'])
+            } | {
+                idCode['code'] for idCode in IDCode().find({
+                    'code': {'$in': candidates}
+                }, fields=['code'])
+            }
+            codes.update(set(candidates) - taken)
+        return(list(codes))
+
+    def inviteMany(self, applet, coordinator, rows, sendEmail=True):
+        """
+        Invite many participants to an applet at once. Rows are validated by
+        :py:func:`validateInvitationRows`, rows without an ID code get a
+        generated one, and the invitations are saved with a bulk write per
+        BULK_INVITE_CHUNK_SIZE rows. Invited participants with an email
+        address are sent an email in the background.
+
+        :param applet: The applet to invite participants to
+        :type applet: dict
+        :param coordinator: user who is doing the inviting
+        :type coordinator: dict
+        :param rows: dicts with the keys "email", "idCode", "displayName" and
+            "role"
+        :type rows: iterable
+        :param sendEmail: Whether to email the invited participants
+        :type sendEmail: bool
+        :returns: generator of a result per row, as from
+            :py:func:`validateInvitationRows`, with a "status" of "invited",
+            "exists" (an invitation with the row's ID code already exists) or
+            "error", and the ID of the row's invitation as "invitationId"
+        """
+        from .applet import Applet
 
-        # Now validate and save the profile.
-        return ({
-            k: v for k, v in self.save(invitation, validate=False).items() if (
-                k!="idCode" and v is not None
+        # Check the coordinator before returning the generator, so that a
+        # streamed response fails before it starts.
+        if not(Applet().isCoordinator(applet['_id'], coordinator)):
+            raise AccessException(
+                'You do not have adequate permissions to invite users to this '
+                'applet ({}).'.format(Applet().preferredName(applet))
             )
-        })
+        return(self._inviteRows(applet, coordinator, rows, sendEmail))
+
+    def _inviteRows(self, applet, coordinator, rows, sendEmail):
+        chunk = []
+        for result in validateInvitationRows(rows):
+            if result.get('status') == 'error':
+                yield result
+                continue
+            chunk.append(result)
+            if len(chunk) >= BULK_INVITE_CHUNK_SIZE:
+                yield from self._inviteChunk(
+                    applet,
+                    coordinator,
+                    chunk,
+                    sendEmail
+                )
+                chunk = []
+        if len(chunk):
+            yield from self._inviteChunk(applet, coordinator, chunk, sendEmail)
+
+    def _inviteChunk(self, applet, coordinator, chunk, sendEmail):
+        missing = [result for result in chunk if result['idCode'] is None]
+        for result, idCode in zip(
+            missing,
+            self.generateIdCodes(applet, len(missing))
+        ):
+            result['idCode'] = idCode
+        try:
+            invitations = self.createInvitations(applet, coordinator, [{
+                'role': result['role'],
+                'idCode': result['idCode'],
+                'profile': {
+                    key: result[key] for key in [
+                        'displayName',
+                        'email'
+                    ] if result[key] is not None
+                }
+            } for result in chunk])
+        except ValidationException as e:
+            # Another request took one of these ID codes since they were
+            # checked. The rows before it were saved, and the rows after it
+            # are invited again.
+            invitations = getattr(e, 'invitations', None)
+            if invitations is None:
+                for result in chunk:
+                    yield dict(result, status='error', error=e.message)
+                return
+            failed = len(invitations)
+            yield from self._invited(
+                applet, coordinator, chunk[:failed], invitations, sendEmail)
+            yield dict(chunk[failed], status='error', error=e.message)
+            if failed + 1 < len(chunk):
+                yield from self._inviteChunk(
+                    applet, coordinator, chunk[failed + 1:], sendEmail)
+            return
+        yield from self._invited(
+            applet, coordinator, chunk, invitations, sendEmail)
+
+    def _invited(self, applet, coordinator, chunk, invitations, sendEmail):
+        emails = []
+        for result, invitation in zip(chunk, invitations):
+            # New invitations are returned without their ID code.
+            result.update({
+                'status': 'exists' if 'idCode' in invitation else 'invited',
+                'invitationId': invitation['_id']
+            })
+            if result['status'] == 'invited' and result['email']:
+                emails.append(result)
+            yield result
+
+        if sendEmail and len(emails):
+            self._sendInvitationEmails(applet, coordinator, emails)
+
+    def _sendInvitationEmails(self, applet, coordinator, results):
+        from .applet import Applet
+        from .setting import Setting
+        from girderformindlogger.settings import SettingKey
+        from girderformindlogger.utility import mail_utils
+
+        params = {
+            'appletName': Applet().preferredName(applet),
+            'coordinatorName': coordinator.get('firstName') or coordinator.get(
+                'login',
+                ''
+            ),
+            'host': mail_utils.getEmailUrlPrefix(),
+            'brandName': Setting().get(SettingKey.BRAND_NAME)
+        }
+        subject = 'Invitation to {}'.format(params['appletName'])
+        mail_utils.sendMailMany([(
+            subject,
+            mail_utils.renderTemplate('appletInvite.mako', dict(
+                params,
+                displayName=result['displayName'],
+                role=result['role'],
+                url=INVITATION_URL.format(str(result['invitationId']))
+            )),
+            [result['email']]
+        ) for result in results])
 
     def acceptInvitation(self, invitation, user):
         from .applet import Applet
@@ -224,7 +505,6 @@ class Invitation(AccessControlledModel):
         from .protocol import Protocol
         from .token import Token
         from .user import User
-        from girderformindlogger.exceptions import GirderException
         from girderformindlogger.api.rest import getApiUrl
         from girderformindlogger.utility import context as contextUtil,        \
             mail_utils
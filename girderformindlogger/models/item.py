@@ -28,6 +28,7 @@ class Item(acl_mixin.AccessControlMixin, Model):
                 'folderId',
                 'name',
                 'lowerName',
+                'ancestors._id',
                 'meta.screen.@type',
                 'meta.screen.url',
                 ([
@@ -161,11 +162,14 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :param folder: The folder to move the item into.
         :type folder: dict.
         """
+        from .folder import Folder
+
         self.propagateSizeChange(item, -item['size'])
 
         item['folderId'] = folder['_id']
         item['baseParentType'] = folder['baseParentType']
         item['baseParentId'] = folder['baseParentId']
+        item['ancestors'] = Folder().childAncestors(folder)
 
         self.propagateSizeChange(item, item['size'])
 
@@ -271,6 +275,8 @@ class Item(acl_mixin.AccessControlMixin, Model):
         :type reuseExisting: bool
         :returns: The item document that was created.
         """
+        from .folder import Folder
+
         if reuseExisting:
             existing = self.findOne({
                 'folderId': folder['_id'],
@@ -299,6 +305,7 @@ class Item(acl_mixin.AccessControlMixin, Model):
             'creatorId': creator['_id'],
             'baseParentType': folder['baseParentType'],
             'baseParentId': folder['baseParentId'],
+            'ancestors': Folder().childAncestors(folder, user=creator),
             'created': now,
             'updated': now,
             'size': 0,
@@ -418,6 +425,49 @@ class Item(acl_mixin.AccessControlMixin, Model):
 
         return folderIdsToRoot
 
+    def migrateItems(self, batchSize=1000):
+        """
+        Store the ancestors of every item created before they were stored,
+        with one bulk update per batch. Run this after
+        :py:meth:`girderformindlogger.models.folder.Folder.migrateFolders`,
+        since items take their ancestors from their folder. This can be
+        interrupted and run again.
+
+        :param batchSize: The number of items to update at a time.
+        :type batchSize: int
+        :returns: A generator of the number of items updated and skipped
+            (for being in a folder without stored ancestors) in each batch.
+        """
+        from .folder import Folder
+
+        query = {'ancestors': {'$exists': False}}
+        lastId = None
+        while True:
+            batch = list(self.find(
+                query if lastId is None else dict(query, _id={'$gt': lastId}),
+                sort=[('_id', 1)],
+                limit=batchSize,
+                fields=['folderId']
+            ))
+            if not len(batch):
+                return
+            lastId = batch[-1]['_id']
+            folders = {
+                folder['_id']: folder['ancestors'] + [
+                    {'_id': folder['_id'], 'type': 'folder'}
+                ] for folder in Folder().find({
+                    '_id': {'$in': list({item['folderId'] for item in batch})},
+                    'ancestors': {'$exists': True}
+                }, fields=['ancestors'])
+            }
+            updates = [
+                ({'_id': item['_id']}, {'$set': {
+                    'ancestors': folders[item['folderId']]
+                }}) for item in batch if item['folderId'] in folders
+            ]
+            self.updateMany(updates, multi=False)
+            yield len(updates), len(batch) - len(updates)
+
     def copyItem(self, srcItem, creator, name=None, folder=None, description=None):
         """
         Copy an item, including duplicating files and metadata.
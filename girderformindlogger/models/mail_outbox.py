@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from pymongo import ReturnDocument
+
+from .model_base import Model
+
+# A message is sent at most MAX_ATTEMPTS times, waiting RETRY_DELAY after
+# the first failure and twice as long after each further one, up to
+# MAX_RETRY_DELAY.
+MAX_ATTEMPTS = 6
+RETRY_DELAY = datetime.timedelta(seconds=30)
+MAX_RETRY_DELAY = datetime.timedelta(hours=1)
+# A message being sent for longer than this was claimed by a worker that
+# stopped (eg, on a restart), and is sent again.
+SEND_TIMEOUT = datetime.timedelta(minutes=5)
+# Sent messages are deleted after a week.
+SENT_TTL = 7 * 86400
+
+
+class MailOutboxStatus(object):
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+
+def retryDelay(attempts):
+    """
+    :param attempts: Number of failed attempts to send a message.
+    :type attempts: int
+    :returns: How long to wait before the next attempt.
+    :rtype: datetime.timedelta
+    """
+    return(min(RETRY_DELAY * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY))
+
+
+class MailOutbox(Model):
+    """
+    Emails waiting to be sent, and the recently sent or failed ones. Messages
+    are queued by :py:func:`girderformindlogger.utility.mail_utils.sendMail`
+    and sent by the workers of
+    :py:mod:`girderformindlogger.utility.mail_delivery`, which claim them
+    from this collection, so any server process may send any message.
+    """
+
+    def initialize(self):
+        self.name = 'mailOutbox'
+        self.ensureIndices((
+            ([('status', 1), ('nextAttempt', 1)], {}),
+        ))
+        self.ensureIndex(('sent', {'expireAfterSeconds': SENT_TTL}))
+
+    def validate(self, doc):
+        return doc
+
+    def enqueue(self, messages):
+        """
+        Queue messages to be sent, with one insert.
+
+        :param messages: (message, recipients) pairs, as from
+            :py:func:`girderformindlogger.utility.mail_utils._createMessage`
+        :type messages: list
+        :returns: The queued documents.
+        """
+        now = datetime.datetime.utcnow()
+        docs = [{
+            'from': message['From'],
+            'recipients': recipients,
+            'subject': message['Subject'],
+            'message': message.as_string(),
+            'status': MailOutboxStatus.QUEUED,
+            'attempts': 0,
+            'created': now,
+            'nextAttempt': now
+        } for message, recipients in messages]
+        if len(docs):
+            self.collection.insert_many(docs)
+        return(docs)
+
+    def claim(self, worker, ids=None):
+        """
+        Claim a message whose sending timed out, which counts as a failed
+        attempt, or else the next message that is due to be sent.
+
+        :param worker: Name of the claiming worker
+        :type worker: str
+        :param ids: If given, only claim one of the messages with these _ids.
+        :type ids: list or None
+        :returns: The message's document, or None if none is due.
+        """
+        now = datetime.datetime.utcnow()
+        update = {'$set': {
+            'status': MailOutboxStatus.SENDING,
+            'worker': worker,
+            'nextAttempt': now
+        }}
+        query = {} if ids is None else {'_id': {'$in': ids}}
+        while True:
+            doc = self.collection.find_one_and_update(
+                dict(query, **{
+                    'status': MailOutboxStatus.SENDING,
+                    'nextAttempt': {'$lte': now - SEND_TIMEOUT}
+                }),
+                dict(update, **{'$inc': {'attempts': 1}}),
+                sort=[('nextAttempt', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if doc is None or doc['attempts'] < MAX_ATTEMPTS:
+                break
+            self._invalidateCaches(doc['_id'])
+            self.collection.update_one({'_id': doc['_id']}, {'$set': {
+                'status': MailOutboxStatus.FAILED,
+                'error': 'Sending timed out.'
+            }})
+        if doc is None:
+            doc = self.collection.find_one_and_update(
+                dict(query, **{
+                    'status': MailOutboxStatus.QUEUED,
+                    'nextAttempt': {'$lte': now}
+                }),
+                update,
+                sort=[('nextAttempt', 1)],
+                return_document=ReturnDocument.AFTER
+            )
+        if doc is not None:
+            self._invalidateCaches(doc['_id'])
+        return(doc)
+
+    def release(self, doc, error):
+        """
+        Queue a claimed message to be sent again after RETRY_DELAY, without
+        counting an attempt, eg, when the SMTP server could not be reached.
+
+        :param doc: The message's document
+        :type doc: dict
+        :param error: Why the message could not be sent
+        :type error: str
+        """
+        self._invalidateCaches(doc['_id'])
+        self.collection.update_one({'_id': doc['_id']}, {'$set': {
+            'status': MailOutboxStatus.QUEUED,
+            'error': error,
+            'nextAttempt': datetime.datetime.utcnow() + RETRY_DELAY
+        }})
+
+    def markSent(self, doc):
+        self._invalidateCaches(doc['_id'])
+        self.collection.update_one({'_id': doc['_id']}, {
+            '$set': {
+                'status': MailOutboxStatus.SENT,
+                'sent': datetime.datetime.utcnow()
+            },
+            '$inc': {'attempts': 1},
+            '$unset': {'error': True}
+        })
+
+    def markFailed(self, doc, error, permanent=False):
+        """
+        Record a failed attempt to send a message, and queue it to be sent
+        again after a delay unless the failure was permanent or it has been
+        attempted MAX_ATTEMPTS times.
+
+        :param doc: The message's document
+        :type doc: dict
+        :param error: Description of the failure
+        :type error: str
+        :param permanent: Whether the failure is permanent, eg, the server
+            rejected the message.
+        :type permanent: bool
+        """
+        attempts = doc.get('attempts', 0) + 1
+        failed = permanent or attempts >= MAX_ATTEMPTS
+        self._invalidateCaches(doc['_id'])
+        self.collection.update_one({'_id': doc['_id']}, {'$set': {
+            'status': MailOutboxStatus.FAILED if failed else (
+                MailOutboxStatus.QUEUED
+            ),
+            'attempts': attempts,
+            'error': error,
+            'nextAttempt': datetime.datetime.utcnow() + retryDelay(attempts)
+        }})
+
+    def nextDue(self):
+        """
+        :returns: When the next queued message is due, or None if none is.
+        """
+        docs = list(self.collection.find(
+            {'status': MailOutboxStatus.QUEUED},
+            projection=['nextAttempt'],
+            sort=[('nextAttempt', 1)],
+            limit=1
+        ))
+        return(docs[0]['nextAttempt'] if len(docs) else None)
@@ -8,7 +8,7 @@ import six
 
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
-from pymongo.errors import WriteError
+from pymongo.errors import BulkWriteError, WriteError
 from dictdiffer import diff
 from girderformindlogger import events, logprint, logger, auditLogger
 from girderformindlogger.constants import ACCESS_FLAGS, AccessType,            \
@@ -18,6 +18,7 @@ from girderformindlogger.external.mongodb_proxy import MongoProxy
 from girderformindlogger.models import getDbConnection
 from girderformindlogger.exceptions import AccessException,                    \
     ResourcePathNotFound, ValidationException
+from girderformindlogger.utility._cache import authCache, identityMap
 
 USER_ROLE_KEYS = USER_ROLES.keys()
 
@@ -68,6 +69,37 @@ def _permissionClauses(user=None, level=None, prefix=''):
     return {'$or': permissionClauses}
 
 
+def _queryIds(query):
+    """
+    The _ids of the documents that a query can match, if the query limits
+    them to a list of _ids.
+
+    :param query: A find() query.
+    :type query: dict
+    :returns: A list of _ids, or None if the query can match any document.
+    """
+    if not isinstance(query, dict):
+        return None
+    for clause in query.get('$and', ()):
+        ids = _queryIds(clause)
+        if ids is not None:
+            return ids
+    if '_id' not in query:
+        return None
+    value = query['_id']
+    if not isinstance(value, dict):
+        ids = [value]
+    elif list(value) == ['$in']:
+        ids = list(value['$in'])
+    else:
+        return None
+    try:
+        set(ids)
+    except TypeError:
+        return None
+    return ids
+
+
 class _ModelSingleton(type):
     def __init__(cls, name, bases, dict):
         super(_ModelSingleton, cls).__init__(name, bases, dict)
@@ -309,10 +341,18 @@ class Model(object):
         return(model, modelType)
 
     def _createIndex(self, index):
-        if isinstance(index, (list, tuple)):
-            self.collection.create_index(index[0], **index[1])
-        else:
-            self.collection.create_index(index)
+        try:
+            if isinstance(index, (list, tuple)):
+                self.collection.create_index(index[0], **index[1])
+            else:
+                self.collection.create_index(index)
+        except pymongo.errors.OperationFailure as e:
+            if e.code == 11000:
+                logprint.error(
+                    'ERROR: Could not create unique index %r on %s over '
+                    'duplicate documents. Run "girderformindlogger migrate" '
+                    'to resolve them.' % (index, self.name))
+            raise
 
     def ensureTextIndex(self, index, language='english'):
         """
@@ -445,6 +485,15 @@ class Model(object):
         """
         query = query or {}
         kwargs = {k: kwargs[k] for k in kwargs if k in _allowedFindArgs}
+        # Lookups by _id alone are served from the request's identity map.
+        if list(query) == ['_id'] and isinstance(query['_id'], ObjectId) and (
+            not kwargs
+        ):
+            found, doc = identityMap.get(self.name, query['_id'], fields)
+            if not found:
+                doc = self.collection.find_one(query, projection=fields)
+                identityMap.set(self.name, query['_id'], fields, doc)
+            return doc
         return self.collection.find_one(query, projection=fields, **kwargs)
 
     def _textSearchFilters(self, query, filters=None, fields=None):
@@ -621,8 +670,12 @@ class Model(object):
                 document['_id'] = \
                     self.collection.insert_one(document).inserted_id
             else:
+                self._invalidateCaches(document['_id'])
                 self.collection.replace_one(
                     {'_id': document['_id']}, document, True)
+                # Again, in case another request cached the old document
+                # between the invalidation and the write.
+                authCache.invalidate(self.name, document['_id'])
         except WriteError as e:
             raise ValidationException('Database save failed: %s' % e.details)
 
@@ -639,6 +692,34 @@ class Model(object):
 
         return document
 
+    def _invalidateCaches(self, id=None):
+        """
+        Forget cached copies of a document that is about to change, or of
+        every document of the collection if no id is given.
+        """
+        identityMap.invalidate(self.name, id)
+        authCache.invalidate(self.name, id)
+
+    def _invalidateQueryCaches(self, queries):
+        """
+        Forget cached copies of the documents that queries can match: of
+        their _ids where every query limits them, or else of every document
+        of the collection.
+
+        :param queries: The find() queries of the documents about to change.
+        :type queries: list
+        """
+        ids = []
+        for query in queries:
+            queryIds = _queryIds(query)
+            if queryIds is None:
+                self._invalidateCaches()
+                return
+            ids.extend(queryIds)
+        for id in ids:
+            identityMap.invalidate(self.name, id)
+        authCache.invalidateMany(self.name, ids)
+
     def update(self, query, update, multi=True):
         """
         This method should be used for updating multiple documents in the
@@ -658,11 +739,149 @@ class Model(object):
         :type multi: bool
         :returns: A pymongo UpdateResult object.
         """
+        self._invalidateQueryCaches([query])
         if multi:
             return self.collection.update_many(query, update)
         else:
             return self.collection.update_one(query, update)
 
+    def saveMany(self, documents, validate=True, triggerEvents=True):
+        """
+        Create or update several documents in the collection with a single
+        bulk write. This triggers the events of :py:meth:`save` in batch
+        form: ``model.<name>.validateMany``, ``model.<name>.saveMany``,
+        ``model.<name>.saveMany.created`` and ``model.<name>.saveMany.after``
+        receive the list of documents. Handlers of the single-document events
+        that are not bound under the same name to the batch events are still
+        called for each document (see
+        :py:func:`girderformindlogger.events.triggerBatch`), and may prevent
+        the validation or saving of that document.
+
+        :param documents: The documents to save.
+        :type documents: list
+        :param validate: Whether to call the model's validate() on each
+            document before saving.
+        :type validate: bool
+        :param triggerEvents: Whether to trigger events for validate and
+            pre- and post-save hooks.
+        :returns: The list of documents that were saved.
+        :raises ValidationException: if the bulk write fails, with the
+            pymongo BulkWriteError as its ``__cause__``. The write is
+            ordered, so the documents before the first failed one were saved.
+        """
+        documents = list(documents)
+        if not len(documents):
+            return documents
+
+        if validate:
+            skip = set()
+            if triggerEvents:
+                event, single = events.triggerBatch(
+                    'model.%s.validateMany' % self.name,
+                    'model.%s.validate' % self.name, documents)
+                if event.defaultPrevented:
+                    validate = False
+                skip = {i for i, e in enumerate(single) if e.defaultPrevented}
+            if validate:
+                documents = [
+                    doc if i in skip else self.validate(doc)
+                    for i, doc in enumerate(documents)
+                ]
+
+        if triggerEvents:
+            event, single = events.triggerBatch(
+                'model.%s.saveMany' % self.name,
+                'model.%s.save' % self.name, documents)
+            if event.defaultPrevented:
+                return documents
+            documents = [
+                doc for doc, e in zip(documents, single) if not e.defaultPrevented
+            ]
+
+        created = [doc for doc in documents if '_id' not in doc]
+        replaced = [doc['_id'] for doc in documents if '_id' in doc]
+        requests = []
+        for doc in documents:
+            if '_id' in doc:
+                self._invalidateCaches(doc['_id'])
+                requests.append(pymongo.ReplaceOne({'_id': doc['_id']}, doc, True))
+            else:
+                doc['_id'] = ObjectId()
+                requests.append(pymongo.InsertOne(doc))
+        if len(requests):
+            try:
+                self.collection.bulk_write(requests)
+            except BulkWriteError as e:
+                raise ValidationException(
+                    'Database save failed: %s' % e.details) from e
+            finally:
+                # Again, in case another request cached an old document
+                # between the invalidation and the write.
+                for id in replaced:
+                    authCache.invalidate(self.name, id)
+
+        if triggerEvents:
+            for doc in created:
+                auditLogger.info('document.create', extra={
+                    'details': {
+                        'collection': self.name,
+                        'id': doc['_id']
+                    }
+                })
+            if len(created):
+                events.triggerBatch(
+                    'model.%s.saveMany.created' % self.name,
+                    'model.%s.save.created' % self.name, created)
+            events.triggerBatch(
+                'model.%s.saveMany.after' % self.name,
+                'model.%s.save.after' % self.name, documents)
+
+        return documents
+
+    def updateMany(self, updates, multi=True):
+        """
+        Apply several updates to the collection with a single bulk write. As
+        with :py:meth:`update`, no events are triggered.
+
+        :param updates: (query, update) pairs, as passed to
+            :py:meth:`update`.
+        :type updates: list
+        :param multi: Whether each update applies to all of the documents
+            matching its query, or just to the first one.
+        :type multi: bool
+        :returns: A pymongo BulkWriteResult object, or None if there were no
+            updates.
+        """
+        operation = pymongo.UpdateMany if multi else pymongo.UpdateOne
+        requests = [operation(query, update) for query, update in updates]
+        if not len(requests):
+            return None
+        self._invalidateQueryCaches([query for query, update in updates])
+        return self.collection.bulk_write(requests, ordered=False)
+
+    def upsertMany(self, updates):
+        """
+        Update or insert several documents with a single bulk write: each
+        update applies to the first document matching its query, or inserts
+        a new document built from the query and the update if none matches.
+        No events are triggered.
+
+        :param updates: (query, update) pairs, as passed to
+            :py:meth:`update`.
+        :type updates: list
+        :returns: A pymongo BulkWriteResult object, whose upserted_ids maps
+            the index of each update that inserted a document to its _id, or
+            None if there were no updates.
+        """
+        requests = [
+            pymongo.UpdateOne(query, update, upsert=True)
+            for query, update in updates
+        ]
+        if not len(requests):
+            return None
+        self._invalidateQueryCaches([query for query, update in updates])
+        return self.collection.bulk_write(requests, ordered=False)
+
     def increment(self, query, field, amount, **kwargs):
         """
         This is a specialization of the update method that atomically increments
@@ -698,7 +917,10 @@ class Model(object):
             })
 
         if not event.defaultPrevented and not kwargsEvent.defaultPrevented:
-            return self.collection.delete_one({'_id': document['_id']})
+            self._invalidateCaches(document['_id'])
+            result = self.collection.delete_one({'_id': document['_id']})
+            authCache.invalidate(self.name, document['_id'])
+            return result
 
     def removeWithQuery(self, query):
         """
@@ -711,6 +933,7 @@ class Model(object):
         """
         assert query
 
+        self._invalidateQueryCaches([query])
         return self.collection.delete_many(query)
 
     def load(self, id, objectId=True, fields=None, exc=False):
@@ -1083,7 +1306,8 @@ class AccessControlledModel(Model):
         role,
         user=None,
         force=False,
-        subject=None
+        subject=None,
+        save=True
     ):
         """
         Private helper for setting user roles on a resource.
@@ -1132,6 +1356,8 @@ class AccessControlledModel(Model):
             for perm in doc['roles'][role][entity]:
                 if perm['id'] == id:
                     doc['roles'][role][entity].remove(perm)
+        if not save:
+            return(doc)
         self._saveRole(doc, update)
 
         return(self.getFullRolesList(doc))
@@ -1152,6 +1378,7 @@ class AccessControlledModel(Model):
 
         event = events.trigger('model.%s.save' % self.name, doc)
         if not event.defaultPrevented:
+            self._invalidateCaches(ObjectId(doc['_id']))
             doc = self.collection.find_one_and_update(
                 {'_id': ObjectId(doc['_id'])}, update,
                 return_document=pymongo.ReturnDocument.AFTER)
@@ -1173,6 +1400,7 @@ class AccessControlledModel(Model):
                               if k != 'roles'}
         event = events.trigger('model.%s.save' % self.name, doc)
         if not event.defaultPrevented:
+            self._invalidateCaches(ObjectId(doc['_id']))
             doc = self.collection.find_one_and_update(
                 {'_id': ObjectId(doc['_id'])}, update,
                 return_document=pymongo.ReturnDocument.AFTER)
@@ -1387,7 +1615,8 @@ class AccessControlledModel(Model):
         role,
         currentUser=None,
         force=False,
-        subject=None
+        subject=None,
+        save=True
     ):
         """
         Set group-level roles on the resource.
@@ -1398,16 +1627,16 @@ class AccessControlledModel(Model):
         :type group: dict
         :param role: What role the group should have.
         :type role: str
-        :param save: Whether to save the object to the database afterward.
-                     Set this to False if you want to wait to save the
-                     document for performance reasons.
-        :type save: bool
         :param flags: List of access flags to grant to the group.
         :type flags: specific flag identifier, or a list/tuple/set of them
         :param currentUser: The user performing this action. Only required if attempting
             to set admin-only flags on the resource.
         :type currentUser: dict or None
-        :returns: The updated resource document.
+        :param save: Whether to save the roles to the database. Set this to
+            False to set several roles and save them at once.
+        :type save: bool
+        :returns: The full roles list of the resource, or the updated
+            resource document if save is False.
         :param force: Set this to True to set the flags regardless of the passed in
             currentUser's permissions (only matters if flags are passed).
         :type force: bool
@@ -1422,7 +1651,8 @@ class AccessControlledModel(Model):
                 role,
                 currentUser,
                 force,
-                subject
+                subject,
+                save
             )
         )
 
@@ -1657,7 +1887,8 @@ class AccessControlledModel(Model):
         role,
         currentUser=None,
         force=False,
-        subject=None
+        subject=None,
+        save=True
     ):
         """
         Set group-level roles on the resource.
@@ -25,7 +25,8 @@ class Profile(AccessControlledModel, dict):
 
     def initialize(self):
         self.name = 'profile'
-        self.ensureIndices(('appletId', ([('appletId', 1)], {})))
+        self.ensureIndices(('appletId', 'scheduleExpandedUntil',
+                            ([('appletId', 1)], {})))
 
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'created', 'updated', 'meta', 'appletId',
@@ -624,59 +625,85 @@ class Profile(AccessControlledModel, dict):
 
         # get groups for applet
         appletGroups = Applet().getAppletGroups(applet)
+        userGroupIds = {
+            ObjectId(groupId) for groupId in appletGroups.get('user', {})
+        }
+        users = list(UserModel().find(
+            query={"groups": {"$in": [
+                ObjectId(groupId) for role in appletGroups for groupId in (
+                    appletGroups[role]
+                )
+            ]}},
+            fields=['_id', 'groups', 'displayName', 'firstName', 'email']
+        ))
 
-        userList = {
-            role: {
-                groupId: {
-                    'active': list(UserModel().find(
-                        query={"groups": {
-                            "$in": [
-                                ObjectId(
-                                    groupId
-                                )
-                            ]
-                        }},
-                        fields=['_id']
-                    ))
-                } for groupId in appletGroups[role].keys()
-            } for role in appletGroups.keys()
+        returnFields = ["_id", "appletId", "coordinatorDefined", "userDefined"]
+        profiles = {
+            profile['userId']: profile for profile in self.find(
+                {
+                    'appletId': applet['_id'],
+                    'userId': {'$in': [user['_id'] for user in users]},
+                    'profile': True
+                },
+                fields=returnFields + ['userId']
+            )
         }
+        deleted = applet.get('meta', {}).get('applet', {}).get('deleted')
+        missing = []
+        now = datetime.datetime.utcnow()
+        for user in users:
+            if user['_id'] in profiles:
+                continue
+            if deleted or not userGroupIds.intersection(user.get('groups', [])):
+                # createProfile also adds the user to the applet's user group
+                profiles[user['_id']] = self.createProfile(applet, user)
+                continue
+            profiles[user['_id']] = self._newProfile(applet, user, now)
+            missing.append(profiles[user['_id']])
+        self.saveMany(missing, validate=False)
 
         # restructure dictionary & return
-        userList = {
-            str(ulu["user"]["_id"]): {k: v for k, v in {
-                "displayName": ulu["user"].get(
+        groups = [{
+            "_id": groupId,
+            "name": appletGroups[role][groupId],
+            "status": "active",
+            "role": role
+        } for role in appletGroups for groupId in appletGroups[role]]
+        return({
+            str(profile["_id"]): {k: v for k, v in {
+                "displayName": profile.get(
                     "coordinatorDefined",
                     {}
-                ).get("displayName", ulu["user"].get(
+                ).get("displayName", profile.get(
                     "userDefined",
                     {}
-                ).get("displayName", ulu["user"].get("displayName"))),
-                "groups": ulu.get("groups")
-            }.items() if v is not None} for ulu in [{
-                "user": self.createProfile(
-                    applet,
-                    UserModel().load(user, AccessType.READ, force=True)
-                ),
-                "groups": [{
-                        "_id": groupId,
-                        "name": appletGroups[role][groupId],
-                        "status": status,
-                        "role": role
-                } for role in userList for groupId in userList[
-                    role
-                ] for status in userList[role][groupId]]
-            } for user in set([
-                ui.get('_id') for u in (
-                    userList[role][groupId][
-                        status
-                    ] for role in userList for groupId in userList[
-                        role
-                    ] for status in userList[role][groupId]
-                ) for ui in u
-            ])]
+                ).get("displayName", profile.get("displayName"))),
+                "groups": groups
+            }.items() if v is not None} for profile in profiles.values()
+        })
+
+    def _newProfile(self, applet, user, now):
+        profile = {
+            k: v for k, v in {
+                'appletId': ObjectId(applet['_id']),
+                'userId': ObjectId(user['_id']),
+                'profile': True,
+                'created': now,
+                'updated': now,
+                'size': 0,
+                'coordinatorDefined': {},
+                'userDefined': {
+                    'displayName': user.get(
+                        'displayName',
+                        user.get('firstName')
+                    ),
+                    'email': user.get('email')
+                }
+            }.items() if v is not None
         }
-        return(userList)
+
+        self.setPublic(profile, False, save=False)
+        return(profile)
 
     def createProfile(self, applet, user, role="user"):
         """
@@ -729,28 +756,7 @@ class Profile(AccessControlledModel, dict):
                     )
                 )
 
-        now = datetime.datetime.utcnow()
-
-        profile = {
-            k: v for k, v in {
-                'appletId': ObjectId(applet['_id']),
-                'userId': ObjectId(user['_id']),
-                'profile': True,
-                'created': now,
-                'updated': now,
-                'size': 0,
-                'coordinatorDefined': {},
-                'userDefined': {
-                    'displayName': user.get(
-                        'displayName',
-                        user.get('firstName')
-                    ),
-                    'email': user.get('email')
-                }
-            }.items() if v is not None
-        }
-
-        self.setPublic(profile, False, save=False)
+        profile = self._newProfile(applet, user, datetime.datetime.utcnow())
 
         # Save the profile.
         self.save(profile, validate=False)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+from bson.binary import Binary
+from pymongo.errors import DuplicateKeyError
+
+from .model_base import Model
+from girderformindlogger import events
+from girderformindlogger.utility import compression
+
+
+class ResponseCache(Model):
+    """
+    Ready-to-send JSON responses built from the cache of a document (eg, the
+    expanded applet served by ``GET /applet/:id``), so that the cache of a
+    popular applet is decoded and serialized once rather than on every
+    request. Each response holds the UTF-8 bytes of the JSON, with the
+    "identity" encoding, or those bytes compressed with one of
+    ``compression.ENCODINGS``. Each response is of one version of the cache,
+    as recorded in the document's ``cachedVersion``, and is replaced when a
+    newer version is requested.
+    """
+
+    def initialize(self):
+        self.name = 'responseCache'
+        self.ensureIndices((
+            ([('collection', 1), ('docId', 1), ('encoding', 1)], {
+                'unique': True
+            }),
+        ))
+
+    def validate(self, doc):
+        return doc
+
+    def getResponse(self, collection, docId, version, encoding):
+        """
+        :param collection: The collection of the cached document, eg, "folder".
+        :type collection: str
+        :param docId: The _id of the cached document.
+        :type docId: ObjectId
+        :param version: The document's cachedVersion.
+        :type version: str
+        :param encoding: The response's content encoding, eg, "gzip", or
+            "identity" for the uncompressed JSON.
+        :type encoding: str
+        :returns: The response, or None if there is none of this version.
+        :rtype: bytes
+        """
+        doc = self.collection.find_one({
+            'collection': collection,
+            'docId': docId,
+            'encoding': encoding,
+            'version': version
+        }, projection=['data'])
+        return(bytes(doc['data']) if doc is not None else None)
+
+    def setResponse(self, collection, docId, version, encoding, data):
+        """
+        Store the response of a version of a document's cache, replacing that
+        of any other version.
+        """
+        query = {
+            'collection': collection,
+            'docId': docId,
+            'encoding': encoding
+        }
+        update = {'$set': {
+            'version': version,
+            'data': Binary(data),
+            'size': len(data),
+            'updated': datetime.datetime.utcnow()
+        }}
+        # Responses are only read by query, never loaded by id, so there are
+        # no cached copies to invalidate.
+        try:
+            self.collection.update_one(query, update, upsert=True)
+        except DuplicateKeyError:
+            # Another request inserted a response first; replace it.
+            self.collection.update_one(query, update)
+
+    def removeResponses(self, collection, docId):
+        """
+        Delete the stored responses of a document, of every version and
+        encoding.
+        """
+        self.removeWithQuery({'collection': collection, 'docId': docId})
+
+    def loadResponse(self, collection, docId, version, encoding, serialize):
+        """
+        Get the response of a version of a document's cache, building and
+        storing it if there is none yet. Compressed responses are compressed
+        from the stored uncompressed one, so the cache is serialized once per
+        version whatever the encodings requested.
+
+        :param serialize: A function of no arguments returning the JSON of
+            the document's cache, as bytes.
+        :type serialize: callable
+        :rtype: bytes
+        """
+        data = self.getResponse(collection, docId, version, encoding)
+        if data is not None:
+            return(data)
+        body = None
+        if encoding != compression.IDENTITY:
+            body = self.getResponse(
+                collection, docId, version, compression.IDENTITY)
+        if body is None:
+            body = serialize()
+            self.setResponse(
+                collection, docId, version, compression.IDENTITY, body)
+        if encoding == compression.IDENTITY:
+            return(body)
+        data = compression.compress(body, encoding, stored=True)
+        self.setResponse(collection, docId, version, encoding, data)
+        return(data)
+
+
+def _removeAppletResponses(event):
+    folder = event.info
+    if not isinstance(folder, dict) or '_id' not in folder:
+        return
+    applet = folder.get('meta', {}).get('applet')
+    if applet is not None and (
+        event.name.endswith('.remove') or applet.get('deleted')
+    ):
+        ResponseCache().removeResponses('folder', folder['_id'])
+
+
+# Applets are deleted by removing them or, usually, by marking them deleted.
+events.bind('model.folder.save.after', 'response_cache',
+            _removeAppletResponses)
+events.bind('model.folder.remove', 'response_cache', _removeAppletResponses)
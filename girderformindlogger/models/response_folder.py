@@ -17,11 +17,14 @@
 #  limitations under the License.
 ###############################################################################
 
+import collections
 import copy
 import datetime
+import hashlib
 import itertools
 import json
 import os
+import re
 import six
 
 from bson.objectid import ObjectId
@@ -30,17 +33,59 @@ from .assignment import Assignment
 from .folder import Folder
 from .item import Item
 from .model_base import AccessControlledModel
-from girderformindlogger import events
+from girderformindlogger import events, auditLogger
 from girderformindlogger.models.roles import getUserCipher
 from girderformindlogger.constants import AccessType
 from girderformindlogger.exceptions import ValidationException, GirderException
+from pymongo.errors import BulkWriteError
+from girderformindlogger.utility._cache import LRUCache
 from girderformindlogger.utility.progress import noProgress, setResponseTimeLimit
 
+RESPONSE_FOLDER_CACHE_SIZE = 10000
+
+
+class _SubjectFolderCache(LRUCache):
+    """
+    Maps (user, applet, applet name, subject) to (subject response folder,
+    {ID of each folder on its path: (name, parentId)}), and counts the
+    entries whose path includes each folder, so that saving a folder that
+    is on no cached path doesn't need to scan the cache.
+    """
+
+    def __init__(self, maxSize):
+        super(_SubjectFolderCache, self).__init__(maxSize)
+        self._folderIds = collections.Counter()
+
+    def _added(self, key, value):
+        self._folderIds.update(value[1].keys())
+
+    def _removed(self, key, value):
+        self._folderIds.subtract(value[1].keys())
+        for folderId in value[1]:
+            if self._folderIds[folderId] <= 0:
+                del self._folderIds[folderId]
+
+    def hasFolder(self, folderId):
+        with self._lock:
+            return folderId in self._folderIds
+
+
+_subjectFolderCache = _SubjectFolderCache(RESPONSE_FOLDER_CACHE_SIZE)
+
+
 class ResponseItem(Item):
     def initialize(self):
         self.name = 'item'
         self.ensureIndices(('folderId', 'name', 'lowerName',
-                            ([('folderId', 1), ('name', 1)], {})))
+                            ([('folderId', 1), ('name', 1)], {}),
+                            ([('creatorId', 1), ('idempotencyKey', 1)], {
+                                'unique': True,
+                                'partialFilterExpression': {
+                                    'idempotencyKey': {'$exists': True}
+                                }
+                            }),
+                            ([('baseParentId', 1), ('meta.applet.@id', 1)],
+                             {})))
         self.ensureTextIndex({
             'name': 1,
             'description': 1
@@ -53,8 +98,52 @@ class ResponseItem(Item):
             'creatorId', 'folderId', 'name', 'baseParentType', 'baseParentId',
             'copyOfItem'))
 
+    def deriveIdempotencyKey(self, activity, metadata, subject):
+        """
+        Derive an idempotency key for a response from its activity, its
+        subject and the client's start and end timestamps.
+
+        :param activity: The activity the response is to.
+        :type activity: dict
+        :param metadata: The response metadata.
+        :type metadata: dict
+        :param subject: The ID of the subject, as sent by the client, or of
+            the informant if the response is about themself.
+        :type subject: ObjectId or str
+        :returns: str, or None if the client did not send both timestamps.
+        """
+        started = metadata.get('responseStarted')
+        completed = metadata.get('responseCompleted')
+        if started is None or completed is None:
+            return None
+        return hashlib.sha256("{}|{}|{}|{}".format(
+            str(activity.get('_id')),
+            str(subject),
+            started,
+            completed
+        ).encode()).hexdigest()
+
+    def findIdempotent(self, creator, idempotencyKey):
+        """
+        Find the response item a user already created with an idempotency
+        key.
+
+        :param creator: The user who created the item.
+        :type creator: dict
+        :param idempotencyKey: The idempotency key.
+        :type idempotencyKey: str or None
+        :returns: The item document, or None.
+        """
+        if not idempotencyKey:
+            return None
+        return self.findOne({
+            'creatorId': creator['_id'],
+            'idempotencyKey': idempotencyKey
+        })
+
     def createResponseItem(self, name, creator, folder, description='',
-                   reuseExisting=False, readOnly=False):
+                   reuseExisting=False, readOnly=False, metadata=None,
+                   idempotencyKey=None):
         """
         Create a new response item. The creator will be given admin access to it.
 
@@ -69,6 +158,11 @@ class ResponseItem(Item):
             under the given folder, return that item rather than creating a
             new one.
         :type reuseExisting: bool
+        :param metadata: Metadata to save with the item.
+        :type metadata: dict or None
+        :param idempotencyKey: Key identifying this submission. Only one item
+            can be created per creator and key.
+        :type idempotencyKey: str or None
         :returns: The item document that was created.
         """
         if reuseExisting:
@@ -92,18 +186,169 @@ class ResponseItem(Item):
             folder['baseParentType'] = pathFromRoot[0]['type']
             folder['baseParentId'] = pathFromRoot[0]['object']['_id']
 
-        return self.save({
+        item = {
             'name': self._validateString(name),
             'description': self._validateString(description),
             'folderId': ObjectId(folder['_id']),
             'creatorId': creator['_id'],
             'baseParentType': folder['baseParentType'],
             'baseParentId': folder['baseParentId'],
+            'ancestors': Folder().childAncestors(folder, user=creator),
             'created': now,
             'updated': now,
             'size': 0,
             'readOnly': readOnly
-        })
+        }
+        if metadata:
+            self.validateKeys(metadata)
+            item['meta'] = metadata
+        if idempotencyKey:
+            item['idempotencyKey'] = idempotencyKey
+        return self.save(item)
+
+    def createResponseItems(self, responses, creator, readOnly=False):
+        """
+        Create many response items with a single bulk write. Responses whose
+        idempotency key has already been used by the creator are not
+        inserted again; the existing item is returned in their place.
+
+        :param responses: The responses to create. Each is a dict with the
+            keys "name", "folder" and "metadata", and optionally
+            "description" and "idempotencyKey".
+        :type responses: list
+        :param creator: User document representing the creator of the items.
+        :type creator: dict
+        :param readOnly: Whether the new items are read-only.
+        :type readOnly: bool
+        :returns: list of item documents in the same order as responses.
+        """
+        if not isinstance(creator, dict) or '_id' not in creator:
+            # Internal error -- this shouldn't be called without a user.
+            raise GirderException('Creator must be a user.',
+                                  'girderformindlogger.models.item.creator-not-user')
+
+        keys = [
+            r['idempotencyKey'] for r in responses if r.get('idempotencyKey')
+        ]
+        existing = self._findIdempotent(creator, keys)
+
+        # Reserve the names already taken among the target folders' items
+        # and subfolders, including those numbered as by Item.validate, so
+        # new names can be made unique without a query per item.
+        folders = {
+            str(r['folder']['_id']): r['folder'] for r in responses
+        }
+        folderIds = [ObjectId(folderId) for folderId in folders]
+        names = re.compile(r'^(?:%s)(?: \(\d+\))?$' % '|'.join(sorted({
+            re.escape(self._validateString(r['name'])) for r in responses
+        })))
+        taken = {
+            (str(item['folderId']), item['name']) for item in self.find({
+                'folderId': {'$in': folderIds},
+                'name': names
+            }, fields=['folderId', 'name'])
+        } | {
+            (str(folder['parentId']), folder['name']) for folder in Folder(
+            ).find({
+                'parentId': {'$in': folderIds},
+                'parentCollection': 'folder',
+                'name': names
+            }, fields=['parentId', 'name'])
+        }
+
+        ancestors = {
+            folderId: Folder().childAncestors(folder, user=creator)
+            for folderId, folder in six.viewitems(folders)
+        }
+        now = datetime.datetime.utcnow()
+        results = []
+        newItems = []
+        for response in responses:
+            key = response.get('idempotencyKey')
+            if key and key in existing:
+                results.append(existing[key])
+                continue
+            folder = response['folder']
+            if 'baseParentType' not in folder:
+                pathFromRoot = self.parentsToRoot({'folderId': folder['_id']},
+                                                  creator, force=True)
+                folder['baseParentType'] = pathFromRoot[0]['type']
+                folder['baseParentId'] = pathFromRoot[0]['object']['_id']
+            name = baseName = self._validateString(response['name'])
+            n = 0
+            while (str(folder['_id']), name) in taken:
+                n += 1
+                name = '%s (%d)' % (baseName, n)
+            taken.add((str(folder['_id']), name))
+            self.validateKeys(response.get('metadata', {}))
+            item = {
+                'name': name,
+                'lowerName': name.lower(),
+                'description': self._validateString(
+                    response.get('description', '')
+                ),
+                'folderId': ObjectId(folder['_id']),
+                'creatorId': creator['_id'],
+                'baseParentType': folder['baseParentType'],
+                'baseParentId': folder['baseParentId'],
+                'ancestors': ancestors[str(folder['_id'])],
+                'created': now,
+                'updated': now,
+                'size': 0,
+                'readOnly': readOnly,
+                'meta': response.get('metadata', {})
+            }
+            if key:
+                item['idempotencyKey'] = key
+                existing[key] = item
+            results.append(item)
+            newItems.append(item)
+
+        if len(newItems):
+            try:
+                self.collection.insert_many(newItems, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get('writeErrors', [])
+                if any([error.get('code') != 11000 for error in errors]):
+                    raise ValidationException(
+                        'Database save failed: %s' % e.details
+                    )
+                # Another request inserted some of these keys since we
+                # looked; return the items it created instead.
+                duplicates = {
+                    newItems[error['index']]['idempotencyKey']
+                    for error in errors
+                }
+                existing = self._findIdempotent(creator, list(duplicates))
+                results = [
+                    existing.get(item['idempotencyKey'], item) if item.get(
+                        'idempotencyKey'
+                    ) in duplicates else item for item in results
+                ]
+                newItems = [
+                    item for item in newItems if item.get(
+                        'idempotencyKey'
+                    ) not in duplicates
+                ]
+            for item in newItems:
+                auditLogger.info('document.create', extra={
+                    'details': {
+                        'collection': self.name,
+                        'id': item['_id']
+                    }
+                })
+                events.trigger('model.%s.save.created' % self.name, item)
+                events.trigger('model.%s.save.after' % self.name, item)
+        return results
+
+    def _findIdempotent(self, creator, idempotencyKeys):
+        return({
+            item['idempotencyKey']: item for item in self.find({
+                'creatorId': creator['_id'],
+                'idempotencyKey': {'$in': idempotencyKeys}
+            })
+        } if len(idempotencyKeys) else {})
+
 
 
 class ResponseFolder(Folder):
@@ -211,3 +456,78 @@ class ResponseFolder(Folder):
             else:
                 return(responseFolders)
         return(responseFolder)
+
+    def getSubjectFolder(self, user, applet, subject):
+        """
+        Get the folder for a user's responses to an applet about a subject
+        (Responses/«applet name»/«subject»), creating any missing folders.
+        Resolved folders are cached for the process and dropped from the cache
+        when a folder on their path is renamed, moved or removed.
+
+        :param user: The user submitting responses.
+        :type user: dict
+        :param applet: The applet the responses are to.
+        :type applet: dict
+        :param subject: ID of the subject's profile.
+        :type subject: ObjectId or str
+        :returns: dict with the folder's _id, name, baseParentType and
+            baseParentId
+        """
+        appletName = Applet().preferredName(applet)
+        key = (
+            str(user['_id']),
+            str(applet['_id']),
+            appletName,
+            str(subject)
+        )
+        cached = _subjectFolderCache.get(key)
+        if cached is not None:
+            return dict(cached[0])
+
+        responsesFolder = self.load(user=user, reviewer=user, force=True)
+        appletFolder = Folder().createFolder(
+            parent=responsesFolder, parentType='folder', name=appletName,
+            reuseExisting=True, public=False, upsert=True)
+        subjectFolder = Folder().createFolder(
+            parent=appletFolder, parentType='folder', name=str(subject),
+            reuseExisting=True, public=False, upsert=True)
+
+        path = {
+            str(folder['_id']): (folder['name'], folder.get('parentId'))
+            for folder in [responsesFolder, appletFolder, subjectFolder]
+        }
+        folder = {
+            k: subjectFolder.get(k) for k in [
+                '_id', 'name', 'baseParentType', 'baseParentId'
+            ]
+        }
+        _subjectFolderCache.set(key, (folder, path))
+        return dict(folder)
+
+
+def _invalidateSubjectFolders(event):
+    """
+    Drop cached response folder paths that include a folder being renamed,
+    moved or removed.
+    """
+    folder = event.info
+    folderId = str(folder.get('_id'))
+    if not _subjectFolderCache.hasFolder(folderId):
+        return
+
+    def stale(key, value):
+        path = value[1]
+        return folderId in path and (
+            event.name.endswith('.remove') or path[folderId] != (
+                folder.get('name'),
+                folder.get('parentId')
+            )
+        )
+
+    _subjectFolderCache.deleteWhere(stale)
+
+
+events.bind('model.folder.save', 'response_folder_cache',
+            _invalidateSubjectFolders)
+events.bind('model.folder.remove', 'response_folder_cache',
+            _invalidateSubjectFolders)
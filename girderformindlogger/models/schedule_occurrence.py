@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+import datetime
+import pytz
+import threading
+
+from bson.objectid import ObjectId
+from .model_base import Model
+from girderformindlogger import events
+from girderformindlogger.utility.schedule import expandSchedule
+
+# How far ahead schedules are expanded, and how close to the end of that
+# window a profile's occurrences are before they are expanded again.
+SCHEDULE_HORIZON = datetime.timedelta(days=14)
+SCHEDULE_REFRESH = datetime.timedelta(days=7)
+EXPAND_BATCH_SIZE = 1000
+
+# Held while an extension of schedules is queued or running.
+_extending = threading.Lock()
+
+
+class ScheduleOccurrence(Model):
+    """
+    Materialized upcoming notification times of applet schedules. There is
+    one document per (profile, activity, notification, time), expanded from
+    the profile's own schedule if it has one or else from its applet's
+    schedule. Occurrences are deleted a day after they are due.
+    """
+
+    def initialize(self):
+        self.name = 'scheduleOccurrence'
+        self.ensureIndices((
+            'appletId',
+            ([('time', 1), ('_id', 1)], {}),
+            ([('profileId', 1), ('time', 1)], {})
+        ))
+        self.ensureIndex(('time', {'expireAfterSeconds': 86400}))
+
+    def validate(self, doc):
+        return doc
+
+    def profileSchedule(self, profile, applet):
+        """
+        Get the schedule that applies to a profile: the user's own, else one
+        set for them by a coordinator, else the applet's.
+
+        :param profile: Profile
+        :type profile: dict
+        :param applet: The profile's applet
+        :type applet: dict
+        :returns: dict or None
+        """
+        for source in ['userDefined', 'coordinatorDefined']:
+            schedule = (profile.get(source) or {}).get('schedule')
+            if schedule:
+                return(schedule)
+        return(applet.get('meta', {}).get('applet', {}).get('schedule'))
+
+    def expandProfiles(self, applet, profiles, now=None):
+        """
+        Replace the upcoming occurrences of some of an applet's profiles with
+        a fresh expansion of their schedules.
+
+        :param applet: Applet
+        :type applet: dict
+        :param profiles: Profiles of the applet, with at least their _id,
+            userId, userDefined and coordinatorDefined fields
+        :type profiles: iterable
+        :param now: Start of the expansion; defaults to the current time.
+        :type now: datetime.datetime
+        """
+        now = now or datetime.datetime.utcnow()
+        start = pytz.utc.localize(now)
+        end = start + SCHEDULE_HORIZON
+        batch = []
+        for profile in profiles:
+            batch.append(profile)
+            if len(batch) >= EXPAND_BATCH_SIZE:
+                self._expandBatch(applet, batch, now, start, end)
+                batch = []
+        if len(batch):
+            self._expandBatch(applet, batch, now, start, end)
+
+    def _expandBatch(self, applet, profiles, now, start, end):
+        from .profile import Profile
+
+        profileIds = [profile['_id'] for profile in profiles]
+        self.collection.delete_many({
+            'profileId': {'$in': profileIds},
+            'time': {'$gte': now}
+        })
+        occurrences = [
+            {
+                **occurrence,
+                'appletId': applet['_id'],
+                'profileId': profile['_id'],
+                'userId': profile.get('userId')
+            } for profile in profiles for occurrence in expandSchedule(
+                self.profileSchedule(profile, applet),
+                start,
+                end,
+                seed=str(profile['_id'])
+            )
+        ]
+        if len(occurrences):
+            self.collection.insert_many(occurrences, ordered=False)
+        Profile().update(
+            {'_id': {'$in': profileIds}},
+            {'$set': {'scheduleExpandedUntil': end.replace(tzinfo=None)}}
+        )
+
+    def expandApplet(self, applet, now=None):
+        """
+        Re-expand an applet's schedule for every profile that follows it,
+        after the applet's schedule changes. Profiles with their own schedule
+        are left alone.
+
+        :param applet: Applet
+        :type applet: dict
+        """
+        from .profile import Profile
+
+        self.expandProfiles(applet, (
+            profile for profile in Profile().find(
+                {'appletId': applet['_id'], 'profile': True},
+                fields=['_id', 'userId', 'userDefined', 'coordinatorDefined']
+            ) if not any([
+                (profile.get(source) or {}).get('schedule') for source in [
+                    'userDefined',
+                    'coordinatorDefined'
+                ]
+            ])
+        ), now)
+
+    def expandProfile(self, profile, applet=None, now=None):
+        """
+        Re-expand a single profile's schedule, after the user's own or a
+        coordinator-defined schedule for them changes.
+
+        :param profile: Profile
+        :type profile: dict
+        :param applet: The profile's applet, if already loaded
+        :type applet: dict
+        """
+        from .applet import Applet
+
+        applet = applet or Applet().load(profile['appletId'], force=True)
+        self.expandProfiles(applet, [profile], now)
+
+    def extend(self, now=None, limit=EXPAND_BATCH_SIZE):
+        """
+        Expand the schedules of profiles whose occurrences end less than
+        SCHEDULE_REFRESH from now, or which have never been expanded.
+
+        :param limit: Maximum number of profiles to expand.
+        :type limit: int
+        :returns: Number of profiles expanded.
+        """
+        from .applet import Applet
+        from .profile import Profile
+
+        now = now or datetime.datetime.utcnow()
+        profiles = {}
+        # Profiles never expanded, then those running out soonest.
+        for profile in Profile().find(
+            {
+                'profile': True,
+                'scheduleExpandedUntil': {'$not': {'$gte': now + SCHEDULE_REFRESH}}
+            },
+            fields=[
+                '_id', 'appletId', 'userId', 'userDefined', 'coordinatorDefined'
+            ],
+            limit=limit,
+            sort=[('scheduleExpandedUntil', 1)]
+        ):
+            profiles.setdefault(profile['appletId'], []).append(profile)
+        for appletId, appletProfiles in profiles.items():
+            applet = Applet().load(appletId, force=True)
+            if applet is not None:
+                self.expandProfiles(applet, appletProfiles, now)
+            else:
+                # The applet was deleted. Mark its profiles as expanded, so
+                # that they don't keep other profiles out of each batch.
+                Profile().update(
+                    {'_id': {'$in': [p['_id'] for p in appletProfiles]}},
+                    {'$set': {'scheduleExpandedUntil': now + SCHEDULE_HORIZON}}
+                )
+        return(sum([len(p) for p in profiles.values()]))
+
+    def extendLater(self):
+        """
+        Extend schedules (see extend) on the event workers, unless that is
+        already queued or running.
+        """
+        if not _extending.acquire(blocking=False):
+            return
+
+        def extend(event):
+            try:
+                self.extend()
+            finally:
+                _extending.release()
+
+        try:
+            events.daemon.trigger(
+                'schedule.extend', callback=extend, key='schedule.extend')
+        except Exception:
+            _extending.release()
+            raise
+
+    def parseAfter(self, after):
+        """
+        Parse the "next" value returned with a page of findDue.
+
+        :param after: The value, of the form "<milliseconds>_<ObjectId>".
+        :type after: str
+        :returns: tuple of the time and _id of the last occurrence of the page
+        :raises ValueError: if the value is malformed.
+        """
+        afterTime, _, afterId = str(after).partition('_')
+        if not ObjectId.is_valid(afterId):
+            raise ValueError('Invalid occurrence ID: %s' % afterId)
+        try:
+            afterTime = datetime.datetime.utcfromtimestamp(int(afterTime) / 1000)
+        except (OverflowError, OSError) as e:
+            raise ValueError(str(e))
+        return(afterTime, ObjectId(afterId))
+
+    def findDue(self, minutes, after=None, limit=1000, now=None):
+        """
+        Page through the occurrences due in the next few minutes, in order of
+        time.
+
+        :param minutes: Length of the window, starting now.
+        :type minutes: int
+        :param after: The "next" value returned with the previous page.
+        :type after: str or None
+        :raises ValueError: if after is malformed.
+        :param limit: Maximum number of occurrences to return.
+        :type limit: int
+        :returns: dict with the keys "occurrences" (list) and "next" (str to
+            pass as after for the next page, or None on the last page)
+        """
+        now = now or datetime.datetime.utcnow()
+        until = now + datetime.timedelta(minutes=minutes)
+        if after:
+            # Page from the last occurrence returned rather than from now, so
+            # that nothing falls between pages as time passes.
+            afterTime, afterId = self.parseAfter(after)
+            query = {'$or': [
+                {'time': {'$gt': afterTime, '$lt': until}},
+                {'time': afterTime, '_id': {'$gt': afterId}}
+            ]}
+        else:
+            query = {'time': {'$gte': now, '$lt': until}}
+        occurrences = list(self.find(
+            query,
+            limit=limit,
+            sort=[('time', 1), ('_id', 1)]
+        ))
+        last = occurrences[-1] if len(occurrences) == limit else None
+        return({
+            'occurrences': occurrences,
+            'next': '{}_{}'.format(
+                int(pytz.utc.localize(last['time']).timestamp() * 1000),
+                str(last['_id'])
+            ) if last else None
+        })
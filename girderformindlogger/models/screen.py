@@ -101,6 +101,7 @@ class Screen(Item):
             'creatorId': creator['_id'],
             'baseParentType': activity['baseParentType'],
             'baseParentId': activity['baseParentId'],
+            'ancestors': FolderModel().childAncestors(activity, user=creator),
             'created': now,
             'updated': now,
             'size': 0,
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+import datetime
+import six
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ReturnDocument, UpdateMany, UpdateOne
+
+from .model_base import Model
+from .notification import ProgressState
+from girderformindlogger import logger
+from girderformindlogger.constants import SortDir
+from girderformindlogger.utility.model_importer import ModelImporter
+from girderformindlogger.utility.progress import ProgressContext
+
+BATCH_SIZE = 1000
+# A running check records that it is alive at least this often; one that has
+# not for STALE_AFTER was interrupted (eg, by a restart), and is resumed by
+# the next request to run a check.
+HEARTBEAT_INTERVAL = datetime.timedelta(seconds=30)
+STALE_AFTER = datetime.timedelta(minutes=5)
+TASK_COUNT = 9
+
+
+class SystemCheck(Model):
+    """
+    Runs of the system consistency check, which removes orphaned files,
+    folders and items, fixes the base parents of folders and items, and
+    recalculates the sizes of items, folders, users and collections.
+
+    A check runs in a background thread. Each of its tasks finds what needs
+    fixing with a query or an aggregation and fixes it with bulk writes, and
+    tasks on different collections run in parallel. The result of each finished task
+    is stored in the check's "done" field, so a check that is interrupted or
+    fails is resumed from its unfinished tasks.
+    """
+
+    def initialize(self):
+        self.name = 'systemCheck'
+        self.ensureIndices(('status', 'created'))
+
+    def validate(self, doc):
+        return doc
+
+    def latest(self):
+        """
+        :returns: The most recent check, or None.
+        """
+        checks = list(self.find(sort=[('created', SortDir.DESCENDING)], limit=1))
+        return(checks[0] if len(checks) else None)
+
+    def start(self, user, progress=False):
+        """
+        Start a consistency check in the background. If a check is already
+        running, it is returned instead; if the last check did not finish, it
+        is resumed.
+
+        :param user: The administrator running the check.
+        :type user: dict
+        :param progress: Whether to record progress notifications for the user.
+        :type progress: bool
+        :returns: The check's document.
+        """
+        now = datetime.datetime.utcnow()
+        check = self.latest()
+        if check is None or check['status'] == ProgressState.SUCCESS:
+            check = self.save({
+                'status': ProgressState.ACTIVE,
+                'userId': user['_id'],
+                'created': now,
+                'updated': now,
+                'done': {}
+            })
+        elif check['status'] == ProgressState.ACTIVE and (
+            check['updated'] > now - STALE_AFTER
+        ):
+            return(check)
+        else:
+            # Claim the check, in case another server is resuming it too.
+            self._invalidateCaches(check['_id'])
+            check = self.collection.find_one_and_update(
+                {'_id': check['_id'], 'updated': check['updated']},
+                {'$set': {'status': ProgressState.ACTIVE, 'updated': now},
+                 '$unset': {'error': True}},
+                return_document=ReturnDocument.AFTER
+            )
+            if check is None:
+                return(self.latest())
+        thread = threading.Thread(target=self.run, args=(check, user, progress))
+        thread.daemon = True
+        thread.start()
+        return(check)
+
+    def run(self, check, user=None, progress=False):
+        """
+        Run the unfinished tasks of a check, and record its results.
+
+        :param check: The check's document.
+        :type check: dict
+        :param user: The user to record progress notifications for.
+        :type user: dict
+        :param progress: Whether to record progress notifications.
+        :type progress: bool
+        """
+        try:
+            with ProgressContext(
+                progress, user=user, title='Running system consistency check',
+                total=TASK_COUNT
+            ) as pc:
+                run = _CheckRun(self, check, pc)
+                pc.update(title='Checking for orphaned records (Step 1 of 3)')
+                self._pruneOrphans(run)
+                pc.update(title='Checking for incorrect base parents (Step 2 of 3)')
+                self._fixBaseParents(run)
+                pc.update(title='Checking for incorrect sizes (Step 3 of 3)')
+                self._recalculateSizes(run)
+        except Exception as e:
+            logger.exception('System consistency check failed')
+            self.update({'_id': check['_id']}, {'$set': {
+                'status': ProgressState.ERROR,
+                'error': str(e),
+                'updated': datetime.datetime.utcnow()
+            }})
+            return
+        self.update({'_id': check['_id']}, {'$set': {
+            'status': ProgressState.SUCCESS,
+            'results': {
+                key: sum(counts.values()) for key, counts in run.done.items()
+            },
+            'updated': datetime.datetime.utcnow()
+        }})
+
+    def _pruneOrphans(self, run):
+        from .file import File
+        from .folder import Folder
+        from .item import Item
+
+        models = {'file': File(), 'folder': Folder(), 'item': Item()}
+        finders = {
+            'file': self._orphanFiles,
+            'folder': lambda: self._findOrphans(
+                models['folder'], 'parentId', _modelNamed, 'parentCollection'
+            ),
+            'item': lambda: self._findOrphans(
+                models['item'], 'folderId', lambda type: models['folder']
+            )
+        }
+        pending = [
+            name for name in finders if not run.isDone('orphansRemoved', name)
+        ]
+        # Find every orphan before removing any, as removing a folder or item
+        # removes its children, which would then look orphaned too.
+        with ThreadPoolExecutor(max(len(pending), 1)) as executor:
+            orphans = dict(zip(pending, executor.map(
+                lambda name: finders[name](), pending
+            )))
+        run.tasks('orphansRemoved', [
+            (name, self._removeOrphans, models[name], orphans[name])
+            for name in pending
+        ])
+
+    def _orphanFiles(self):
+        from .file import File
+        from .item import Item
+
+        fileModel = File()
+        return(self._findOrphans(
+            fileModel, 'itemId', lambda type: Item(),
+            query={'attachedToId': None}
+        ) + self._findOrphans(
+            fileModel, 'attachedToId', _modelNamed, 'attachedToType',
+            query={'attachedToId': {'$ne': None}}
+        ))
+
+    def _findOrphans(self, model, idField, parentModel, typeField=None,
+                     query=None):
+        """
+        Find the documents whose parent is missing, grouping them by parent
+        so that each parent is only looked up once.
+
+        :param model: The model of the documents.
+        :param idField: The field holding a document's parent's id.
+        :type idField: str
+        :param parentModel: A function of the value of typeField returning the
+            model of the parent, or None if the type is invalid.
+        :param typeField: The field holding the type of a document's parent.
+        :type typeField: str or None
+        :param query: Only check the documents matching this query.
+        :type query: dict or None
+        :returns: The ids of the orphaned documents.
+        :rtype: list
+        """
+        group = {'id': '$' + idField}
+        if typeField:
+            group['type'] = '$' + typeField
+        parents = {}
+        for result in model.collection.aggregate([
+            {'$match': query or {}},
+            {'$group': {'_id': group}}
+        ], allowDiskUse=True):
+            type = result['_id'].get('type')
+            parents.setdefault(
+                tuple(type) if isinstance(type, list) else type, []
+            ).append(result['_id'].get('id'))
+        orphans = []
+        for type, ids in parents.items():
+            parent = parentModel(type)
+            for i in range(0, len(ids), BATCH_SIZE):
+                batch = ids[i:i + BATCH_SIZE]
+                found = set() if parent is None else {
+                    doc['_id'] for doc in parent.find(
+                        {'_id': {'$in': batch}}, fields=['_id'])
+                }
+                missing = [id for id in batch if id not in found]
+                if not len(missing):
+                    continue
+                orphanQuery = dict(query or {}, **{idField: {'$in': missing}})
+                if typeField:
+                    orphanQuery[typeField] = list(type) if isinstance(
+                        type, tuple) else type
+                orphans.extend(
+                    doc['_id'] for doc in model.find(orphanQuery, fields=['_id'])
+                )
+        return(orphans)
+
+    def _removeOrphans(self, run, model, ids):
+        # Removal cascades to children and assetstores, so orphans are
+        # removed one at a time.
+        count = 0
+        for i in range(0, len(ids), BATCH_SIZE):
+            for doc in model.find({'_id': {'$in': ids[i:i + BATCH_SIZE]}}):
+                model.remove(doc)
+                count += 1
+            run.heartbeat()
+        return(count)
+
+    def _fixBaseParents(self, run):
+        # Items take their base parent from their folder, so folders go first.
+        run.tasks('baseParentsFixed', [('folder', self._fixFolderBaseParents)])
+        run.tasks('baseParentsFixed', [('item', self._fixItemBaseParents)])
+
+    def _fixFolderBaseParents(self, run):
+        from .folder import Folder
+
+        folderModel = Folder()
+        fixes = 0
+        ancestors = {}
+
+        def fixBatch(folders):
+            # Roots come from the stored ancestors where they end at the
+            # folder's parent, or else by loading the folder's ancestors (with
+            # just the fields needed) a level at a time.
+            roots = {}
+            unknown = []
+            for folder in folders:
+                if folder.get('parentCollection') != 'folder':
+                    roots[folder['_id']] = (
+                        folder.get('parentCollection'), folder.get('parentId'))
+                elif folder.get('ancestors') and (
+                    folder['ancestors'][-1]['_id'] == folder['parentId']
+                ):
+                    roots[folder['_id']] = (
+                        folder['ancestors'][0]['type'],
+                        folder['ancestors'][0]['_id'])
+                else:
+                    unknown.append(folder)
+            if len(ancestors) > 100 * BATCH_SIZE:
+                ancestors.clear()
+            for id, path in six.viewitems(
+                folderModel._pathsFromRoot(unknown, ancestors)
+            ):
+                # A path that is broken or cyclic is None.
+                if path:
+                    roots[id] = (path[0]['type'], path[0]['object']['_id'])
+            return(_bulkWrite(folderModel, [
+                UpdateOne({'_id': folder['_id']}, {'$set': {
+                    'baseParentType': roots[folder['_id']][0],
+                    'baseParentId': roots[folder['_id']][1]
+                }}) for folder in folders if folder['_id'] in roots and (
+                    folder.get('baseParentType'), folder.get('baseParentId')
+                ) != roots[folder['_id']]
+            ]))
+
+        folders = []
+        for folder in folderModel.find({}, fields=[
+            'parentId', 'parentCollection', 'baseParentId', 'baseParentType',
+            'ancestors'
+        ]):
+            folders.append(folder)
+            if len(folders) >= BATCH_SIZE:
+                fixes += fixBatch(folders)
+                folders = []
+                run.heartbeat()
+        return(fixes + (fixBatch(folders) if len(folders) else 0))
+
+    def _fixItemBaseParents(self, run):
+        from .folder import Folder
+        from .item import Item
+
+        folderModel = Folder()
+        itemModel = Item()
+        fixes = 0
+
+        def fixBatch(groups):
+            folders = {folder['_id']: folder for folder in folderModel.find(
+                {'_id': {'$in': list({group['folderId'] for group in groups})}},
+                fields=['baseParentId', 'baseParentType']
+            )}
+            wrong = set()
+            for group in groups:
+                folder = folders.get(group['folderId'])
+                if folder is not None and (
+                    group.get('baseParentType'), group.get('baseParentId')
+                ) != (folder.get('baseParentType'), folder.get('baseParentId')):
+                    wrong.add(group['folderId'])
+            return(_bulkWrite(itemModel, [UpdateMany({
+                'folderId': folderId,
+                '$or': [
+                    {'baseParentType': {'$ne': folders[folderId]['baseParentType']}},
+                    {'baseParentId': {'$ne': folders[folderId]['baseParentId']}}
+                ]
+            }, {'$set': {
+                'baseParentType': folders[folderId]['baseParentType'],
+                'baseParentId': folders[folderId]['baseParentId']
+            }}) for folderId in wrong]))
+
+        # Items can only differ from their folder in a few ways, so group
+        # them by folder and base parent rather than checking each one.
+        groups = []
+        for result in itemModel.collection.aggregate([
+            {'$match': {'folderId': {'$ne': None}}},
+            {'$group': {'_id': {
+                'folderId': '$folderId',
+                'baseParentId': '$baseParentId',
+                'baseParentType': '$baseParentType'
+            }}}
+        ], allowDiskUse=True):
+            groups.append(result['_id'])
+            if len(groups) >= BATCH_SIZE:
+                fixes += fixBatch(groups)
+                groups = []
+                run.heartbeat()
+        return(fixes + (fixBatch(groups) if len(groups) else 0))
+
+    def _recalculateSizes(self, run):
+        from .collection import Collection
+        from .file import File
+        from .folder import Folder
+        from .item import Item
+        from .user import User
+
+        # Each size is the sum of the sizes of the level below: items of
+        # their files, folders of their items, and users and collections of
+        # every folder they contain.
+        run.tasks('sizesChanged', [
+            ('item', self._fixSizes, Item(), File(), 'itemId')
+        ])
+        run.tasks('sizesChanged', [
+            ('folder', self._fixSizes, Folder(), Item(), 'folderId')
+        ])
+        run.tasks('sizesChanged', [
+            ('user', self._fixSizes, User(), Folder(), 'baseParentId',
+             {'baseParentType': 'user'}),
+            ('collection', self._fixSizes, Collection(), Folder(),
+             'baseParentId', {'baseParentType': 'collection'})
+        ])
+
+    def _fixSizes(self, run, model, childModel, parentField, query=None):
+        sizes = {
+            result['_id']: result['size'] for result in
+            childModel.collection.aggregate([
+                {'$match': dict(query or {}, **{parentField: {'$ne': None}})},
+                {'$group': {'_id': '$' + parentField, 'size': {'$sum': '$size'}}}
+            ], allowDiskUse=True)
+        }
+        fixes = 0
+        updates = []
+        ids = list(sizes)
+        for i in range(0, len(ids), BATCH_SIZE):
+            updates = [
+                UpdateOne({'_id': doc['_id']}, {'$set': {
+                    'size': sizes[doc['_id']]
+                }}) for doc in model.find(
+                    {'_id': {'$in': ids[i:i + BATCH_SIZE]}}, fields=['size']
+                ) if doc.get('size') != sizes[doc['_id']]
+            ]
+            fixes += _bulkWrite(model, updates)
+            run.heartbeat()
+        # Documents without children should be empty.
+        updates = []
+        for doc in model.find({'size': {'$ne': 0}}, fields=['_id']):
+            if doc['_id'] not in sizes:
+                updates.append(UpdateOne({'_id': doc['_id']}, {'$set': {
+                    'size': 0
+                }}))
+            if len(updates) >= BATCH_SIZE:
+                fixes += _bulkWrite(model, updates)
+                updates = []
+                run.heartbeat()
+        return(fixes + _bulkWrite(model, updates))
+
+
+class _CheckRun(object):
+    """
+    The state of a running check, shared by its tasks' threads.
+    """
+
+    def __init__(self, model, check, progress):
+        self.model = model
+        self.check = check
+        self.progress = progress
+        self.done = check.get('done', {})
+        self._lastHeartbeat = datetime.datetime.utcnow()
+        self._lock = threading.Lock()
+        progress.update(current=sum(len(tasks) for tasks in self.done.values()))
+
+    def isDone(self, key, name):
+        return(name in self.done.get(key, {}))
+
+    def tasks(self, key, tasks):
+        """
+        Run the unfinished tasks among a list in parallel.
+
+        :param key: The result the tasks count towards.
+        :type key: str
+        :param tasks: (name, function, args...) tuples. Each function is
+            called with this run and the args, and returns its count.
+        :type tasks: list
+        """
+        tasks = [task for task in tasks if not self.isDone(key, task[0])]
+        if not len(tasks):
+            return
+        with ThreadPoolExecutor(len(tasks)) as executor:
+            for future in [
+                executor.submit(self._runTask, key, *task) for task in tasks
+            ]:
+                future.result()
+
+    def _runTask(self, key, name, func, *args):
+        count = func(self, *args)
+        with self._lock:
+            self.done.setdefault(key, {})[name] = count
+            self._lastHeartbeat = datetime.datetime.utcnow()
+            self.model.update({'_id': self.check['_id']}, {'$set': {
+                'done.%s.%s' % (key, name): count,
+                'updated': self._lastHeartbeat
+            }})
+            self.progress.update(increment=1, message='Checked %ss' % name)
+
+    def heartbeat(self):
+        """
+        Record that the check is still running. Tasks call this after each
+        batch of work.
+        """
+        with self._lock:
+            now = datetime.datetime.utcnow()
+            if now - self._lastHeartbeat >= HEARTBEAT_INTERVAL:
+                self._lastHeartbeat = now
+                self.model.update(
+                    {'_id': self.check['_id']}, {'$set': {'updated': now}})
+            self.progress.update()
+
+
+def _modelNamed(name):
+    if isinstance(name, six.string_types):
+        return(ModelImporter.model(name))
+    if isinstance(name, tuple) and len(name) == 2:
+        return(ModelImporter.model(*name))
+    return(None)
+
+
+def _bulkWrite(model, updates):
+    if not len(updates):
+        return(0)
+    model._invalidateCaches()
+    return(model.collection.bulk_write(updates, ordered=False).modified_count)
@@ -223,6 +223,27 @@ class User(AccessControlledModel):
 
         return user
 
+    def loadCached(self, user):
+        """
+        Add the applet cache to a user loaded without it, as is the current
+        user of a request (see :py:func:`girderformindlogger.api.rest.getCurrentUser`).
+
+        :param user: The user document, which is modified.
+        :type user: dict
+        :returns: The user document.
+        """
+        if 'cached' not in user and '_id' in user:
+            stored = self.load(user['_id'], force=True, fields=['cached'])
+            if stored and 'cached' in stored:
+                user['cached'] = stored['cached']
+        return(user)
+
+    def save(self, user, *args, **kwargs):
+        # Saving replaces the whole document, so don't drop the applet cache
+        # of a user loaded without it.
+        self.loadCached(user)
+        return super(User, self).save(user, *args, **kwargs)
+
     def remove(self, user, progress=None, **kwargs):
         """
         Delete a user, and all references to it in the database.
@@ -1,4 +1,8 @@
 import cherrypy
+import collections
+import copy
+import threading
+import time
 from dogpile.cache import make_region, register_backend
 from dogpile.cache.backends.memory import MemoryBackend
 
@@ -23,6 +27,255 @@ class CherrypyRequestBackend(MemoryBackend):
         return cherrypy.request._girderCache
 
 
+class LRUCache(object):
+    """
+    A thread-safe, size-bounded mapping for process-level caches. When full,
+    the least recently used entry is evicted. If ttl (in seconds) is given,
+    entries also expire that long after they are set.
+
+    Subclasses that index the cached values can override _added and
+    _removed, which are called with the cache locked as each entry is set
+    and as it leaves the cache (replaced, evicted, expired or deleted).
+    """
+
+    def __init__(self, maxSize, ttl=None):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _added(self, key, value):
+        pass
+
+    def _removed(self, key, value):
+        pass
+
+    def _pop(self, key):
+        self._expires.pop(key, None)
+        self._removed(key, self._data.pop(key))
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            if self.ttl is not None and self._expires[key] < time.time():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = value
+            self._added(key, value)
+            if self.ttl is not None:
+                self._expires[key] = time.time() + self.ttl
+            while len(self._data) > self.maxSize:
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+
+    def deleteWhere(self, predicate):
+        """
+        Delete every entry for which ``predicate(key, value)`` is true.
+        """
+        with self._lock:
+            for key in [k for k, v in self._data.items() if predicate(k, v)]:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._data):
+                self._pop(key)
+
+
+class RequestIdentityMap(object):
+    """
+    Documents loaded by _id during the current CherryPy request, keyed by
+    collection, _id and projection, so that loading the same document again
+    in the same request doesn't go back to the database.
+
+    It is only active while handling a request and while the request cache
+    is configured with the ``cherrypy_request`` backend (that is, when
+    ``[cache] enabled`` is set). Documents are copied in and out, so callers
+    may modify what they load. Per-request hit and miss counts are available
+    from :py:meth:`stats`.
+    """
+
+    def _state(self):
+        try:
+            if not isinstance(requestCache.backend, CherrypyRequestBackend):
+                return None
+        except AttributeError:
+            return None
+        # Outside of a request, cherrypy.request is a default object shared
+        # by every thread.
+        if cherrypy.request.app is None:
+            return None
+        if not hasattr(cherrypy.request, '_girderIdentityMap'):
+            cherrypy.request._girderIdentityMap = {
+                'documents': {},
+                'hits': 0,
+                'misses': 0
+            }
+        return cherrypy.request._girderIdentityMap
+
+    @staticmethod
+    def _fieldsKey(fields):
+        if fields is None:
+            return None
+        if isinstance(fields, str):
+            fields = [fields]
+        if isinstance(fields, dict):
+            key = tuple(sorted(fields.items()))
+        else:
+            key = tuple(sorted(fields))
+        try:
+            hash(key)
+        except TypeError:
+            return False
+        return key
+
+    def get(self, collection, id, fields=None):
+        """
+        Get a copy of a document loaded earlier in this request.
+
+        :returns: A tuple of whether the document was in the map, and the
+            document (which is None if it didn't exist).
+        """
+        state = self._state()
+        fieldsKey = self._fieldsKey(fields)
+        if state is None or fieldsKey is False:
+            return False, None
+        documents = state['documents'].get(collection, {}).get(id, {})
+        if fieldsKey not in documents:
+            state['misses'] += 1
+            return False, None
+        state['hits'] += 1
+        return True, copy.deepcopy(documents[fieldsKey])
+
+    def set(self, collection, id, fields, doc):
+        state = self._state()
+        fieldsKey = self._fieldsKey(fields)
+        if state is None or fieldsKey is False:
+            return
+        state['documents'].setdefault(collection, {}).setdefault(id, {})[
+            fieldsKey] = copy.deepcopy(doc)
+
+    def invalidate(self, collection, id=None):
+        """
+        Forget a document, or every document of a collection if no id is
+        given.
+        """
+        state = self._state()
+        if state is None:
+            return
+        if id is None:
+            state['documents'].pop(collection, None)
+        else:
+            state['documents'].get(collection, {}).pop(id, None)
+
+    def stats(self):
+        """
+        :returns: The number of hits and misses in the current request.
+        :rtype: dict
+        """
+        state = self._state()
+        return {
+            'hits': state['hits'] if state else 0,
+            'misses': state['misses'] if state else 0
+        }
+
+
+class AuthCache(object):
+    """
+    Tokens, and the users they authenticate, by token, so that requests
+    don't load them from the database every time. Users are held without
+    their (large) ``cached`` field.
+
+    Entries expire after a short ttl (in seconds), so that tokens removed and
+    users changed by other server processes are soon noticed, and entries are
+    invalidated when this process saves or removes their token or user.
+    Tokens and users are copied in and out, so callers may modify them.
+    """
+
+    def __init__(self, maxSize, ttl):
+        self._entries = LRUCache(maxSize, ttl=ttl)
+
+    def getToken(self, tokenStr):
+        """
+        :returns: A tuple of whether the token was in the cache, and a copy
+            of the token (which is None if it doesn't exist).
+        """
+        entry = self._entries.get(tokenStr)
+        if entry is None:
+            return False, None
+        return True, copy.deepcopy(entry['token'])
+
+    def setToken(self, tokenStr, token):
+        self._entries.set(tokenStr, {'token': copy.deepcopy(token)})
+
+    def getUser(self, tokenStr):
+        """
+        :returns: A copy of the user authenticated by a token, or None if it
+            isn't in the cache.
+        """
+        entry = self._entries.get(tokenStr)
+        if entry is None or 'user' not in entry:
+            return None
+        return copy.deepcopy(entry['user'])
+
+    def setUser(self, tokenStr, user):
+        entry = self._entries.get(tokenStr)
+        if entry is not None:
+            entry['user'] = copy.deepcopy(user)
+
+    def invalidate(self, collection, id=None):
+        """
+        Forget the entries of a token or user, or of every token or user if
+        no id is given.
+        """
+        if collection == 'token':
+            if id is None:
+                self._entries.clear()
+            else:
+                self._entries.deleteWhere(
+                    lambda key, entry: entry['token'] is not None and (
+                        entry['token']['_id'] == id))
+        elif collection == 'user':
+            if id is None:
+                self._entries.deleteWhere(lambda key, entry: 'user' in entry)
+            else:
+                self._entries.deleteWhere(
+                    lambda key, entry: entry['token'] is not None and (
+                        entry['token'].get('userId') == id))
+
+    def invalidateMany(self, collection, ids):
+        """
+        Forget the entries of several tokens or users at once.
+        """
+        ids = set(ids)
+        if not ids:
+            return
+        field = {'token': '_id', 'user': 'userId'}.get(collection)
+        if field is not None:
+            self._entries.deleteWhere(
+                lambda key, entry: entry['token'] is not None and (
+                    entry['token'].get(field) in ids))
+
+    def clear(self):
+        self._entries.clear()
+
+
 register_backend('cherrypy_request', 'girderformindlogger.utility._cache', 'CherrypyRequestBackend')
 
 # These caches must be configured with the null backend upon creation due to the fact
@@ -35,3 +288,10 @@ requestCache = make_region(name='girderformindlogger.request').configure(backend
 # It holds data for rate limiting, which is ephemeral, but must be persisted (i.e. it's not optional
 # or best-effort).
 rateLimitBuffer = make_region(name='girderformindlogger.rate_limit')
+
+identityMap = RequestIdentityMap()
+
+# Tokens expire from this cache after AUTH_CACHE_TTL seconds.
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL = 30
+authCache = AuthCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar (Apache Parquet and Arrow IPC stream) writers for response data.
+
+Rows are converted to typed columns, one per item IRI, and written in row
+groups so an export can be streamed without holding the whole study in
+memory:
+
+    for data in columnarLines(rows, schema, 'parquet'):
+        yield data
+
+pyarrow is an optional dependency and is only imported when a columnar
+export is requested.
+"""
+
+import json
+
+from girderformindlogger.exceptions import RestException
+from girderformindlogger.utility import JsonEncoder
+
+__all__ = ('COLUMNAR_FORMATS', 'FIXED_COLUMNS', 'RESPONSE_FIELDS',
+           'columnarLines', 'responseSchema')
+
+COLUMNAR_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.stream'
+}
+ROW_GROUP_SIZE = 10000
+
+# The parts of a response item needed to build its columnar row. This keeps
+# the stored aggregates (allTime, last7Days) out of the export cursor.
+RESPONSE_FIELDS = [
+    'baseParentId',
+    'meta.applet',
+    'meta.activity',
+    'meta.subject',
+    'meta.responses',
+    'meta.responseStarted',
+    'meta.responseCompleted'
+]
+
+# The columns of every export, before those of the item IRIs.
+FIXED_COLUMNS = (
+    'respondent',
+    'applet',
+    'activity',
+    'subject',
+    'responseStarted',
+    'responseCompleted'
+)
+
+_INT_TYPES = {'int', 'long'}
+_NUMBER_TYPES = {'int', 'long', 'double', 'decimal'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RestException(
+            'Columnar exports require pyarrow, which is not installed on '
+            'this server.',
+            code=501
+        )
+    return pyarrow
+
+
+class _ChunkSink(object):
+    """
+    A write-only file-like object that holds written bytes until they are
+    drained into the response stream.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _columnType(pa, bsonTypes):
+    """
+    Choose an Arrow type for a column from the BSON types of its values.
+    Mixed and nested values are stored as JSON strings.
+    """
+    bsonTypes = set(bsonTypes) - {'null', 'missing', 'undefined'}
+    if not bsonTypes:
+        return pa.string()
+    if bsonTypes <= _INT_TYPES:
+        return pa.int64()
+    if bsonTypes <= _NUMBER_TYPES:
+        return pa.float64()
+    if bsonTypes == {'bool'}:
+        return pa.bool_()
+    if bsonTypes == {'date'}:
+        return pa.timestamp('ms', tz='UTC')
+    return pa.string()
+
+
+def responseSchema(itemTypes, columns=None):
+    """
+    Build the Arrow schema of a response export.
+
+    :param itemTypes: BSON types of the values of each item IRI, as returned
+        by :py:func:`girderformindlogger.models.applet.Applet.getResponseItemTypes`
+    :type itemTypes: dict
+    :param columns: item IRIs to include, or None for all of them
+    :type columns: list or None
+    :returns: pyarrow.Schema
+    """
+    pa = _pyarrow()
+    timestamp = pa.timestamp('ms', tz='UTC')
+    items = sorted(itemTypes) if columns is None else list(columns)
+    collisions = sorted(set(items) & set(FIXED_COLUMNS))
+    if collisions:
+        raise RestException(
+            'Columns may not be named %s.' % ', '.join(collisions))
+    return pa.schema([
+        ('respondent', pa.string()),
+        ('applet', pa.string()),
+        ('activity', pa.string()),
+        ('subject', pa.string()),
+        ('responseStarted', timestamp),
+        ('responseCompleted', timestamp)
+    ] + [
+        (item, _columnType(pa, itemTypes.get(item, ()))) for item in items
+    ])
+
+
+def _convert(pa, dataType, value):
+    from girderformindlogger.utility.response import responseDatetime
+
+    if value is None:
+        return None
+    try:
+        if pa.types.is_timestamp(dataType):
+            return responseDatetime(value)
+        if pa.types.is_integer(dataType):
+            return int(value)
+        if pa.types.is_floating(dataType):
+            return float(value)
+        if pa.types.is_boolean(dataType):
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, cls=JsonEncoder, sort_keys=True)
+
+
+def _rowValues(row):
+    responses = row.get('responses', {})
+    return dict(responses if isinstance(responses, dict) else {}, **{
+        'respondent': row.get('respondent'),
+        'applet': (row.get('applet') or {}).get('@id'),
+        'activity': (row.get('activity') or {}).get('@id'),
+        'subject': (row.get('subject') or {}).get('@id'),
+        'responseStarted': row.get('responseStarted'),
+        'responseCompleted': row.get('responseCompleted')
+    })
+
+
+def columnarLines(rows, schema, format='parquet', rowGroupSize=ROW_GROUP_SIZE):
+    """
+    Serialize response data rows into a Parquet file or an Arrow IPC stream,
+    yielding the encoded bytes one row group at a time.
+
+    :param rows: response data rows, as generated by
+        :py:func:`girderformindlogger.models.applet.Applet.iterResponseData`
+    :type rows: iterable
+    :param schema: the export schema, see :py:func:`responseSchema`
+    :type schema: pyarrow.Schema
+    :param format: 'parquet' or 'arrow'
+    :type format: str
+    :param rowGroupSize: number of rows to write per row group
+    :type rowGroupSize: int
+    """
+    pa = _pyarrow()
+    sink = _ChunkSink()
+    if format == 'parquet':
+        writer = pa.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+
+    def writeBatch(columns):
+        writer.write_table(pa.Table.from_arrays([
+            pa.array(values, type=field.type)
+            for field, values in zip(schema, columns)
+        ], schema=schema))
+        return sink.drain()
+
+    columns = [[] for field in schema]
+    count = 0
+    for row in rows:
+        values = _rowValues(row)
+        for field, column in zip(schema, columns):
+            column.append(_convert(pa, field.type, values.get(field.name)))
+        count += 1
+        if count >= rowGroupSize:
+            yield writeBatch(columns)
+            columns = [[] for field in schema]
+            count = 0
+    if count:
+        yield writeBatch(columns)
+    writer.close()
+    yield sink.drain()
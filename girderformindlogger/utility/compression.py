@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Compression of REST responses, negotiated with the ``Accept-Encoding`` header
+of each request.
+
+JSON and text responses of at least ``compression_min_size`` bytes are sent
+gzip compressed, or brotli compressed if the ``brotli`` package is installed
+(``pip install girderformindlogger[brotli]``) and the client prefers it, or
+accepts it as much as gzip. Streamed responses are compressed as they are
+sent, whatever their size. This is configured in the ``[server]`` section of
+the config file::
+
+    [server]
+    compression = True
+    compression_min_size = 1024
+"""
+
+import zlib
+
+from girderformindlogger.utility import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ('ENCODINGS', 'IDENTITY', 'acceptedEncoding', 'compress', 'compressStream',
+           'isCompressible', 'isEnabled', 'minSize')
+
+# Supported encodings, preferred first.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+# The encoding of uncompressed responses.
+IDENTITY = 'identity'
+DEFAULT_MIN_SIZE = 1024
+# Compression levels for responses compressed per request, and for those
+# compressed once and stored (see ResponseCache).
+GZIP_LEVEL = 6
+GZIP_STORED_LEVEL = 9
+BROTLI_QUALITY = 5
+BROTLI_STORED_QUALITY = 11
+
+# Content types worth compressing; event streams are left alone, since
+# compressors hold back output that their clients are waiting for.
+_COMPRESSIBLE_TYPES = {
+    'application/json',
+    'application/ld+json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml'
+}
+
+
+def isEnabled():
+    return config.getConfig()['server'].get('compression', True)
+
+
+def minSize():
+    """
+    :returns: The size in bytes from which responses are compressed.
+    """
+    return int(config.getConfig()['server'].get(
+        'compression_min_size',
+        DEFAULT_MIN_SIZE
+    ))
+
+
+def isCompressible(contentType):
+    """
+    :param contentType: The value of a Content-Type header, or None.
+    :type contentType: str
+    :rtype: bool
+    """
+    if not contentType:
+        return False
+    mediaType = contentType.split(';', 1)[0].strip().lower()
+    if mediaType == 'text/event-stream':
+        return False
+    return mediaType in _COMPRESSIBLE_TYPES or mediaType.startswith('text/')
+
+
+def acceptedEncoding(acceptEncoding):
+    """
+    Choose the encoding of a response.
+
+    :param acceptEncoding: The value of the request's Accept-Encoding header,
+        eg, "gzip, deflate, br" or "br;q=1.0, gzip;q=0.8, *;q=0.1".
+    :type acceptEncoding: str or None
+    :returns: The supported encoding with the highest quality value, the
+        most preferred of ENCODINGS in a tie, or None if the client accepts
+        none of them.
+    """
+    if not acceptEncoding:
+        return None
+    qualities = {}
+    for item in acceptEncoding.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding] = quality
+    best = None
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best is not None else None
+
+
+def compress(data, encoding, stored=False):
+    """
+    :param data: The response body.
+    :type data: bytes
+    :param encoding: One of ENCODINGS.
+    :type encoding: str
+    :param stored: Whether the result will be stored and sent many times, so
+        is worth compressing harder.
+    :type stored: bool
+    :rtype: bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(
+            data,
+            mode=brotli.MODE_TEXT,
+            quality=BROTLI_STORED_QUALITY if stored else BROTLI_QUALITY
+        )
+    compressor = zlib.compressobj(
+        GZIP_STORED_LEVEL if stored else GZIP_LEVEL,
+        zlib.DEFLATED,
+        16 + zlib.MAX_WBITS
+    )
+    return compressor.compress(data) + compressor.flush()
+
+
+def compressStream(chunks, encoding):
+    """
+    Compress a streamed response body as it is sent. The compressor sends
+    its output in blocks, rather than after every chunk.
+
+    :param chunks: The chunks of the body, as bytes or str.
+    :type chunks: iterable
+    :param encoding: One of ENCODINGS.
+    :type encoding: str
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf8')
+        out = process(chunk)
+        if out:
+            yield out
+    yield finish()
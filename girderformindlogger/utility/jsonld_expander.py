@@ -1,4 +1,5 @@
 from bson import json_util
+from bson.objectid import ObjectId
 from copy import deepcopy
 from datetime import datetime
 from girderformindlogger.constants import AccessType, DEFINED_RELATIONS,       \
@@ -671,9 +672,44 @@ def createCache(obj, formatted, modelType, user):
         **formatted,
         "prov:generatedAtTime": xsdNow()
     })
+    obj["cachedVersion"] = cacheVersion()
+    if modelType=='applet':
+        obj["activityIndex"] = activityIndex(formatted)
     return(MODELS()[modelType]().save(obj, validate=False))
 
 
+def cacheVersion():
+    """
+    Identify a new version of a document's "cached" field, to be stored with
+    it as "cachedVersion" whenever it changes, so that responses built from
+    the cache (see ResponseCache) can be reused until it changes again.
+
+    :returns: str
+    """
+    return(str(ObjectId()))
+
+
+def activityIndex(formatted):
+    """
+    List the activities of a formatted applet as small dicts of "_id" and
+    "url", so that callers that only need to enumerate activities don't need
+    to load the whole cached applet.
+
+    :param formatted: Applet as returned by formatLdObject
+    :type formatted: dict
+    :returns: list of dicts
+    """
+    return([
+        {
+            "_id": activity.get('_id', ''),
+            "url": url
+        } for url, activity in (formatted or {}).get(
+            'activities',
+            {}
+        ).items() if isinstance(activity, dict)
+    ])
+
+
 def loadCache(obj, user=None):
     if isinstance(obj, dict):
         if 'applet' in obj:
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+Delivery of the emails queued in the
+:py:class:`~girderformindlogger.models.mail_outbox.MailOutbox`.
+
+A small pool of worker threads claims queued messages and sends them. Each
+worker keeps its SMTP connection open between messages, so that a wave of
+invitations costs one handshake and login per ``messages_per_session``
+messages rather than one per message, and closes it after ``IDLE_TIMEOUT``
+without mail. Messages that fail are retried with an increasing delay.
+
+The pool is configured in the ``[email]`` section of the config file::
+
+    [email]
+    # Number of worker threads sending mail
+    workers = 2
+    # Most messages sent per second by this process; 0 for no limit
+    rate_limit = 10
+    # Most messages sent over one SMTP connection
+    messages_per_session = 100
+
+If the event daemon is disabled, mail is sent in the thread that queues it
+instead, as events are, along with any earlier messages that are due to be
+retried.
+"""
+
+import smtplib
+import threading
+import time
+
+from girderformindlogger import logger, logprint
+from girderformindlogger.utility import config
+
+__all__ = ('ForegroundMailDelivery', 'MailDeliveryPool', 'MailWorker',
+           'RateLimiter', 'pool', 'setupDelivery')
+
+DEFAULT_WORKERS = 2
+DEFAULT_RATE_LIMIT = 10
+DEFAULT_MESSAGES_PER_SESSION = 100
+# Idle workers look for mail queued by other processes or due to be retried
+# at least this often, in seconds.
+POLL_INTERVAL = 10
+# Workers close their SMTP connection after this many seconds without mail.
+IDLE_TIMEOUT = 30
+
+
+class RateLimiter(object):
+    """
+    A token bucket shared by threads, which allows bursts of up to one
+    second's worth of messages.
+
+    :param rate: Most messages per second, or 0 or None for no limit.
+    :type rate: float
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = rate or 0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a message may be sent.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.rate,
+                    self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class MailWorker(object):
+    """
+    Sends queued messages over one reused SMTP connection.
+
+    :param name: Name recorded on the messages the worker claims.
+    :type name: str
+    :param rateLimiter: Limiter shared with the other workers.
+    :type rateLimiter: RateLimiter
+    :param messagesPerSession: Most messages sent over one connection.
+    :type messagesPerSession: int
+    """
+
+    def __init__(self, name, rateLimiter, messagesPerSession):
+        self.name = name
+        self.rateLimiter = rateLimiter
+        self.messagesPerSession = messagesPerSession
+        self.connection = None
+        self.sessionCount = 0
+        self.lastSent = None
+
+    def deliver(self, stop=None, ids=None):
+        """
+        Send messages until none are due, or the SMTP server can't be
+        reached.
+
+        :param stop: Event which, once set, stops delivery after the current
+            message.
+        :type stop: threading.Event or None
+        :param ids: If given, only send the messages with these _ids.
+        :type ids: list or None
+        :returns: The number of messages attempted. A message that was queued
+            again because the server couldn't be reached isn't counted.
+        """
+        from girderformindlogger.models.mail_outbox import MailOutbox
+
+        count = 0
+        while stop is None or not stop.is_set():
+            doc = MailOutbox().claim(self.name, ids)
+            if doc is None or not self.send(doc):
+                break
+            count += 1
+        return count
+
+    def send(self, doc):
+        """
+        Send one claimed message, and record whether it was sent.
+
+        :param doc: The message's document in the outbox.
+        :type doc: dict
+        :returns: False if the SMTP server couldn't be reached, in which case
+            the message is queued again without counting an attempt.
+        """
+        from girderformindlogger.models.mail_outbox import MailOutbox
+
+        self.rateLimiter.acquire()
+        if self.connection is None:
+            try:
+                self.open()
+            except (smtplib.SMTPException, OSError) as e:
+                # Including 5xx replies to the login, which are about the
+                # server's settings rather than the message.
+                logger.warning('Failed to connect to the SMTP server: %s', e)
+                MailOutbox().release(doc, str(e))
+                self.close()
+                return False
+        try:
+            refused = self.connection.send(
+                doc['from'],
+                doc['recipients'],
+                doc['message']
+            )
+        except smtplib.SMTPRecipientsRefused as e:
+            logger.warning('Email "%s" was refused: %s', doc['subject'], e)
+            MailOutbox().markFailed(doc, str(e), permanent=True)
+            return True
+        except smtplib.SMTPResponseException as e:
+            # 5xx replies to the message are permanent failures; 4xx are
+            # worth retrying.
+            logger.warning('Failed to send email "%s": %s', doc['subject'], e)
+            MailOutbox().markFailed(doc, str(e), permanent=e.smtp_code >= 500)
+            self.close()
+            return True
+        except (smtplib.SMTPException, OSError) as e:
+            logger.warning('Failed to send email "%s": %s', doc['subject'], e)
+            MailOutbox().markFailed(doc, str(e))
+            self.close()
+            return True
+
+        if refused:
+            logger.warning(
+                'Email "%s" was refused for %s',
+                doc['subject'],
+                ', '.join(refused)
+            )
+        MailOutbox().markSent(doc)
+        self.lastSent = time.monotonic()
+        self.sessionCount += 1
+        if self.sessionCount >= self.messagesPerSession:
+            self.close()
+        return True
+
+    def open(self):
+        from girderformindlogger.utility.mail_utils import smtpConnection
+
+        self.connection = smtpConnection()
+        logger.info(
+            'Opening SMTP connection to %s for %s',
+            self.connection.host,
+            self.name
+        )
+        self.connection.open()
+        self.sessionCount = 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.connection = None
+
+    def closeIfIdle(self):
+        if self.connection is not None and (
+            self.lastSent is None or time.monotonic() - self.lastSent >=
+            IDLE_TIMEOUT
+        ):
+            self.close()
+
+    def run(self, pool):
+        """
+        Send messages as they are queued until the pool stops.
+        """
+        try:
+            while not pool.stopping.is_set():
+                try:
+                    if not self.deliver(pool.stopping):
+                        self.closeIfIdle()
+                        pool.wait(POLL_INTERVAL)
+                except Exception:
+                    # Eg, the outbox is unreachable; unsent messages stay
+                    # queued. Wait without waking for new mail.
+                    logger.exception('Mail worker %s failed', self.name)
+                    self.close()
+                    pool.stopping.wait(POLL_INTERVAL)
+        finally:
+            self.close()
+
+
+class ForegroundMailDelivery(object):
+    """
+    Sends mail in the thread that queues it. This is used if the config file
+    disables the event daemon, and provides no-op start() and stop()
+    implementations to remain compatible with the API of MailDeliveryPool.
+    """
+
+    def __init__(self):
+        self.worker = MailWorker(
+            'foreground',
+            RateLimiter(None),
+            DEFAULT_MESSAGES_PER_SESSION
+        )
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def wake(self, docs=()):
+        """
+        Send the messages that were just queued, then any others that are
+        due, such as messages queued again after failing to send, which no
+        worker thread polls for.
+
+        :param docs: The queued messages' documents.
+        :type docs: list
+        """
+        ids = [doc['_id'] for doc in docs]
+        try:
+            # Fewer attempts than messages means the SMTP server couldn't be
+            # reached, so don't keep the request waiting to try again.
+            if self.worker.deliver(ids=ids) == len(ids):
+                self.worker.deliver()
+        finally:
+            self.worker.close()
+
+
+class MailDeliveryPool(object):
+    """
+    A pool of threads running :py:class:`MailWorker` s.
+
+    :param workers: Number of workers.
+    :type workers: int
+    :param rateLimit: Most messages sent per second by all workers.
+    :type rateLimit: float
+    :param messagesPerSession: Most messages sent over one connection.
+    :type messagesPerSession: int
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, rateLimit=DEFAULT_RATE_LIMIT,
+                 messagesPerSession=DEFAULT_MESSAGES_PER_SESSION):
+        rateLimiter = RateLimiter(rateLimit)
+        self.workers = [
+            MailWorker('mail-%d' % i, rateLimiter, messagesPerSession)
+            for i in range(workers)
+        ]
+        self.threads = []
+        self.stopping = threading.Event()
+        self._queued = threading.Condition()
+
+    def start(self):
+        logprint.info('Started %d mail delivery workers.' % len(self.workers))
+        self.stopping.clear()
+        self.threads = [
+            threading.Thread(target=worker.run, args=(self,), daemon=True)
+            for worker in self.workers
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stop the workers once they finish sending their current message.
+        """
+        self.stopping.set()
+        self.wake()
+        for thread in self.threads:
+            thread.join(timeout=POLL_INTERVAL)
+        self.threads = []
+
+    def wake(self, docs=()):
+        """
+        Tell idle workers that messages were queued.
+
+        :param docs: The queued messages' documents, which any worker may
+            send.
+        :type docs: list
+        """
+        with self._queued:
+            self._queued.notify_all()
+
+    def wait(self, timeout):
+        with self._queued:
+            if not self.stopping.is_set():
+                self._queued.wait(timeout)
+
+
+pool = ForegroundMailDelivery()
+
+
+def setupDelivery():
+    global pool
+    cfg = config.getConfig()
+    if cfg['server'].get('disable_event_daemon', False):
+        pool = ForegroundMailDelivery()
+    else:
+        email = cfg.get('email', {})
+        pool = MailDeliveryPool(
+            workers=int(email.get('workers', DEFAULT_WORKERS)),
+            rateLimit=float(email.get('rate_limit', DEFAULT_RATE_LIMIT)),
+            messagesPerSession=int(email.get(
+                'messages_per_session',
+                DEFAULT_MESSAGES_PER_SESSION
+            ))
+        )
@@ -149,7 +149,7 @@ class _SMTPConnection(object):
         self.username = username
         self.password = password
 
-    def __enter__(self):
+    def open(self):
         if self.encryption == 'ssl':
             self.connection = smtplib.SMTP_SSL(self.host, self.port)
         else:
@@ -158,20 +158,29 @@ class _SMTPConnection(object):
                 self.connection.starttls()
         if self.username and self.password:
             self.connection.login(self.username, self.password)
-        return self
 
     def send(self, fromAddress, toAddresses, message):
-        self.connection.sendmail(fromAddress, toAddresses, message)
+        return self.connection.sendmail(fromAddress, toAddresses, message)
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
+    def close(self):
         self.connection.quit()
 
+    def __enter__(self):
+        self.open()
+        return self
 
-def _submitEmail(msg, recipients):
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def smtpConnection():
+    """
+    :returns: An unopened connection to the SMTP server in the settings.
+    """
     from girderformindlogger.models.setting import Setting
 
     setting = Setting()
-    smtp = _SMTPConnection(
+    return _SMTPConnection(
         host=setting.get(SettingKey.SMTP_HOST),
         port=setting.get(SettingKey.SMTP_PORT),
         encryption=setting.get(SettingKey.SMTP_ENCRYPTION),
@@ -179,16 +188,26 @@ def _submitEmail(msg, recipients):
         password=setting.get(SettingKey.SMTP_PASSWORD)
     )
 
+
+def _submitEmail(msg, recipients):
+    smtp = smtpConnection()
+
     logger.info('Sending email to %s through %s', ', '.join(recipients), smtp.host)
 
     with smtp:
         smtp.send(msg['From'], recipients, msg.as_string())
 
 
+def _queueMail(messages):
+    from girderformindlogger.models.mail_outbox import MailOutbox
+    from girderformindlogger.utility import mail_delivery
+
+    docs = MailOutbox().enqueue(messages)
+    mail_delivery.pool.wake(docs)
+
+
 def _sendmail(event):
-    msg = event.info['message']
-    recipients = event.info['recipients']
-    _submitEmail(msg, recipients)
+    _queueMail([(event.info['message'], event.info['recipients'])])
 
 
 events.bind('_sendmail', 'core.email', _sendmail)
@@ -203,7 +222,7 @@ def sendMailSync(subject, text, to, bcc=None):
 
 def sendMail(subject, text, to, bcc=None):
     """
-    Send an email asynchronously.
+    Send an email asynchronously, by queueing it in the mail outbox.
 
     :param subject: The subject line of the email.
     :type subject: str
@@ -214,12 +233,20 @@ def sendMail(subject, text, to, bcc=None):
     :param bcc: Recipient email addresses that should be specified using the Bcc header.
     :type bcc: list or None
     """
-    msg, recipients = _createMessage(subject, text, to, bcc)
+    _queueMail([_createMessage(subject, text, to, bcc)])
+
+
+def sendMailMany(messages):
+    """
+    Send several emails asynchronously, queueing them with one insert.
 
-    events.daemon.trigger('_sendmail', info={
-        'message': msg,
-        'recipients': recipients
-    })
+    :param messages: The subject, text and list of recipients of each email.
+    :type messages: list of tuples
+    """
+    _queueMail([
+        _createMessage(subject, text, to, None)
+        for subject, text, to in messages
+    ])
 
 
 def sendMailToAdmins(subject, text):
@@ -232,5 +259,4 @@ def sendMailToAdmins(subject, text):
 
 def sendMailIndividually(subject, text, to):
     """Send emails asynchronously to all recipients individually."""
-    for address in to:
-        sendMail(address, subject, text)
+    sendMailMany([(subject, text, [address]) for address in to])
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation of the MongoDB commands issued by the server.
+
+A :py:class:`CommandRecorder` is registered with the client returned by
+:py:func:`girderformindlogger.models.getDbConnection`. It attributes every
+command to the CherryPy request that issued it, keeps per-route histograms
+of query counts and times (served by ``GET /system/metrics``), and logs
+commands slower than ``[logging] slow_query_ms`` with the shape of their
+query, that is, the query with its values replaced by ``"?"``.
+
+Outside of production mode, it also records the call stack of each command,
+so that :py:func:`repeatedQueries` can point at the code that issues the same
+query many times in one request (an "N+1" query pattern).
+"""
+
+import bisect
+import cherrypy
+import os
+import sys
+import threading
+
+from pymongo import monitoring
+from girderformindlogger.constants import ServerMode
+from girderformindlogger.utility import config
+
+__all__ = ('CommandRecorder', 'finishRequest', 'formatRepeatedQuery',
+           'getRouteMetrics', 'queryShape', 'repeatedQueries', 'requestStats')
+
+# Upper bounds of the histogram buckets, in queries per request and in
+# milliseconds of database time per request.
+QUERY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500]
+TIME_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+DEFAULT_SLOW_QUERY_MS = 100
+REPEATED_QUERY_THRESHOLD = 10
+STACK_DEPTH = 8
+
+# The part of each command that holds its query, by command name.
+_QUERY_FIELDS = {
+    'find': lambda command: command.get('filter'),
+    'aggregate': lambda command: command.get('pipeline'),
+    'count': lambda command: command.get('query'),
+    'distinct': lambda command: command.get('query'),
+    'findAndModify': lambda command: command.get('query'),
+    'update': lambda command: [u.get('q') for u in command.get('updates', [])],
+    'delete': lambda command: [d.get('q') for d in command.get('deletes', [])]
+}
+
+_routeMetrics = {}
+_routeMetricsLock = threading.Lock()
+
+_packageDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Frames in these files are plumbing rather than the code issuing a query.
+_skippedFiles = {
+    os.path.join(_packageDir, 'utility', 'mongo_metrics.py'),
+    os.path.join(_packageDir, 'models', 'model_base.py'),
+    os.path.join(_packageDir, 'external', 'mongodb_proxy.py')
+}
+
+
+def queryShape(value):
+    """
+    Normalize a query by replacing its values with "?", so that queries that
+    differ only in their values (eg, the _id they look up) have the same
+    shape.
+
+    :param value: A query, or part of one.
+    :returns: The shape of the query.
+    """
+    if isinstance(value, dict):
+        return {k: queryShape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        if any(isinstance(v, (dict, list, tuple)) for v in value):
+            return [queryShape(v) for v in value]
+        return ['?']
+    return '?'
+
+
+def _callStack():
+    """
+    Get the innermost frames of the server's own code in the current call
+    stack, as (file, line, function) tuples relative to the package.
+    """
+    stack = []
+    frame = sys._getframe(2)
+    while frame is not None and len(stack) < STACK_DEPTH:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_packageDir) and filename not in _skippedFiles:
+            if filename == os.path.join(_packageDir, 'api', 'rest.py'):
+                break
+            stack.append((
+                os.path.relpath(filename, _packageDir),
+                frame.f_lineno,
+                frame.f_code.co_name
+            ))
+        frame = frame.f_back
+    return stack
+
+
+def _requestState():
+    # Outside of a request, cherrypy.request is a default object shared by
+    # every thread.
+    if cherrypy.request.app is None:
+        return None
+    if not hasattr(cherrypy.request, '_girderMongo'):
+        cherrypy.request._girderMongo = {'queries': 0, 'time': 0, 'commands': []}
+    return cherrypy.request._girderMongo
+
+
+def requestStats():
+    """
+    :returns: The number of commands the current request has issued, their
+        total time in milliseconds, and a list of the commands, each with
+        its collection, operation, shape, duration (in ms) and number of
+        documents returned.
+    :rtype: dict
+    """
+    state = _requestState() or {'queries': 0, 'time': 0, 'commands': []}
+    return {
+        'queries': state['queries'],
+        'time': state['time'] / 1000.0,
+        'commands': state['commands']
+    }
+
+
+def repeatedQueries(threshold=REPEATED_QUERY_THRESHOLD):
+    """
+    Find the queries that the current request issued more than a threshold
+    number of times with the same shape, which usually means a document is
+    being loaded per item of a list rather than all at once.
+
+    :param threshold: Report queries repeated more than this many times.
+    :type threshold: int
+    :returns: A list of the repeated queries, most repeated first, each with
+        its collection, operation, shape, count, and the call stack of its
+        first occurrence (outside of production mode).
+    :rtype: list
+    """
+    groups = {}
+    for command in requestStats()['commands']:
+        if command['shape'] is None:
+            continue
+        key = (command['collection'], command['operation'], repr(command['shape']))
+        if key not in groups:
+            groups[key] = dict(command, count=0)
+            groups[key].pop('duration', None)
+            groups[key].pop('docs', None)
+        groups[key]['count'] += 1
+    return sorted([
+        group for group in groups.values() if group['count'] > threshold
+    ], key=lambda group: -group['count'])
+
+
+def formatRepeatedQuery(repeated):
+    """
+    Describe a repeated query, as found by :py:func:`repeatedQueries`.
+
+    :rtype: str
+    """
+    return '%s.%s %r was issued %d times%s' % (
+        repeated['collection'],
+        repeated['operation'],
+        repeated['shape'],
+        repeated['count'],
+        ''.join(
+            '\n  %s:%d in %s' % frame for frame in repeated.get('stack', [])
+        )
+    )
+
+
+def _histogram(buckets):
+    return {'buckets': buckets, 'counts': [0] * (len(buckets) + 1)}
+
+
+def _observe(histogram, value):
+    histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+
+
+def finishRequest(route):
+    """
+    Add the current request's database use to the metrics of its route.
+
+    :param route: The method and route pattern, eg, "GET applet/:id".
+    :type route: str
+    :returns: The request's stats, see :py:func:`requestStats`.
+    """
+    stats = requestStats()
+    with _routeMetricsLock:
+        metrics = _routeMetrics.setdefault(route, {
+            'requests': 0,
+            'queries': 0,
+            'time': 0.0,
+            'maxQueries': 0,
+            'queryHistogram': _histogram(QUERY_BUCKETS),
+            'timeHistogram': _histogram(TIME_BUCKETS)
+        })
+        metrics['requests'] += 1
+        metrics['queries'] += stats['queries']
+        metrics['time'] += stats['time']
+        metrics['maxQueries'] = max(metrics['maxQueries'], stats['queries'])
+        _observe(metrics['queryHistogram'], stats['queries'])
+        _observe(metrics['timeHistogram'], stats['time'])
+    return stats
+
+
+def getRouteMetrics(reset=False):
+    """
+    Get the database use of each route since the server started or the
+    metrics were last reset. Histogram counts are of requests with at most
+    the corresponding bucket's queries or milliseconds; the last count is of
+    those above the last bucket.
+
+    :param reset: Whether to clear the metrics after reading them.
+    :type reset: bool
+    :rtype: dict
+    """
+    global _routeMetrics
+
+    with _routeMetricsLock:
+        metrics = {
+            route: dict(values, **{
+                key: dict(values[key], counts=list(values[key]['counts']))
+                for key in ('queryHistogram', 'timeHistogram')
+            }) for route, values in _routeMetrics.items()
+        }
+        if reset:
+            _routeMetrics = {}
+    return metrics
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """
+    A pymongo command listener that records each command against the
+    request that issued it. pymongo publishes command events on the thread
+    that runs the command, so the current CherryPy request is the one that
+    issued it.
+
+    :param slowQueryMs: Log commands that take at least this long.
+    :type slowQueryMs: int or float
+    """
+
+    def __init__(self, slowQueryMs=DEFAULT_SLOW_QUERY_MS):
+        self.slowQueryMs = slowQueryMs
+        self._pending = {}
+
+    def started(self, event):
+        command = event.command
+        name = event.command_name
+        collection = command.get(name)
+        if name == 'getMore':
+            collection = command.get('collection')
+        query = _QUERY_FIELDS.get(name)
+        self._pending[event.request_id] = {
+            'collection': collection if isinstance(collection, str) else None,
+            'operation': name,
+            'shape': queryShape(query(command)) if query else None
+        }
+        if cherrypy.request.app is not None and (
+            config.getServerMode() != ServerMode.PRODUCTION
+        ):
+            self._pending[event.request_id]['stack'] = _callStack()
+
+    def succeeded(self, event):
+        reply = event.reply or {}
+        cursor = reply.get('cursor') or {}
+        batch = cursor.get('firstBatch', cursor.get('nextBatch'))
+        self._record(
+            event,
+            len(batch) if batch is not None else reply.get('n')
+        )
+
+    def failed(self, event):
+        self._record(event, None)
+
+    def _record(self, event, docs):
+        from girderformindlogger import logger
+
+        command = self._pending.pop(event.request_id, None)
+        if command is None:
+            return
+        command['duration'] = event.duration_micros / 1000.0
+        command['docs'] = docs
+        state = _requestState()
+        if state is not None:
+            state['queries'] += 1
+            state['time'] += event.duration_micros
+            state['commands'].append(command)
+        if self.slowQueryMs is not None and (
+            command['duration'] >= self.slowQueryMs
+        ):
+            logger.warning(
+                'Slow query (%.1f ms): %s.%s %r, %s documents%s',
+                command['duration'],
+                command['collection'],
+                command['operation'],
+                command['shape'],
+                docs,
+                ' [%s]' % getattr(cherrypy.request, 'girderRoute', '')
+                if state is not None else ''
+            )
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+A per-process broker of notifications for ``GET /notification/stream``.
+
+Rather than each open stream querying the notification collection every
+second or so, one thread per process follows the collection and hands each
+new or updated notification to the streams of its user (or token), which
+wait on a condition in the meantime. The broker uses a change stream when
+the ``[database]`` section of the config names a ``replica_set``, and
+otherwise polls the collection once per ``POLL_INTERVAL`` while any stream is
+open.
+"""
+
+import collections
+import datetime
+import threading
+
+from girderformindlogger.utility import config
+from pymongo.errors import PyMongoError
+
+__all__ = ('NotificationBroker', 'Subscription', 'broker')
+
+# Seconds between queries of the collection when polling.
+POLL_INTERVAL = 0.5
+# Notifications saved by other processes may carry "updated" times this far
+# behind the clock of this one, so polling looks back this far and ignores
+# notifications it has already seen.
+CLOCK_SKEW = datetime.timedelta(seconds=2)
+# A stream that falls further behind than this drops its oldest notifications.
+MAX_QUEUED = 1000
+
+
+class Subscription(object):
+    """
+    The notifications of one user or token waiting to be sent on a stream.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+        self._events = collections.deque(maxlen=MAX_QUEUED)
+        self._condition = threading.Condition()
+
+    def put(self, event):
+        with self._condition:
+            self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout):
+        """
+        Wait for notifications.
+
+        :param timeout: Most seconds to wait.
+        :type timeout: float
+        :returns: The notifications received since the last call, oldest
+            first, or an empty list if none arrived in time.
+        """
+        with self._condition:
+            if not self._events and not self.closed:
+                self._condition.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+
+def _subscriptionKey(user=None, token=None):
+    if user:
+        return ('userId', user['_id'])
+    return ('tokenId', token['_id'])
+
+
+class NotificationBroker(object):
+    """
+    Follows the notification collection and fans notifications out to the
+    subscriptions of their user or token. The following thread starts with
+    the first subscription.
+    """
+
+    def __init__(self, pollInterval=POLL_INTERVAL):
+        self.pollInterval = pollInterval
+        self.thread = None
+        self.stopping = threading.Event()
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        # (_id, updated) of the notifications published within CLOCK_SKEW
+        # of the latest one, to skip them when polling looks back.
+        self._seen = collections.OrderedDict()
+        self._lastSeen = None
+
+    def subscribe(self, user=None, token=None):
+        """
+        Receive the notifications of a user or, if user is None, a token.
+
+        :returns: The subscription, to wait on with its get() method and
+            pass to unsubscribe() when the stream closes.
+        :rtype: Subscription
+        """
+        subscription = Subscription(_subscriptionKey(user, token))
+        with self._lock:
+            self._subscriptions.setdefault(subscription.key, set()).add(
+                subscription)
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        with self._wake:
+            self._wake.notify()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self._subscriptions.pop(subscription.key, None)
+        subscription.close()
+
+    def publish(self, event):
+        """
+        Hand a notification to the subscriptions of its user or token.
+
+        :param event: The notification document.
+        :type event: dict
+        """
+        key = ('userId', event['userId']) if event.get('userId') else (
+            'tokenId', event.get('tokenId'))
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def stop(self):
+        """
+        Stop following the collection and close every subscription.
+        """
+        self.stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        with self._lock:
+            subscriptions = [
+                subscription for subscriptions in self._subscriptions.values()
+                for subscription in subscriptions
+            ]
+            self._subscriptions = {}
+        for subscription in subscriptions:
+            subscription.close()
+
+    def run(self):
+        from girderformindlogger import logger
+        from girderformindlogger.models.notification import Notification
+
+        self._lastSeen = datetime.datetime.utcnow()
+        if config.getConfig().get('database', {}).get('replica_set'):
+            try:
+                self._watch(Notification().collection)
+                return
+            except PyMongoError:
+                # Eg, change streams aren't supported or the connection was
+                # lost. Polling picks up from the last notification seen.
+                logger.exception(
+                    'Notification change stream failed; polling instead')
+        try:
+            while not self.stopping.is_set():
+                try:
+                    self.poll(Notification())
+                except PyMongoError:
+                    logger.exception('Failed to poll notifications')
+                with self._wake:
+                    if not self.stopping.is_set():
+                        self._wake.wait(self.pollInterval)
+        except Exception:
+            logger.exception('Notification broker stopped')
+
+    def _watch(self, collection):
+        with collection.watch(
+            [{'$match': {'operationType': {'$in': [
+                'insert', 'update', 'replace'
+            ]}}}],
+            full_document='updateLookup',
+            max_await_time_ms=int(self.pollInterval * 1000)
+        ) as changes:
+            while not self.stopping.is_set():
+                change = changes.try_next()
+                if change is not None and change.get('fullDocument'):
+                    self._publishNew(change['fullDocument'])
+
+    def poll(self, model):
+        """
+        Publish the notifications updated since the last poll.
+
+        :param model: The notification model.
+        """
+        with self._lock:
+            if not self._subscriptions:
+                return
+        for event in model.find(
+            {'updated': {'$gte': self._lastSeen - CLOCK_SKEW}},
+            sort=[('updated', 1)]
+        ):
+            self._publishNew(event)
+
+    def _publishNew(self, event):
+        """
+        Publish a notification unless this version of it was already
+        published.
+        """
+        seen = (event['_id'], event['updated'])
+        if seen in self._seen:
+            return
+        self._seen[seen] = event['updated']
+        self._lastSeen = max(self._lastSeen, event['updated'])
+        self.publish(event)
+        while self._seen and next(iter(self._seen.values())) < (
+            self._lastSeen - CLOCK_SKEW
+        ):
+            self._seen.popitem(last=False)
+
+
+broker = NotificationBroker()
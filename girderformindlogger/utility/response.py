@@ -1,6 +1,10 @@
 import backports
+import csv
+import hashlib
+import io
 import isodate
 import itertools
+import json
 import pandas as pd
 import pytz
 import tzlocal
@@ -10,42 +14,100 @@ from bson.objectid import ObjectId
 from datetime import date, datetime, timedelta
 from girderformindlogger.models.applet import Applet as AppletModel
 from girderformindlogger.models.user import User as UserModel
+from girderformindlogger import events
 from girderformindlogger.models.response_folder import ResponseItem
-from girderformindlogger.utility import clean_empty
+from girderformindlogger.utility import clean_empty, JsonEncoder
+from girderformindlogger.utility._cache import LRUCache
 from pandas.api.types import is_numeric_dtype
 from pymongo import ASCENDING, DESCENDING
 MonkeyPatch.patch_fromisoformat()
 
 
+SCHEDULE_CACHE_SIZE = 10000
+# Responses saved by other server processes don't invalidate this process's
+# cache, so entries also expire after this many seconds.
+SCHEDULE_CACHE_TTL = 300
+
+# informant ID → {(applet ID, activity URL): latest "updated" datetime}
+_latestResponseTimes = LRUCache(SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL)
+
+
 def getSchedule(currentUser, timezone=None):
-    from .jsonld_expander import formatLdObject
+    from .jsonld_expander import reprolibCanonize, reprolibPrefix
+
+    applets = AppletModel().getAppletsForUser(
+        user=currentUser,
+        role='user',
+        fields=['_id', 'activityIndex']
+    )
+    latest = getLatestResponseTimes(currentUser['_id'])
     return({
-        applet['applet'].get('_id', ''): {
-            applet['activities'][activity].get('_id', ''): {
-                'lastResponse': getLatestResponseTime(
-                    currentUser['_id'],
-                    applet['applet']['_id'].split('applet/')[-1],
-                    activity,
-                    tz=timezone
-                ) #,
+        'applet/{}'.format(str(applet['_id'])): {
+            activity.get('_id', ''): {
+                'lastResponse': _formatResponseTime(max([
+                    latest[(str(applet['_id']), url)] for url in {
+                        activity['url'],
+                        reprolibPrefix(activity['url']),
+                        reprolibCanonize(activity['url'])
+                    } if (str(applet['_id']), url) in latest
+                ], default=None), timezone) #,
                 # 'nextScheduled': None,
                 # 'lastScheduled': None
-            } for activity in list(
-                applet.get('activities', {}).keys()
-            )
-        } for applet in [
-            formatLdObject(
+            } for activity in AppletModel().getActivityIndex(
                 applet,
-                'applet',
                 currentUser
-            ) for applet in AppletModel().getAppletsForUser(
-                user=currentUser,
-                role='user'
             )
-        ]
+        } for applet in applets
     })
 
 
+def getLatestResponseTimes(informantId):
+    """
+    Get the time of an informant's latest response to each activity, from a
+    single aggregation. Results are cached until the informant's responses
+    change.
+
+    :param informantId: ID of the informant
+    :type informantId: ObjectId or str
+    :returns: dict of {(str(appletId), activityURL): datetime}
+    """
+    latest = _latestResponseTimes.get(str(informantId))
+    if latest is None:
+        latest = {
+            (
+                str(group['_id'].get('applet')),
+                group['_id'].get('activity')
+            ): group['updated'] for group in ResponseItem(
+            ).collection.aggregate([
+                {"$match": {
+                    "baseParentType": 'user',
+                    "baseParentId": ObjectId(informantId)
+                }},
+                {"$group": {
+                    "_id": {
+                        "applet": "$meta.applet.@id",
+                        "activity": "$meta.activity.url"
+                    },
+                    "updated": {"$max": "$updated"}
+                }}
+            ]) if isinstance(group.get('updated'), datetime)
+        }
+        _latestResponseTimes.set(str(informantId), latest)
+    return(latest)
+
+
+def _invalidateLatestResponseTimes(event):
+    item = event.info
+    if isinstance(item, dict) and item.get('baseParentType') == 'user':
+        _latestResponseTimes.delete(str(item.get('baseParentId')))
+
+
+events.bind('model.item.save.after', 'schedule_cache',
+            _invalidateLatestResponseTimes)
+events.bind('model.item.remove', 'schedule_cache',
+            _invalidateLatestResponseTimes)
+
+
 def getLatestResponse(informantId, appletId, activityURL):
     from .jsonld_expander import reprolibCanonize, reprolibPrefix
     responses = list(ResponseItem().find(
@@ -90,19 +152,24 @@ def getLatestResponseTime(informantId, appletId, activityURL, tz=None):
         import sys, traceback
         print(sys.exc_info())
         print(traceback.print_tb(sys.exc_info()[2]))
+    return(_formatResponseTime(
+        latestResponse.get('updated') if isinstance(
+            latestResponse,
+            dict
+        ) else None,
+        tz
+    ))
+
+
+def _formatResponseTime(updated, tz=None):
     return(
         (
-            latestResponse['updated'].astimezone(pytz.timezone(
+            updated.astimezone(pytz.timezone(
                 tz
             )).isoformat() if (
                 isinstance(tz, str) and tz in pytz.all_timezones
-            ) else latestResponse['updated'].isoformat()
-        ) if (
-            isinstance(latestResponse, dict) and isinstance(
-                latestResponse.get('updated'),
-                datetime
-            )
-        ) else None
+            ) else updated.isoformat()
+        ) if isinstance(updated, datetime) else None
     )
 
 
@@ -251,6 +318,84 @@ def formatResponse(response):
     return(clean_empty(thisResponse))
 
 
+def tidyResponses(responses, appletId):
+    """
+    Generate tidy rows, one per item response, from an iterable of response
+    items. Respondents are identified by a hash of the applet ID and their
+    user ID.
+
+    :param responses: Response items to format
+    :type responses: iterable
+    :param appletId: ID of the applet the responses belong to
+    :type appletId: str
+    :returns: generator of dicts with keys TIDY_RESPONSE_COLUMNS
+    """
+    for response in responses:
+        formattedResponse = formatResponse(response)
+        if not formattedResponse or 'thisResponse' not in formattedResponse:
+            continue
+        formattedResponse = formattedResponse['thisResponse']
+        userId = hashlib.md5(
+            "{}{}".format(appletId, response['baseParentId']).encode()
+        ).hexdigest()
+        for itemURI, value in formattedResponse.get('responses', {}).items():
+            yield {
+                'schema:startDate': formattedResponse.get('schema:startDate'),
+                'schema:endDate': formattedResponse.get('schema:endDate'),
+                'userId': userId,
+                'itemURI': itemURI,
+                'value': value
+            }
+
+
+TIDY_RESPONSE_COLUMNS = [
+    'userId',
+    'schema:startDate',
+    'schema:endDate',
+    'itemURI',
+    'value'
+]
+EXPORT_CHUNK_SIZE = 65536
+
+
+def ndjsonLines(rows):
+    """
+    Serialize rows as newline-delimited JSON, yielding encoded chunks of
+    roughly EXPORT_CHUNK_SIZE bytes for a streaming response.
+    """
+    chunk = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, cls=JsonEncoder, sort_keys=True) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf8')
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk).encode('utf8')
+
+
+def csvLines(rows, columns):
+    """
+    Serialize rows as CSV with a header of the given columns, yielding
+    encoded chunks of roughly EXPORT_CHUNK_SIZE bytes for a streaming
+    response. Keys not in columns are ignored.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf8')
+
+
 def string_or_ObjectID(s):
     return([str(s), ObjectId(s)])
 
@@ -506,6 +651,23 @@ def isodatetime(d):
     ).isoformat())
 
 
+def responseDatetime(d):
+    """
+    :param d: A response time, as a Unix timestamp (in seconds or a finer
+        unit), an ISO 8601 string or a datetime.
+    :returns: datetime, in UTC if d is a timestamp
+    """
+    if isinstance(d, int):
+        while (d > 10000000000):
+            d = d/10
+        return(datetime.fromtimestamp(d, pytz.utc))
+    return(
+        datetime.fromisoformat(
+            d
+        ) if isinstance(d, str) else d
+    )
+
+
 def responseDateList(appletId, userId, reviewer):
     from girderformindlogger.models.profile import Profile
     userId = ProfileModel().getProfile(userId, reviewer)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Expansion of applet schedules into notification times.
+
+Schedules are stored as `Dayspan <https://github.com/ClickerMonkey/dayspan>`_
+calendars, as sent by the admin panel to ``PUT /applet/{id}/schedule``. Each
+event's ``data`` names the activity (``URI``) and its ``notifications``, and
+its ``schedule`` restricts the days on which it occurs. This module supports
+the parts of a Dayspan schedule that the admin panel writes: the ``start``
+and ``end`` bounds, the ``year``, ``month``, ``dayOfMonth`` and ``dayOfWeek``
+lists and ``exclude``d days. An empty schedule occurs every day.
+"""
+
+import hashlib
+import pytz
+import random
+
+from datetime import datetime, time, timedelta
+
+__all__ = ('expandSchedule',)
+
+
+def _date(value, tz):
+    """
+    Convert a Dayspan timestamp (epoch milliseconds) or ISO string to a date
+    in the given timezone.
+    """
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value / 1000.0, tz).date()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).date()
+        except ValueError:
+            return None
+    return None
+
+
+def _dayIdentifiers(days):
+    """
+    Normalize a Dayspan list (or object keyed by) day identifiers, which are
+    YYYYMMDD numbers, to a set of strings.
+    """
+    if isinstance(days, dict):
+        days = [k for k, v in days.items() if v]
+    if not isinstance(days, list):
+        return set()
+    return {str(day).replace('-', '')[:8] for day in days}
+
+
+def _matchesDay(rule, day, tz):
+    start = _date(rule.get('start'), tz)
+    end = _date(rule.get('end'), tz)
+    if (start is not None and day < start) or (end is not None and day > end):
+        return False
+    for key, value in [
+        ('year', day.year),
+        ('month', day.month - 1),  # Dayspan months are zero-based
+        ('dayOfMonth', day.day),
+        ('dayOfWeek', day.isoweekday() % 7)  # Dayspan weeks start on Sunday
+    ]:
+        if isinstance(rule.get(key), list) and len(rule[key]) and (
+            value not in rule[key]
+        ):
+            return False
+    return day.strftime('%Y%m%d') not in _dayIdentifiers(rule.get('exclude'))
+
+
+def _parseTime(value):
+    try:
+        hour, minute = [int(part) for part in str(value).split(':')[:2]]
+        return time(hour, minute)
+    except (TypeError, ValueError):
+        return None
+
+
+def _notificationTime(notification, day, tz, seed):
+    """
+    Get the time of a notification on a given day. A random notification
+    gets a random time between its start and end, which is seeded so that
+    expanding the same schedule again gives the same time.
+    """
+    start = _parseTime(notification.get('start'))
+    if start is None:
+        return None
+    when = datetime.combine(day, start)
+    end = _parseTime(notification.get('end'))
+    if notification.get('random') and end is not None and end > start:
+        window = int((datetime.combine(day, end) - when).total_seconds() // 60)
+        when += timedelta(minutes=random.Random(int(hashlib.md5(
+            '{}|{}'.format(seed, day.isoformat()).encode()
+        ).hexdigest(), 16)).randint(0, window))
+    return tz.localize(when)
+
+
+def expandSchedule(schedule, start, end, seed=''):
+    """
+    Expand a schedule into the notification times of its events in a time
+    range.
+
+    :param schedule: Dayspan calendar, optionally with a "timezone" (a TZ
+        database name) in which its times are interpreted; UTC by default.
+    :type schedule: dict
+    :param start: Start of the range, inclusive.
+    :type start: timezone-aware datetime
+    :param end: End of the range, exclusive.
+    :type end: timezone-aware datetime
+    :param seed: Seed for random notification times, eg, the profile ID.
+    :type seed: str
+    :returns: generator of dicts with the keys "activity" (activity URI),
+        "time" (naïve UTC datetime), "notification" (index of the
+        notification in the event) and "notifyIfIncomplete"
+    """
+    if not isinstance(schedule, dict):
+        return
+    tz = schedule.get('timezone')
+    tz = pytz.timezone(tz) if tz in pytz.all_timezones else pytz.utc
+    firstDay = start.astimezone(tz).date()
+    lastDay = end.astimezone(tz).date()
+    for event in schedule.get('events') or []:
+        data = event.get('data') or {}
+        if not data.get('useNotifications') or not data.get('URI'):
+            continue
+        rule = event.get('schedule') or {}
+        day = firstDay
+        while day <= lastDay:
+            if _matchesDay(rule, day, tz):
+                for i, notification in enumerate(
+                    data.get('notifications') or []
+                ):
+                    when = _notificationTime(
+                        notification,
+                        day,
+                        tz,
+                        '{}|{}|{}'.format(seed, data['URI'], i)
+                    )
+                    if when is not None and start <= when < end:
+                        yield {
+                            'activity': data['URI'],
+                            'time': when.astimezone(pytz.utc).replace(
+                                tzinfo=None
+                            ),
+                            'notification': i,
+                            'notifyIfIncomplete': bool(
+                                notification.get('notifyIfIncomplete')
+                            )
+                        }
+            day += timedelta(days=1)
@@ -10,7 +10,7 @@ from girderformindlogger import constants, logprint, __version__, logStdoutStder
 from girderformindlogger.models.setting import Setting
 from girderformindlogger import plugin
 from girderformindlogger.settings import SettingKey
-from girderformindlogger.utility import config
+from girderformindlogger.utility import config, mail_delivery, notification_broker
 from girderformindlogger.constants import ServerMode
 from . import webroot
 
@@ -83,6 +83,10 @@ def configureServer(mode=None, plugins=None, curConfig=None):
     girderformindlogger.events.setupDaemon()
     cherrypy.engine.subscribe('start', girderformindlogger.events.daemon.start)
     cherrypy.engine.subscribe('stop', girderformindlogger.events.daemon.stop)
+    mail_delivery.setupDelivery()
+    cherrypy.engine.subscribe('start', mail_delivery.pool.start)
+    cherrypy.engine.subscribe('stop', mail_delivery.pool.stop)
+    cherrypy.engine.subscribe('stop', notification_broker.broker.stop)
 
     routeTable = loadRouteTable()
     info = {
@@ -2,11 +2,22 @@ import cherrypy
 import datetime
 import logging
 import six
-from six.moves import urllib
-from girderformindlogger import auditLogger
+import threading
+import time
+from pymongo.errors import BulkWriteError, PyMongoError
+from six.moves import queue, urllib
+from girderformindlogger import auditLogger, logger
 from girderformindlogger.models.model_base import Model
 from girderformindlogger.api.rest import getCurrentUser
 from girderformindlogger.plugin import GirderPlugin
+from girderformindlogger.utility import config
+
+
+# A batch that fails to save is tried this many times in all, waiting
+# SAVE_RETRY_DELAY seconds after the first failure and twice as long after
+# each further one.
+SAVE_ATTEMPTS = 3
+SAVE_RETRY_DELAY = 0.5
 
 
 class Record(Model):
@@ -18,7 +29,168 @@ class Record(Model):
         return doc
 
 
+class OverflowPolicy(object):
+    """
+    What to do with records when the writer's queue is full. BLOCK, the
+    default, makes requests wait for room. DROP discards new records, and
+    SAMPLE keeps only one in sample_rate records once the queue is half full
+    and discards the rest when it is full; both lose audit records, which
+    are counted and logged as warnings.
+    """
+    BLOCK = 'block'
+    DROP = 'drop'
+    SAMPLE = 'sample'
+
+
+class BufferedRecordWriter(object):
+    """
+    Saves audit log records from a background thread, with one insert per
+    batch_size records or per flush_interval_ms milliseconds, whichever
+    comes first. It is configured in the ``[audit_logs]`` section of the
+    config file, and flushes its queue when the server stops. Records put
+    while the thread isn't running are saved directly.
+    """
+
+    def __init__(self, batchSize=500, flushInterval=1.0, maxQueued=10000,
+                 overflow=OverflowPolicy.BLOCK, sampleRate=10):
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.overflow = overflow
+        self.sampleRate = sampleRate
+        self.queue = queue.Queue(maxQueued)
+        self.dropped = 0
+        self._sampled = 0
+        self._thread = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fromConfig(cls):
+        cfg = config.getConfig().get('audit_logs', {})
+        return cls(
+            batchSize=int(cfg.get('batch_size', 500)),
+            flushInterval=int(cfg.get('flush_interval_ms', 1000)) / 1000.0,
+            maxQueued=int(cfg.get('max_queued', 10000)),
+            overflow=cfg.get('overflow', OverflowPolicy.BLOCK),
+            sampleRate=int(cfg.get('sample_rate', 10)))
+
+    def put(self, doc):
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            # Before start or after stop, nothing would save a queued record,
+            # and a blocked request would wait forever.
+            self._save([doc])
+            return
+        if self.overflow == OverflowPolicy.BLOCK:
+            self.queue.put(doc)
+            return
+        if self.overflow == OverflowPolicy.SAMPLE and (
+                self.queue.qsize() * 2 >= self.queue.maxsize):
+            with self._lock:
+                self._sampled += 1
+                keep = self._sampled % self.sampleRate == 0
+                if not keep:
+                    self.dropped += 1
+            if not keep:
+                return
+        try:
+            self.queue.put_nowait(doc)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the writer once it has saved every queued record.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.flush(self.flushInterval)
+            except Exception:
+                logger.exception('Failed to save audit log records')
+
+    def flush(self, interval=0):
+        """
+        Save the queued records in batches. With an interval, save one
+        batch of the records queued within that many seconds.
+
+        :returns: The number of records saved.
+        """
+        saved = 0
+        while True:
+            deadline = time.monotonic() + interval
+            batch = []
+            while len(batch) < self.batchSize:
+                try:
+                    batch.append(self.queue.get(
+                        timeout=max(deadline - time.monotonic(), 0)
+                    ) if interval else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                saved += self._save(batch)
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                logger.warning('Dropped %d audit log records' % dropped)
+            if interval or len(batch) < self.batchSize:
+                return saved
+
+    def _save(self, batch):
+        """
+        Insert a batch of records, trying again after a failure. Records that
+        still can't be saved are counted as dropped.
+
+        :returns: The number of records saved.
+        """
+        pending = batch
+        delay = SAVE_RETRY_DELAY
+        for attempt in range(SAVE_ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                Record().collection.insert_many(pending, ordered=False)
+                pending = []
+            except BulkWriteError as e:
+                # The other records of an unordered insert were saved. A
+                # duplicate key is a record saved by an earlier attempt.
+                failed = {
+                    error['index'] for error in e.details['writeErrors']
+                    if error['code'] != 11000
+                }
+                pending = [
+                    doc for i, doc in enumerate(pending) if i in failed]
+                error = e
+            except PyMongoError as e:
+                error = e
+            if not pending:
+                break
+        if pending:
+            logger.warning('Failed to save %d audit log records: %s' % (
+                len(pending), error))
+            with self._lock:
+                self.dropped += len(pending)
+        return len(batch) - len(pending)
+
+
 class _AuditLogDatabaseHandler(logging.Handler):
+    def __init__(self, writer):
+        super(_AuditLogDatabaseHandler, self).__init__()
+        self.writer = writer
+
     def handle(self, record):
         user = getCurrentUser()
 
@@ -34,17 +206,20 @@ class _AuditLogDatabaseHandler(logging.Handler):
                 urllib.parse.quote(paramKey, safe='').replace('.', '%2E'): paramValue
                 for paramKey, paramValue in six.viewitems(record.details['params'])
             }
-        Record().save({
+        self.writer.put({
             'type': record.msg,
             'details': record.details,
             'ip': cherrypy.request.remote.ip,
             'userId': user and user['_id'],
             'when': datetime.datetime.utcnow()
-        }, triggerEvents=False)
+        })
 
 
 class AuditLogsPlugin(GirderPlugin):
     DISPLAY_NAME = 'Audit logging'
 
     def load(self, info):
-        auditLogger.addHandler(_AuditLogDatabaseHandler())
+        writer = BufferedRecordWriter.fromConfig()
+        cherrypy.engine.subscribe('start', writer.start)
+        cherrypy.engine.subscribe('stop', writer.stop)
+        auditLogger.addHandler(_AuditLogDatabaseHandler(writer))
@@ -1,13 +1,25 @@
+import contextlib
 import hashlib
 import mongomock
 import os
 import pytest
 import shutil
+import warnings
 
 from .plugin_registry import PluginRegistry
 from .utils import MockSmtpReceiver, serverContext
 
 
+# The most database queries a request to each of these routes may make in a
+# test. They have made queries per applet, profile or response before. Use
+# the queryBudget marker to change or add a budget.
+QUERY_BUDGETS = {
+    'GET user/applets': 50,
+    'GET applet/:id/users': 50,
+    'GET response': 50
+}
+
+
 def _uid(node):
     """
     Generate a unique name from a pytest request node object.
@@ -90,6 +102,50 @@ def _getPluginsFromMarker(request, registry):
     return plugins
 
 
+@contextlib.contextmanager
+def _queryBudgets(request):
+    """
+    Record the requests that make more database queries than their route's
+    budget, or repeat a query more than the repeated query threshold, so
+    that pytest_runtest_call fails the test.
+
+    Queries are not counted with --mock-db, since mongomock doesn't publish
+    command events, so budgets are not checked then.
+    """
+    from girderformindlogger import events
+    from girderformindlogger.utility.mongo_metrics import formatRepeatedQuery
+
+    if request.config.getoption('--mock-db'):
+        if request.node.get_closest_marker('queryBudget') is not None:
+            warnings.warn(pytest.PytestWarning(
+                'Query budgets are not checked with --mock-db.'))
+        yield
+        return
+
+    budgets = dict(QUERY_BUDGETS)
+    for marker in request.node.iter_markers('queryBudget'):
+        budgets[marker.args[0]] = marker.args[1]
+    exceeded = request.node._queryBudgetsExceeded = []
+
+    def checkQueries(event):
+        route = event.info['route']
+        budget = budgets.get(route)
+        if budget is None:
+            return
+        if event.info['stats']['queries'] > budget:
+            exceeded.append('%s made %d queries; its budget is %d.' % (
+                route, event.info['stats']['queries'], budget))
+        for repeated in event.info['repeated']:
+            exceeded.append('%s repeated a query: %s' % (
+                route, formatRepeatedQuery(repeated)))
+
+    events.bind('rest.queries', 'pytest_girder.queryBudget', checkQueries)
+    try:
+        yield
+    finally:
+        events.unbind('rest.queries', 'pytest_girder.queryBudget')
+
+
 @pytest.fixture
 def server(db, request):
     """
@@ -102,7 +158,7 @@ def server(db, request):
     registry = PluginRegistry()
     with registry():
         plugins = _getPluginsFromMarker(request, registry)
-        with serverContext(plugins) as server:
+        with serverContext(plugins) as server, _queryBudgets(request):
             yield server
 
 
@@ -121,7 +177,7 @@ def boundServer(db, request):
     registry = PluginRegistry()
     with registry():
         plugins = _getPluginsFromMarker(request, registry)
-        with serverContext(plugins, bindPort=True) as server:
+        with serverContext(plugins, bindPort=True) as server, _queryBudgets(request):
             yield server
 
 
@@ -131,9 +187,9 @@ def smtp(db, server):
     Provides a mock SMTP server for testing.
     """
     # TODO strictly speaking, this does not depend on the server itself, but does
-    # depend on the events daemon, which is currently managed by the server fixture.
-    # We should sort this out so that the daemon is its own fixture rather than being
-    # started/stopped via the cherrypy server lifecycle.
+    # depend on the mail delivery pool, which is currently managed by the server
+    # fixture. We should sort this out so that the pool is its own fixture rather
+    # than being started/stopped via the cherrypy server lifecycle.
     from girderformindlogger.models.setting import Setting
     from girderformindlogger.settings import SettingKey
 
@@ -1,4 +1,5 @@
 import os
+import pytest
 from .fixtures import *  # noqa
 
 
@@ -22,6 +23,8 @@ def _makeCoverageDirs(config):
 def _addCustomMarkers(config):
     markerDocs = [
         'plugin(pluginName, [pluginClass]): load a plugin (may be marked multiple times)',
+        'queryBudget(route, queries): fail if a request to the route (eg, "GET applet/:id") '
+        'makes more database queries, or None to not check the route',
     ]
     for markerDoc in markerDocs:
         config.addinivalue_line('markers', markerDoc)
@@ -32,6 +35,17 @@ def pytest_configure(config):
     _addCustomMarkers(config)
 
 
+@pytest.hookimpl(trylast=True)
+def pytest_runtest_call(item):
+    """
+    Fail a test whose requests exceeded their query budgets (see the server
+    fixture).
+    """
+    exceeded = getattr(item, '_queryBudgetsExceeded', None)
+    if exceeded:
+        pytest.fail('\n'.join(exceeded))
+
+
 def pytest_addoption(parser):
     group = parser.getgroup('girderformindlogger')
     group.addoption('--mock-db', action='store_true', default=False,
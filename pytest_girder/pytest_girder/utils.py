@@ -305,17 +305,16 @@ def _findFreePort():
 
 @contextlib.contextmanager
 def serverContext(plugins=None, bindPort=False):
-    # The event daemon cannot be restarted since it is a threading.Thread
-    # object, however all references to girderformindlogger.events.daemon are a singular
-    # global daemon due to its side effect on import. We have to hack around
-    # this by creating a unique event daemon each time we startup the server
-    # and assigning it to the global.
+    # All references to girderformindlogger.events.daemon are a singular
+    # global daemon due to its side effect on import. We create a unique event
+    # daemon each time we startup the server, so that events queued by one
+    # test are not handled during the next, and assign it to the global.
     import girderformindlogger.events
     from girderformindlogger.api import docs
     from girderformindlogger.utility.server import setup as setupServer
     from girderformindlogger.constants import ServerMode
 
-    girderformindlogger.events.daemon = girderformindlogger.events.AsyncEventsThread()
+    girderformindlogger.events.daemon = girderformindlogger.events.AsyncEventsDaemon()
 
     if plugins is None:
         # By default, pass "[]" to "plugins", disabling any installed plugins
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the per-request cost of ``autoDescribeRoute``: the time
+its wrapper spends validating and converting the parameters of a request
+before calling the route handler, for a few routes with typical descriptions.
+Documents are "loaded" from a dict so that no database is needed.
+
+Run it from the root of the repository, eg::
+
+    python scripts/benchmark_describe.py [iterations]
+
+To compare two versions, run it on each, eg, with ``git stash`` or a
+checkout of the earlier commit.
+"""
+import sys
+import timeit
+
+from girderformindlogger.api.describe import autoDescribeRoute, Description
+from girderformindlogger.constants import SortDir
+
+DOCUMENT_ID = '5e4a9b6f1d2c3b4a5f6e7d8c'
+
+
+class DictModel(object):
+    name = 'document'
+    documents = {DOCUMENT_ID: {'_id': DOCUMENT_ID, 'name': 'benchmark'}}
+
+    def load(self, id, force=False, **kwargs):
+        return self.documents.get(id)
+
+    def requireAccessFlags(self, doc, user=None, flags=None):
+        pass
+
+
+def handler(**kwargs):
+    return kwargs
+
+
+ROUTES = {
+    'no params': (Description('No parameters'), {}),
+    'paging': (
+        Description('Paging parameters')
+        .pagingParams(defaultSort='name', defaultSortDir=SortDir.DESCENDING),
+        {'params': {'limit': '50', 'offset': '100', 'sort': ' name '}}
+    ),
+    'model, json and typed': (
+        Description('A document, a JSON object and typed parameters')
+        .modelParam('id', model=DictModel, force=True, destName='document')
+        .jsonParam('metadata', 'An object.', requireObject=True)
+        .jsonParam('filter', 'A filter.', required=False, schema={
+            'type': 'object',
+            'properties': {'name': {'type': 'string'}},
+            'additionalProperties': False
+        })
+        .param('active', 'Whether active.', dataType='boolean', default=True, required=False)
+        .param('count', 'A count.', dataType='integer', required=False)
+        .param('mode', 'A mode.', enum=['a', 'b', 'c'], default='a', required=False)
+        .param('name', 'A name.', strip=True, lower=True, required=False)
+        .param('since', 'A date.', dataType='dateTime', required=False),
+        {'id': DOCUMENT_ID, 'params': {
+            'metadata': '{"a": 1, "b": [1, 2, 3]}',
+            'filter': '{"name": "benchmark"}',
+            'count': '10',
+            'mode': 'b',
+            'name': ' Benchmark ',
+            'since': '2020-02-13T10:00:00'
+        }}
+    )
+}
+
+
+def main(iterations=20000):
+    print('%-24s%12s' % ('route', 'us per call'))
+    for label, (description, kwargs) in ROUTES.items():
+        wrapped = autoDescribeRoute(description)(handler)
+
+        def call():
+            wrapped(**dict(kwargs, params=dict(kwargs.get('params', {}))))
+
+        def bare():
+            handler(**dict(kwargs, params=dict(kwargs.get('params', {}))))
+        seconds = min(timeit.repeat(call, number=iterations, repeat=5)) - min(
+            timeit.repeat(bare, number=iterations, repeat=5))
+        print('%-24s%12.2f' % (label, seconds / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of REST route matching over the full ``api/v1`` route table,
+including the routes of the loaded plugins. It matches a path for every
+registered route, with the compiled route tries of
+``Resource._matchRoute`` and with the linear scan of each method's routes of
+that length which it replaced, and reports the time per lookup of each.
+
+Run it in the server's environment (it connects to the database to load the
+plugins), eg::
+
+    girderformindlogger shell scripts/benchmark_routes.py [iterations]
+    girderformindlogger shell --plugins=jobs,oauth scripts/benchmark_routes.py
+"""
+import sys
+import timeit
+
+from girderformindlogger.api.rest import Resource
+
+# Stands in for the value of every wildcard in the benchmarked paths.
+WILDCARD_VALUE = '5e4a9b6f1d2c3b4a5f6e7d8c'
+
+
+def linearMatch(resource, method, path):
+    """
+    Match a path as ``Resource._matchRoute`` did before routes were compiled.
+    """
+    for route, handler in resource._routes[method][len(path)]:
+        wildcards = {}
+        for routeComponent, pathComponent in zip(route, path):
+            if routeComponent[0] == ':':
+                wildcards[routeComponent[1:]] = pathComponent
+            elif routeComponent != pathComponent:
+                break
+        else:
+            return route, handler, wildcards
+    return None
+
+
+def routeTable(apiRoot):
+    """
+    :returns: A list of (resource name, resource, method, path) tuples, with
+        one path for each registered route.
+    """
+    table = []
+    for name, resource in sorted(vars(apiRoot).items()):
+        if not isinstance(resource, Resource):
+            continue
+        for method, lengths in resource._routes.items():
+            for routes in lengths.values():
+                for route, handler in routes:
+                    table.append((name, resource, method, tuple(
+                        WILDCARD_VALUE if component[0] == ':' else component
+                        for component in route
+                    )))
+    return table
+
+
+def benchmark(table, iterations):
+    results = {}
+    for label, match in (
+        ('linear', lambda resource, method, path: linearMatch(resource, method, path)),
+        ('trie', lambda resource, method, path: resource._matchRoute(method, path))
+    ):
+        def run():
+            for name, resource, method, path in table:
+                match(resource, method, path)
+        seconds = min(timeit.repeat(run, number=iterations, repeat=5))
+        results[label] = seconds / (iterations * len(table)) * 1e6
+    return results
+
+
+def main(iterations=200):
+    if 'webroot' in globals():
+        root = webroot  # noqa: F821 (defined by girderformindlogger shell)
+    else:
+        from girderformindlogger.utility.server import configureServer
+        root, _ = configureServer()
+    table = routeTable(root.api.v1)
+
+    mismatched = [
+        (method, name, '/'.join(path)) for name, resource, method, path in table
+        if linearMatch(resource, method, path)[1] !=
+        resource._matchRoute(method, path)[1]
+    ]
+    for method, name, path in mismatched:
+        print('Ambiguous route, now matched by its leftmost literal: %s %s/%s' % (
+            method.upper(), name, path))
+
+    results = benchmark(table, iterations)
+    print('%d routes on %d resources, %d iterations' % (
+        len(table), len({name for name, _, _, _ in table}), iterations))
+    for label in ('linear', 'trie'):
+        print('%-8s%8.3f us per lookup' % (label, results[label]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
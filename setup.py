@@ -58,6 +58,12 @@ installReqs = [
 ]
 
 extrasReqs = {
+    'brotli': [
+        'brotli'
+    ],
+    'columnar': [
+        'pyarrow'
+    ],
     'sftp': [
         'paramiko'
     ],
@@ -104,6 +110,7 @@ setup(
         ],
         'girderformindlogger.cli_plugins': [
             'serve = girderformindlogger.cli.serve:main',
+            'migrate = girderformindlogger.cli.migrate:main',
             'mount = girderformindlogger.cli.mount:main',
             'shell = girderformindlogger.cli.shell:main',
             'sftpd = girderformindlogger.cli.sftpd:main',
@@ -29,3 +29,865 @@ testOutput = {
 def testDereference(args):
     from girderformindlogger.utility.jsonld_expander import dereference
     assert dereference(testInput)==testOutput, 'Dereferencing failed.'
+
+
+def testStreamingExportLines():
+    from girderformindlogger.utility.response import csvLines, ndjsonLines
+    rows = [{'a': 1, 'b': 'x'}, {'a': 2, 'c': 'ignored'}]
+    assert b''.join(csvLines(rows, ['a', 'b']))==b'a,b\r\n1,x\r\n2,\r\n'
+    assert b''.join(ndjsonLines(rows))==(
+        b'{"a": 1, "b": "x"}\n{"a": 2, "c": "ignored"}\n'
+    )
+
+
+def testExpandSchedule():
+    import datetime
+    import pytz
+    from girderformindlogger.utility.schedule import expandSchedule
+    schedule = {'events': [{
+        'data': {
+            'URI': 'activity',
+            'useNotifications': True,
+            'notifications': [{'start': '09:00', 'end': '10:00'}]
+        },
+        'schedule': {'dayOfWeek': [1, 3]}  # Mondays and Wednesdays
+    }]}
+    start = pytz.utc.localize(datetime.datetime(2020, 3, 2))  # a Monday
+    times = [o['time'] for o in expandSchedule(
+        schedule,
+        start,
+        start + datetime.timedelta(days=7)
+    )]
+    assert times==[
+        datetime.datetime(2020, 3, 2, 9),
+        datetime.datetime(2020, 3, 4, 9)
+    ]
+
+
+def testQueryShape():
+    from girderformindlogger.utility.mongo_metrics import queryShape
+    assert queryShape({
+        '_id': 'abc',
+        'meta.applet.@id': {'$in': [1, 2, 3]},
+        '$or': [{'a': 1}, {'b': {'$gt': 2}}]
+    })=={
+        '_id': '?',
+        'meta.applet.@id': {'$in': ['?']},
+        '$or': [{'a': '?'}, {'b': {'$gt': '?'}}]
+    }
+
+
+def testTriggerBatch():
+    from girderformindlogger import events
+    calls = []
+    with events.bound('test.save', 'single', lambda e: calls.append(e.info)), \
+            events.bound('test.save', 'batch', lambda e: calls.append('no')), \
+            events.bound('test.saveMany', 'batch', lambda e: calls.append(
+                list(e.info)
+            )):
+        batchEvent, single = events.triggerBatch(
+            'test.saveMany', 'test.save', [1, 2]
+        )
+    assert calls==[[1, 2], 1, 2]
+    assert [e.info for e in single]==[1, 2]
+
+
+def testValidateInvitationRows():
+    from girderformindlogger.models.invitation import validateInvitationRows
+    results = list(validateInvitationRows([
+        {'email': ' A@example.org ', 'displayName': 'A'},
+        {'email': 'a@example.org'},
+        {'email': 'not an email'},
+        {'idCode': 'x1', 'role': 'manager'},
+        {'idCode': 'x1'},
+        {'idCode': 'x2', 'role': 'owner'},
+        {'displayName': 'nobody'}
+    ]))
+    assert [r.get('error') for r in results]==[
+        None,
+        'Duplicate email address.',
+        'Invalid email address.',
+        None,
+        'Duplicate ID code.',
+        'Invalid role.',
+        'An email address or an ID code is required.'
+    ]
+    assert results[0]['email']=='a@example.org'
+    assert results[0]['role']=='user'
+
+
+def testMailRetryDelay():
+    import datetime
+    from girderformindlogger.models.mail_outbox import retryDelay
+    assert [retryDelay(n).total_seconds() for n in range(1, 5)]==[
+        30, 60, 120, 240
+    ]
+    assert retryDelay(20)==datetime.timedelta(hours=1)
+
+
+def testAsyncEventsDaemonOrdering():
+    from girderformindlogger import events
+    daemon = events.AsyncEventsDaemon(workers=3)
+    handled = []
+    with events.bound('test.async', 'order', lambda e: handled.append(
+        (e.info['_id'], e.info['n'])
+    )):
+        daemon.start()
+        for n in range(60):
+            daemon.trigger('test.async', {'_id': n % 4, 'n': n})
+        daemon.stop()
+    for key in range(4):
+        assert [n for k, n in handled if k==key]==list(range(key, 60, 4))
+    assert daemon.metrics()['events']['test.async']['count']==60
+    assert daemon.metrics()['queueDepth']==0
+
+
+def testAuthCacheInvalidation():
+    from bson.objectid import ObjectId
+    from girderformindlogger.utility._cache import AuthCache
+    cache = AuthCache(10, 30)
+    userId = ObjectId()
+    cache.setToken('a', {'_id': 'a', 'userId': userId})
+    cache.setUser('a', {'_id': userId, 'login': 'a'})
+    cache.setToken('missing', None)
+    assert cache.getToken('missing')==(True, None)
+    cache.getUser('a')['login'] = 'changed'
+    assert cache.getUser('a')['login']=='a'
+    cache.invalidate('user', userId)
+    assert cache.getToken('a')==(False, None)
+    assert cache.getToken('missing')==(True, None)
+    cache.setToken('a', {'_id': 'a', 'userId': userId})
+    cache.invalidate('token', 'a')
+    assert cache.getToken('a')==(False, None)
+
+
+def testMatchRoute():
+    from girderformindlogger.api.rest import Resource
+    from girderformindlogger.exceptions import RestException
+    resource = Resource()
+    handlers = {}
+    for route in [(':id',), ('me',), (':id', 'details'), ('me', ':key')]:
+        handlers[route] = lambda **kwargs: None
+        handlers[route].accessLevel = 'public'
+        resource.route('GET', route, handlers[route], nodoc=True)
+    assert resource._matchRoute('get', ('me',))[1] is handlers[('me',)]
+    assert resource._matchRoute('get', ('abc',))[2]=={'id': 'abc'}
+    route, handler, wildcards = resource._matchRoute('get', ('me', 'details'))
+    assert handler is handlers[('me', ':key')]
+    assert wildcards=={'key': 'details'}
+    resource.removeRoute('GET', ('me', ':key'))
+    assert resource._matchRoute('get', ('me', 'details'))[2]=={'id': 'me'}
+    with pytest.raises(RestException):
+        resource._matchRoute('get', ('me', 'details', 'x'))
+
+
+def testAutoDescribeRouteParams():
+    from girderformindlogger.api.describe import autoDescribeRoute, Description
+    from girderformindlogger.exceptions import RestException
+
+    @autoDescribeRoute(
+        Description('Typed parameters')
+        .jsonParam('filter', 'A filter.', required=False, schema={
+            'type': 'object', 'additionalProperties': False
+        })
+        .param('count', 'A count.', dataType='integer', required=False)
+        .param('mode', 'A mode.', enum=['a', 'b'], default='a', required=False)
+        .param('name', 'A name.', strip=True, lower=True)
+    )
+    def handler(filter, count, mode, params):
+        return filter, count, mode, params
+
+    assert handler(params={'count': '3', 'name': ' A '})==(
+        None, 3, 'a', {'name': 'a'}
+    )
+    for params in [{}, {'name': 'a', 'mode': 'c'}, {'name': 'a', 'filter': '{"x": 1}'}]:
+        with pytest.raises(RestException):
+            handler(params=params)
+    # As plugins do, once the route has been declared and even called.
+    handler.description.param('size', 'A size.', dataType='integer', default=2,
+                              required=False)
+    assert handler(params={'name': 'a'})[3]=={'name': 'a', 'size': 2}
+
+
+def testAcceptedEncoding():
+    import gzip
+    from girderformindlogger.utility import compression
+    assert compression.acceptedEncoding(None) is None
+    assert compression.acceptedEncoding('gzip, deflate')=='gzip'
+    assert compression.acceptedEncoding('identity') is None
+    assert compression.acceptedEncoding('gzip;q=0, *;q=0.5') in (
+        'br' if 'br' in compression.ENCODINGS else None,
+    )
+    assert compression.acceptedEncoding('br;q=1.0, gzip;q=0.8')==(
+        compression.ENCODINGS[0]
+    )
+    data = b'{"@id": "http://schema.org/name"}' * 100
+    assert gzip.decompress(compression.compress(data, 'gzip'))==data
+    assert gzip.decompress(b''.join(compression.compressStream(
+        [data[:50], data[50:].decode('utf8')], 'gzip'
+    )))==data
+
+
+def testJsonArrayChunks():
+    from girderformindlogger.api import rest
+    for items in ([], [None], [{'b': 1, 'a': [1.5, 'x']}] * 5000):
+        chunks = list(rest.jsonArrayChunks(iter(items)))
+        assert b''.join(chunks)==rest.jsonResponseBody(items)
+        assert all(
+            len(chunk) < 2 * rest.JSON_STREAM_CHUNK_SIZE for chunk in chunks
+        )
+    lines = b''.join(rest.jsonArrayChunks([{'a': 1}, [2]], ndjson=True))
+    assert lines==b'{"a": 1}\n[2]\n'
+    assert list(rest.jsonArrayChunks(iter([]), ndjson=True))==[]
+
+
+def testColumnarLines():
+    import io
+    import pyarrow.parquet
+    from girderformindlogger.exceptions import RestException
+    from girderformindlogger.utility import columnar
+    itemTypes = {'http://example.org/q1': ['int'], 'http://example.org/q2': [
+        'string', 'object']}
+    schema = columnar.responseSchema(itemTypes)
+    rows = [{
+        'respondent': 'r%d' % i,
+        'applet': {'@id': 'applet/a'},
+        'responseStarted': 1581588000000,
+        'responses': {
+            'http://example.org/q1': i,
+            'http://example.org/q2': {'value': i} if i % 2 else 'text'
+        }
+    } for i in range(5)]
+    table = pyarrow.parquet.read_table(io.BytesIO(b''.join(
+        columnar.columnarLines(rows, schema, 'parquet', rowGroupSize=2)
+    )))
+    assert table.num_rows==5
+    assert table.column('http://example.org/q1').to_pylist()==list(range(5))
+    assert table.column('http://example.org/q2').to_pylist()[:2]==[
+        'text', '{"value": 1}']
+    started = table.column('responseStarted').to_pylist()[0]
+    assert started.isoformat()=='2020-02-13T10:00:00+00:00'
+    with pytest.raises(RestException):
+        columnar.responseSchema(itemTypes, ['http://example.org/q1', 'subject'])
+
+
+@pytest.fixture
+def mockDb():
+    """
+    Connect the models to an empty mongomock database.
+    """
+    import mongomock
+    from girderformindlogger import models
+    from girderformindlogger.external.mongodb_proxy import MongoProxy
+    from girderformindlogger.models import model_base
+
+    client = MongoProxy(mongomock.MongoClient('mongodb://localhost/girder_test'))
+    models._dbClients[(None, None)] = client
+    for model in model_base._modelSingletons:
+        model.reconnect()
+    yield client.get_database()
+    client.drop_database('girder_test')
+    models._dbClients.pop((None, None), None)
+
+
+def testCreateResponseItems(mockDb):
+    from bson import ObjectId
+    from girderformindlogger.models.folder import Folder
+    from girderformindlogger.models.response_folder import ResponseItem
+    user = {'_id': ObjectId(), 'login': 'informant'}
+    folder = {
+        '_id': ObjectId(),
+        'name': 'responses',
+        'parentId': user['_id'],
+        'parentCollection': 'user',
+        'baseParentType': 'user',
+        'baseParentId': user['_id'],
+        'ancestors': [{'_id': user['_id'], 'type': 'user'}]
+    }
+    Folder().collection.insert_one(folder)
+    items = ResponseItem().createResponseItems([
+        {'name': 'r', 'folder': folder, 'metadata': {'a': 1}, 'idempotencyKey': 'k1'},
+        {'name': 'r', 'folder': folder, 'metadata': {'a': 2}, 'idempotencyKey': 'k2'}
+    ], user)
+    assert [item['name'] for item in items]==['r', 'r (1)']
+    assert items[0]['ancestors'][-1]=={'_id': folder['_id'], 'type': 'folder'}
+    again = ResponseItem().createResponseItems([
+        {'name': 'r', 'folder': folder, 'metadata': {'a': 2}, 'idempotencyKey': 'k2'},
+        {'name': 'r', 'folder': folder, 'metadata': {'a': 3}, 'idempotencyKey': 'k3'}
+    ], user)
+    assert again[0]['_id']==items[1]['_id']
+    assert again[1]['name']=='r (2)'
+    assert ResponseItem().collection.count_documents({
+        'folderId': folder['_id']
+    })==3
+
+
+def testMigrateDedupe():
+    import mongomock
+    from bson import ObjectId
+    from girderformindlogger.cli.migrate import dedupe
+    db = mongomock.MongoClient().get_database('girder_dedupe')
+    parentId, creatorId = ObjectId(), ObjectId()
+    folders = [ObjectId() for _ in range(3)]
+    db['folder'].insert_many([{
+        '_id': id, 'parentId': parentId, 'parentCollection': 'folder',
+        'name': 'a', 'lowerName': 'a'
+    } for id in folders])
+    db['item'].insert_many([
+        {'folderId': parentId, 'name': 'a (1)'},
+        {'creatorId': creatorId, 'idempotencyKey': 'k'},
+        {'creatorId': creatorId, 'idempotencyKey': 'k'},
+        {'creatorId': creatorId}
+    ])
+    db['invitation'].insert_many([
+        {'appletId': parentId, 'idCode': 'A1'},
+        {'appletId': parentId, 'idCode': 'A1'},
+        {'appletId': parentId}
+    ])
+    db['responseCache'].insert_many([
+        {'collection': 'folder', 'docId': parentId, 'encoding': 'gzip'}
+        for _ in range(2)
+    ])
+    assert dedupe(db)==[
+        ('folders renamed', 2),
+        ('response idempotency keys removed', 1),
+        ('invitation ID codes removed', 1),
+        ('cached responses removed', 1)
+    ]
+    assert [db['folder'].find_one({'_id': id})['name'] for id in folders]==[
+        'a', 'a (2)', 'a (3)'
+    ]
+    assert db['item'].count_documents({'idempotencyKey': 'k'})==1
+    assert db['invitation'].count_documents({'idCode': 'A1'})==1
+    assert db['responseCache'].count_documents({})==1
+    assert dedupe(db)==[
+        ('folders renamed', 0),
+        ('response idempotency keys removed', 0),
+        ('invitation ID codes removed', 0),
+        ('cached responses removed', 0)
+    ]
+
+
+def testLRUCache():
+    from girderformindlogger.utility._cache import LRUCache
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a')==1
+    cache.set('c', 3)
+    assert cache.get('b') is None and len(cache)==2
+    cache.deleteWhere(lambda key, value: value > 2)
+    assert cache.get('c') is None and cache.get('a')==1
+    expiring = LRUCache(2, ttl=-1)
+    expiring.set('a', 1)
+    assert expiring.get('a') is None and len(expiring)==0
+
+
+def testSubjectFolderCacheIndex():
+    from girderformindlogger.models.response_folder import _SubjectFolderCache
+    cache = _SubjectFolderCache(2)
+    for subject in range(3):
+        cache.set(subject, ({}, {'responses': None, str(subject): None}))
+    assert not cache.hasFolder('0')
+    assert cache.hasFolder('1') and cache.hasFolder('responses')
+    cache.deleteWhere(lambda key, value: True)
+    assert not cache.hasFolder('responses') and not cache._folderIds
+
+
+def testUpsertFolder(mockDb):
+    from bson import ObjectId
+    from girderformindlogger.exceptions import ValidationException
+    from girderformindlogger.models.folder import Folder
+    from girderformindlogger.models.item import Item
+    user = {'_id': ObjectId(), 'login': 'informant'}
+    parent = Folder().createFolder(user, 'Responses', parentType='user')
+    folder = Folder().createFolder(
+        parent, ' Applet ', reuseExisting=True, upsert=True)
+    assert (folder['name'], folder['lowerName'])==('Applet', 'applet')
+    again = Folder().createFolder(
+        parent, 'Applet', reuseExisting=True, upsert=True)
+    assert again['_id']==folder['_id']
+    Item().collection.insert_one({'folderId': parent['_id'], 'name': 'taken'})
+    with pytest.raises(ValidationException):
+        Folder().createFolder(parent, 'taken', reuseExisting=True, upsert=True)
+
+
+def testDeriveIdempotencyKey(mockDb):
+    from girderformindlogger.models.response_folder import ResponseItem
+    activity = {'_id': 'activity'}
+    metadata = {'responseStarted': 1581588000000, 'responseCompleted': 1581588060000}
+    key = ResponseItem().deriveIdempotencyKey(activity, metadata, 'subject1')
+    assert key==ResponseItem().deriveIdempotencyKey(activity, dict(metadata), 'subject1')
+    assert key!=ResponseItem().deriveIdempotencyKey(activity, metadata, 'subject2')
+    assert ResponseItem().deriveIdempotencyKey(activity, {}, 'subject1') is None
+
+
+def testExtendSkipsDeletedApplets(mockDb):
+    import datetime
+    from bson import ObjectId
+    from girderformindlogger.models.profile import Profile
+    from girderformindlogger.models.schedule_occurrence import \
+        ScheduleOccurrence
+    now = datetime.datetime(2020, 1, 1)
+    Profile().collection.insert_many([
+        {'profile': True, 'appletId': ObjectId(), 'userId': ObjectId()}
+        for i in range(3)
+    ])
+    assert ScheduleOccurrence().extend(now, limit=2)==2
+    assert ScheduleOccurrence().extend(now, limit=2)==1
+    assert ScheduleOccurrence().extend(now, limit=2)==0
+
+
+def testParseAfter(mockDb):
+    from bson import ObjectId
+    from girderformindlogger.models.schedule_occurrence import \
+        ScheduleOccurrence
+    _id = ObjectId()
+    afterTime, afterId = ScheduleOccurrence().parseAfter(
+        '1577836800000_%s' % _id)
+    assert (afterTime.year, afterId)==(2020, _id)
+    for after in ('1577836800000', 'x_%s' % _id, '1_x', '9' * 30 + '_%s' % _id):
+        with pytest.raises(ValueError):
+            ScheduleOccurrence().parseAfter(after)
+
+
+def testIdentityMapInvalidation(mockDb, monkeypatch):
+    from girderformindlogger.models.mail_outbox import MailOutbox
+    from girderformindlogger.models.setting import Setting
+    from girderformindlogger.utility._cache import identityMap
+    state = {'documents': {}, 'hits': 0, 'misses': 0}
+    monkeypatch.setattr(identityMap, '_state', lambda: state)
+    doc = Setting().save({'key': 'test.key', 'value': 1}, validate=False)
+    assert Setting().findOne({'_id': doc['_id']})['value']==1
+    assert Setting().findOne({'_id': doc['_id']})['value']==1
+    assert identityMap.stats()=={'hits': 1, 'misses': 1}
+    doc['value'] = 2
+    Setting().save(doc, validate=False)
+    assert Setting().findOne({'_id': doc['_id']})['value']==2
+    message = MailOutbox().collection.insert_one({'status': 'queued'})
+    message = MailOutbox().findOne({'_id': message.inserted_id})
+    MailOutbox().markSent(message)
+    assert MailOutbox().findOne({'_id': message['_id']})['status']=='sent'
+
+
+@pytest.mark.parametrize('names,rootType,folderType', [
+    (['Applets'], 'collection', 'applet'),
+    (['Applets'], 'user', 'applet'),
+    (['Applets', 'Applet'], 'user', 'activity'),
+    (['Applets', 'Applet', 'Activity'], 'user', 'activityVersion'),
+    (['Activities', 'Activity'], 'collection', 'activityVersion'),
+    (['Activities', 'Activity'], 'user', 'folder'),
+    (['Responses', 'Applets'], 'user', 'applet'),
+    (['Responses', 'Applet'], 'user', 'folder'),
+])
+def testGetFolderType(mockDb, names, rootType, folderType):
+    from girderformindlogger.models.folder import Folder
+    path = [{'type': rootType, 'object': {'name': names[0]}}] + [
+        {'type': 'folder', 'object': {'name': name}} for name in names[1:]
+    ]
+    assert Folder().getFolderType({'name': 'folder'}, path)==folderType
+
+
+@pytest.fixture
+def folderModels(monkeypatch):
+    # Register only the models that folders need, without the assetstore
+    # models that the other core models import.
+    from girderformindlogger.models import collection, folder, item, user
+    from girderformindlogger.utility import model_importer
+    monkeypatch.setattr(model_importer, '_coreModelsRegistered', True)
+    monkeypatch.setattr(model_importer, '_modelClasses', {})
+    for name, cls in [
+        ('collection', collection.Collection), ('folder', folder.Folder),
+        ('item', item.Item), ('user', user.User)
+    ]:
+        model_importer.ModelImporter.registerModel(name, cls)
+
+
+def testPathsFromRootCycle(mockDb, folderModels):
+    from bson import ObjectId
+    from girderformindlogger.models.folder import Folder
+    a, b = ObjectId(), ObjectId()
+    folders = [
+        {'_id': a, 'name': 'a', 'parentId': b, 'parentCollection': 'folder'},
+        {'_id': b, 'name': 'b', 'parentId': a, 'parentCollection': 'folder'}
+    ]
+    Folder().collection.insert_many(folders)
+    assert Folder()._pathsFromRoot(folders, {})=={a: None, b: None}
+
+
+def testMoveFolderType(mockDb, folderModels):
+    from bson import ObjectId
+    from girderformindlogger.models.collection import Collection
+    from girderformindlogger.models.folder import Folder
+    user = {'_id': ObjectId(), 'login': 'creator'}
+    applets = Collection().createCollection('Applets', user)
+    other = Collection().createCollection('Other', user)
+    applet = Folder().createFolder(other, 'Applet', parentType='collection')
+    activity = Folder().createFolder(applet, 'Activity')
+    version = Folder().createFolder(activity, 'Version')
+    assert Folder().load(version['_id'], force=True).get('folderType') is None
+    applet = Folder().move(applet, applets, 'collection')
+    assert applet['folderType']=='applet'
+    assert [
+        Folder().load(folder['_id'], force=True)['folderType']
+        for folder in (applet, activity, version)
+    ]==['applet', 'activity', 'activityVersion']
+
+
+def testMoveFolderAncestors(mockDb, folderModels):
+    from bson import ObjectId
+    from girderformindlogger.models.collection import Collection
+    from girderformindlogger.models.folder import Folder
+    from girderformindlogger.models.item import Item
+    user = {'_id': ObjectId(), 'login': 'creator'}
+    root = Collection().createCollection('Root', user)
+    a = Folder().createFolder(root, 'a', parentType='collection')
+    b = Folder().createFolder(a, 'b')
+    c = Folder().createFolder(b, 'c')
+    item = Item().createItem('item', user, c)
+    d = Folder().createFolder(root, 'd', parentType='collection')
+    assert Folder().subtreeCount(Folder().load(a['_id'], force=True))==4
+    Folder().move(b, d, 'folder')
+    assert [
+        parent['_id'] for parent in Folder().load(c['_id'], force=True)[
+            'ancestors']
+    ]==[root['_id'], d['_id'], b['_id']]
+    assert [
+        parent['_id'] for parent in Item().load(item['_id'], force=True)[
+            'ancestors']
+    ]==[root['_id'], d['_id'], b['_id'], c['_id']]
+    assert Folder().subtreeCount(Folder().load(a['_id'], force=True))==1
+    assert Folder().subtreeCount(Folder().load(d['_id'], force=True))==4
+    assert Folder().countFolders(Folder().load(d['_id'], force=True))==1
+    assert Folder().countItems(c)==1
+
+
+def testFixFolderBaseParents(mockDb, folderModels):
+    from bson import ObjectId
+    from girderformindlogger.models.collection import Collection
+    from girderformindlogger.models.folder import Folder
+    from girderformindlogger.models.system_check import SystemCheck
+
+    class Run(object):
+        def heartbeat(self):
+            pass
+
+    user = {'_id': ObjectId(), 'login': 'creator'}
+    root = Collection().createCollection('Root', user)
+    a = Folder().createFolder(root, 'a', parentType='collection')
+    b = Folder().createFolder(a, 'b')
+    c = Folder().createFolder(b, 'c')
+    Folder().collection.update_many({}, {'$set': {'baseParentId': ObjectId()}})
+    Folder().collection.update_one(
+        {'_id': c['_id']}, {'$unset': {'ancestors': True}})
+    assert SystemCheck()._fixFolderBaseParents(Run())==3
+    assert {
+        folder['baseParentId'] for folder in Folder().find()
+    }=={root['_id']}
+
+
+def testCreateGroups(mockDb):
+    from girderformindlogger.models.group import Group
+    from girderformindlogger.models.user import User
+    creator = {'login': 'creator', 'groups': []}
+    User().collection.insert_one(creator)
+    groups = Group().createGroups([{'name': 'a'}, {'name': 'b'}], creator)
+    ids = [group['_id'] for group in groups]
+    assert creator['groups']==ids
+    assert User().collection.find_one({'_id': creator['_id']})['groups']==ids
+    assert all(
+        group['access']['users'][0]['id']==creator['_id'] for group in groups
+    )
+
+
+def testInviteChunkPartialSave(mockDb, monkeypatch):
+    from bson import ObjectId
+    from girderformindlogger.models.applet import Applet
+    from girderformindlogger.models.invitation import Invitation
+    from girderformindlogger.models.profile import Profile
+    monkeypatch.setattr(Applet, 'isCoordinator', lambda *args: True)
+    monkeypatch.setattr(Profile, 'coordinatorProfile', lambda *args: None)
+    applet = {'_id': ObjectId()}
+    saveMany = Invitation.saveMany
+
+    def raceSaveMany(self, documents, **kwargs):
+        # Another request takes an ID code after it was checked.
+        monkeypatch.setattr(Invitation, 'saveMany', saveMany)
+        self.collection.insert_one({'appletId': applet['_id'], 'idCode': 'x'})
+        return saveMany(self, documents, **kwargs)
+
+    monkeypatch.setattr(Invitation, 'saveMany', raceSaveMany)
+    chunk = [{
+        'row': i, 'idCode': idCode, 'role': 'user', 'displayName': None,
+        'email': None
+    } for i, idCode in enumerate(['a', 'x', 'b', 'c'])]
+    results = list(Invitation()._inviteChunk(applet, {}, chunk, False))
+    assert [(r['row'], r['status']) for r in results]==[
+        (0, 'invited'), (1, 'error'), (2, 'invited'), (3, 'invited')
+    ]
+    assert Invitation().collection.count_documents({})==4
+
+
+def testMailOutboxClaim(mockDb):
+    import datetime
+    from girderformindlogger.models import mail_outbox
+    from girderformindlogger.models.mail_outbox import MailOutbox
+    now = datetime.datetime.utcnow()
+    timedOut = now - mail_outbox.SEND_TIMEOUT
+    MailOutbox().collection.insert_many([
+        {'status': 'sending', 'attempts': 1, 'nextAttempt': timedOut},
+        {'status': 'sending', 'attempts': mail_outbox.MAX_ATTEMPTS - 1,
+         'nextAttempt': timedOut},
+        {'status': 'queued', 'attempts': 0, 'nextAttempt': now}
+    ])
+    docs = list(MailOutbox().collection.find(sort=[('_id', 1)]))
+    assert MailOutbox().claim('a', [docs[2]['_id']])['_id']==docs[2]['_id']
+    assert MailOutbox().claim('a')['attempts']==2
+    assert MailOutbox().claim('a') is None
+    assert MailOutbox().collection.find_one(
+        {'_id': docs[1]['_id']})['status']=='failed'
+
+
+def testMailWorkerConnectionFailure(mockDb, monkeypatch):
+    import datetime
+    import smtplib
+    from girderformindlogger.models.mail_outbox import MailOutbox
+    from girderformindlogger.utility import mail_delivery
+
+    def refuseLogin(self):
+        raise smtplib.SMTPAuthenticationError(535, b'Bad credentials')
+
+    monkeypatch.setattr(mail_delivery.MailWorker, 'open', refuseLogin)
+    MailOutbox().collection.insert_many([{
+        'status': 'queued', 'attempts': 0, 'subject': 'Hi',
+        'nextAttempt': datetime.datetime.utcnow()
+    } for i in range(2)])
+    worker = mail_delivery.MailWorker(
+        'test', mail_delivery.RateLimiter(None), 10)
+    assert worker.deliver()==0
+    assert [(doc['status'], doc['attempts']) for doc in MailOutbox().find(
+        sort=[('_id', 1)])]==[('queued', 0), ('queued', 0)]
+
+
+def testForegroundMailDeliveryRetry(mockDb, monkeypatch):
+    import datetime
+    import smtplib
+    from girderformindlogger.models.mail_outbox import MailOutbox
+    from girderformindlogger.utility import mail_delivery
+    sent = []
+
+    class Connection(object):
+        def send(self, sender, recipients, message):
+            sent.append(message)
+            return {}
+
+        def close(self):
+            pass
+
+    def openOnce(self):
+        if not hasattr(openOnce, 'failed'):
+            openOnce.failed = True
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        self.connection = Connection()
+
+    def queue(message):
+        doc = {
+            'status': 'queued', 'attempts': 0, 'subject': 'Hi',
+            'from': 'a@example.com', 'recipients': ['b@example.com'],
+            'message': message, 'nextAttempt': datetime.datetime.utcnow()
+        }
+        MailOutbox().collection.insert_one(doc)
+        return doc
+
+    monkeypatch.setattr(mail_delivery.MailWorker, 'open', openOnce)
+    delivery = mail_delivery.ForegroundMailDelivery()
+    delivery.wake([queue('first')])
+    assert sent==[]
+    # Once the retry delay has passed, the next wake sends it too.
+    MailOutbox().collection.update_many({}, {'$set': {
+        'nextAttempt': datetime.datetime.utcnow()}})
+    delivery.wake([queue('second')])
+    assert sent==['second', 'first']
+    assert {doc['status'] for doc in MailOutbox().find()}=={'sent'}
+
+
+def testNotificationBrokerPoll(mockDb):
+    import datetime
+    from bson import ObjectId
+    from girderformindlogger.models.notification import Notification
+    from girderformindlogger.utility.notification_broker import \
+        NotificationBroker, Subscription
+    broker = NotificationBroker()
+    user = {'_id': ObjectId()}
+    subscription = Subscription(('userId', user['_id']))
+    broker._subscriptions[subscription.key] = {subscription}
+    now = datetime.datetime.utcnow()
+    broker._lastSeen = now
+    Notification().collection.insert_many([
+        {'userId': user['_id'], 'updated': now},
+        {'userId': ObjectId(), 'updated': now}
+    ])
+    broker.poll(Notification())
+    assert len(subscription.get(0))==1
+    broker.poll(Notification())
+    assert subscription.get(0)==[]
+    Notification().collection.update_many(
+        {}, {'$set': {'updated': now + datetime.timedelta(seconds=1)}})
+    broker.poll(Notification())
+    assert len(subscription.get(0))==1
+
+
+def testUpdateInvalidatesQueriedIds(mockDb):
+    from bson import ObjectId
+    from girderformindlogger.models.model_base import _queryIds
+    from girderformindlogger.models.user import User
+    from girderformindlogger.utility._cache import authCache
+    a, b = ObjectId(), ObjectId()
+    assert _queryIds({'_id': a})==[a]
+    assert _queryIds({'$and': [{'x': 1}, {'_id': {'$in': [a, b]}}]})==[a, b]
+    assert _queryIds({'_id': {'$ne': a}}) is None
+    assert _queryIds({'login': 'a'}) is None
+    authCache.clear()
+    for userId in (a, b):
+        authCache.setToken(str(userId), {'_id': str(userId), 'userId': userId})
+        authCache.setUser(str(userId), {'_id': userId})
+    User().update({'_id': a}, {'$set': {'x': 1}})
+    assert [authCache.getToken(str(id))[0] for id in (a, b)]==[False, True]
+    User().update({'login': 'b'}, {'$set': {'x': 1}})
+    assert authCache.getToken(str(b))[0] is False
+
+
+def testLoadResponse(mockDb):
+    import gzip
+    from bson import ObjectId
+    from girderformindlogger import events
+    from girderformindlogger.models.response_cache import ResponseCache
+    docId = ObjectId()
+    calls = []
+
+    def serialize():
+        calls.append(1)
+        return b'{"version": %d}' % len(calls)
+
+    load = lambda version, encoding: ResponseCache().loadResponse(
+        'folder', docId, version, encoding, serialize)
+    assert gzip.decompress(load('v1', 'gzip'))==b'{"version": 1}'
+    assert load('v1', 'identity')==b'{"version": 1}'
+    assert len(calls)==1
+    assert load('v2', 'identity')==b'{"version": 2}'
+    assert ResponseCache().collection.count_documents({})==2
+    events.trigger('model.folder.save.after', {
+        '_id': docId, 'meta': {'applet': {'deleted': True}}})
+    assert ResponseCache().collection.count_documents({})==0
+
+
+@pytest.fixture
+def auditLogs(mockDb, monkeypatch):
+    """
+    The audit_logs plugin, saving its records to mongomock without waiting
+    between attempts.
+    """
+    auditLogs = pytest.importorskip('girder_audit_logs')
+    monkeypatch.setattr(auditLogs, 'SAVE_RETRY_DELAY', 0)
+    yield auditLogs
+
+
+def stalledWriter(auditLogs, **kwargs):
+    """
+    A writer whose thread is running but never takes records from the queue.
+    """
+    import threading
+    writer = auditLogs.BufferedRecordWriter(**kwargs)
+    writer._thread = threading.Thread(target=writer._stopping.wait)
+    writer._thread.start()
+    return writer
+
+
+def testAuditLogBatches(auditLogs, monkeypatch):
+    collection = auditLogs.Record().collection
+    insertMany = collection.insert_many
+    batches = []
+
+    def recordBatch(docs, **kwargs):
+        batches.append(len(docs))
+        return insertMany(docs, **kwargs)
+
+    monkeypatch.setattr(collection, 'insert_many', recordBatch)
+    writer = stalledWriter(auditLogs, batchSize=2)
+    for i in range(5):
+        writer.put({'i': i})
+    assert writer.flush()==5
+    assert batches==[2, 2, 1]
+    writer.stop()
+    # Without a running thread, records are saved as they are put.
+    writer.put({'i': 5})
+    assert batches==[2, 2, 1, 1]
+    assert writer.queue.empty() and collection.count_documents({})==6
+
+
+def testAuditLogOverflow(auditLogs):
+    import threading
+    drop = stalledWriter(auditLogs, maxQueued=2, overflow='drop')
+    sample = stalledWriter(
+        auditLogs, maxQueued=4, overflow='sample', sampleRate=2)
+    block = stalledWriter(auditLogs, maxQueued=1)
+    for i in range(8):
+        drop.put({'i': i})
+        sample.put({'i': i})
+    assert (drop.queue.qsize(), drop.dropped)==(2, 6)
+    assert (sample.queue.qsize(), sample.dropped)==(4, 4)
+    assert block.overflow=='block'
+    block.put({'i': 0})
+    blocked = threading.Thread(target=block.put, args=({'i': 1},))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    assert block.flush()==1
+    blocked.join()
+    assert block.flush()==1 and block.dropped==0
+    for writer in (drop, sample, block):
+        writer.stop()
+
+
+def testAuditLogRetries(auditLogs, monkeypatch):
+    from pymongo.errors import AutoReconnect
+    collection = auditLogs.Record().collection
+    insertMany = collection.insert_many
+    attempts = []
+
+    def failFirst(docs, **kwargs):
+        attempts.append(len(docs))
+        if len(attempts) == 1:
+            # The connection was lost after some records were saved.
+            insertMany(docs[:3], **kwargs)
+            raise AutoReconnect('Connection lost')
+        return insertMany(docs, **kwargs)
+
+    monkeypatch.setattr(collection, 'insert_many', failFirst)
+    writer = stalledWriter(auditLogs)
+    for i in range(5):
+        writer.put({'_id': i})
+    assert writer.flush()==5 and writer.dropped==0
+    assert collection.count_documents({})==5
+
+    def fail(docs, **kwargs):
+        attempts.append(len(docs))
+        raise AutoReconnect('Connection refused')
+
+    monkeypatch.setattr(collection, 'insert_many', fail)
+    del attempts[:]
+    for i in range(5, 7):
+        writer.put({'_id': i})
+    assert writer._save([writer.queue.get(), writer.queue.get()])==0
+    assert attempts==[2] * auditLogs.SAVE_ATTEMPTS and writer.dropped==2
+    writer.stop()
+
+
+def testAuditLogFlushOnStop(auditLogs):
+    writer = stalledWriter(auditLogs)
+    for i in range(3):
+        writer.put({'i': i})
+    assert auditLogs.Record().collection.count_documents({})==0
+    writer.stop()
+    assert writer.queue.empty()
+    assert auditLogs.Record().collection.count_documents({})==3